@@ -27,6 +27,30 @@ QUERY_DEFINER_PROMPT = PromptTemplate(
     )
 )
 
+QUERY_BATCH_DEFINER_PROMPT = PromptTemplate(
+    input_variables=["subjects", "language", "top_k"],
+    template=(
+        "You are an OSINT research agent. "
+        "You receive as input a JSON list of companies or individuals "
+        "(e.g., 'OpenAI', 'Gabriele Scorpaniti'), each with an id, a name and "
+        "some context. For each of them, your task is to generate a list of "
+        "search queries, in the specified language and optimized for Serper "
+        "Api, tailored to the type of the input provided. Generate {top_k} "
+        "queries for each input.\n\n"
+        "Each query is one string ready to be used with Serper Api. Queries "
+        "should include Boolean operators, quotation marks for exact phrases,"
+        " and specific "
+        "keywords to increase precision. If the subject is a person, adapt the"
+        " categories accordingly. Use the context only if relevant.\n\n"
+        "Return ONLY the output as a pure JSON object mapping each input id "
+        "(as a string) to its JSON list of queries, without any markdown, "
+        "backticks, or code block. Do not include ```json or similar. "
+        "Output only the JSON object.\n\n"
+        "Language: {language}\n"
+        "Inputs: {subjects}"
+    )
+)
+
 VERIFIER_PROMPT = PromptTemplate(
     input_variables=["text_chunks", "language"],
     template=(
@@ -1,36 +1,84 @@
 
 import json
 import re
-from langchain_setup import llm
+from langchain_setup import get_llm, ainvoke_llm, astream_llm
+from prompt_packing import as_documents, chunk_budget, pack_chunks
+from prompt_packing import render_chunks
+from config import __SCORER_PROMPT_TOKENS__
 from .prompt_templates import SCORER_PROMPT
 
 
+def partial_details(content):
+    """
+    Extracts the (possibly incomplete) 'details' string from a partial JSON
+    scorer response.
+    Args:
+        content (str): Response text received so far.
+    Returns:
+        str: Decoded details text received so far, empty if not started.
+    """
+    match = re.search(r'"details"\s*:\s*"((?:[^"\\]|\\.)*)', content)
+    if not match:
+        return ""
+    raw = match.group(1)
+    # drop a trailing incomplete escape sequence
+    raw = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', "", raw)
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+
 class ScorerAgent:
     def __init__(self):
-        self.llm = llm
+        self.llm = get_llm()
 
-    async def run(self, verified_data_log, language):
+    async def run(self, verified_data_log, language, on_token=None,
+                  max_tokens=__SCORER_PROMPT_TOKENS__):
         """
         Computes a trust score (0-100) and explanatory details using the
         provided search results log.
         Requires Azure OpenAI environment variables as set in __init__.
+        The chunks of all attempts are packed into a prompt of at most
+        max_tokens tokens: each chunk once, best retrieval score first.
         Args:
-            verified_data_log: Dictionary containing 'searches' key with list
-            of search result texts.
+            verified_data_log: Dictionary containing 'searches' key with the
+            list of chunks (Documents or strings) of each attempt.
             language: the output language.
+            on_token: Optional async callback. If given, the response is
+            streamed and the callback receives each new piece of the
+            details text as it arrives.
+            max_tokens: Token budget of the prompt.
         Returns:
             Tuple (score: float, details: str) with the trust score and
             explanation.
         """
 
         prompt_template = SCORER_PROMPT
-        result = self.llm.invoke(
-            prompt_template.format(
-                verified_data_log=verified_data_log["searches"],
-                language=language
-            )
+        chunks = pack_chunks(
+            [
+                chunk for attempt in verified_data_log["searches"]
+                for chunk in as_documents(attempt)
+            ],
+            chunk_budget(prompt_template, max_tokens, language=language)
+        )
+        prompt = prompt_template.format(
+            verified_data_log=render_chunks(chunks),
+            language=language
         )
-        content = getattr(result, 'content', str(result))
+        if on_token is None:
+            # the score is cached with the analysis result (see main)
+            result = await ainvoke_llm(prompt, model=self.llm, cache=False)
+            content = getattr(result, 'content', str(result))
+        else:
+            content = ""
+            streamed = ""
+            async for chunk in astream_llm(prompt, model=self.llm):
+                content += getattr(chunk, 'content', str(chunk))
+                details = partial_details(content)
+                if len(details) > len(streamed):
+                    await on_token(details[len(streamed):])
+                    streamed = details
 
         # BUG: known parser error. Implementing serialization fallback chain
         try:
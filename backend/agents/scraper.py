@@ -1,22 +1,52 @@
 import re
+import time
 import logging
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 
-from langchain_setup import embeddings
-from config import __TOPK_RESULTS__, __API_TIMEOUT__
+from embedding_cache import cached_embeddings
+from retrieval import RetrievalSession
+from http_client import get_session
+from cache import page_cache, page_flights, normalize_url
+from metrics import pages, page_bytes
+from tracing import count
+from extraction import decode_html, extract_text_async, get_executor
+from text_cleaning import clean_sentences, dedup_key
+from url_scheduler import UrlScheduler, domain_of, domain_stats
+from dedup import (
+    PageStream, clean_page_sentences, deduplicate_pages, minhash_signatures
+)
+from config import __TOPK_RESULTS__, __API_TIMEOUT__, __SCRAPER_MAX_BYTES__
+from config import (
+    __PIPELINE_MIN_PAGES__, __PIPELINE_MIN_CHUNKS__, __PIPELINE_GRACE__
+)
+
+# Browser-like headers of the page downloads
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/115.0.0.0 Safari/537.36"
+    ),
+    "Accept": (
+        "text/html,application/xhtml+xml,application/xml;q=0.9,"
+        "image/webp,*/*;q=0.8"
+    ),
+    "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Referer": "https://www.google.com/",
+}
 
 
 class ScraperAgent:
     def __init__(self) -> None:
         """
         Initializes the ScraperAgent with embeddings for vector search.
+        Embeddings are cached by chunk content hash (see embedding_cache).
         """
-        self.embeddings = embeddings
+        self.embeddings = cached_embeddings
 
     def is_valid_url(self, url):
         """
@@ -35,9 +65,31 @@ class ScraperAgent:
             re.IGNORECASE
         )
 
+    async def read_capped(self, resp, max_bytes=__SCRAPER_MAX_BYTES__):
+        """
+        Reads a response body, stopping once max_bytes have been received.
+        Args:
+            resp (aiohttp.ClientResponse): Response to read.
+            max_bytes (int): Maximum number of bytes to read.
+        Returns:
+            str: Decoded body, possibly truncated.
+        """
+        body = bytearray()
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            body.extend(chunk)
+            if len(body) >= max_bytes:
+                logging.debug(f"Page truncated at {max_bytes} bytes.")
+                break
+        page_bytes.inc(len(body))
+        count("page_bytes", len(body))
+        # resp.get_encoding() cannot guess once the body was streamed
+        return decode_html(bytes(body[:max_bytes]), resp.charset)
+
     async def fetch_site(self, url, headers, timeout=__API_TIMEOUT__):
         """
         Asynchronously fetches the HTML content of a web page.
+        The download stops at __SCRAPER_MAX_BYTES__ and the text is extracted
+        in the extraction pool (see extraction), off the event loop.
         Args:
             url (str): The URL to fetch.
             headers (dict): HTTP headers to use.
@@ -45,32 +97,61 @@ class ScraperAgent:
             If None, uses __API_TIMEOUT__ from config.
         Returns:
             str | None: Extracted text or None if failed.
+            Extracted texts are cached by normalized URL in page_cache, and
+            concurrent fetches of the same page share one download.
         """
 
-        elements_to_filter = ['script', 'style', 'footer',
-                              'header', 'nav', 'aside', 'form', 'noscript']
-
         if timeout is None:
             timeout = __API_TIMEOUT__
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                logging.debug("ClientSession spawned.")
-                async with session.get(
-                    url, headers=headers, timeout=aiohttp.ClientTimeout(
-                        total=timeout
-                    )
-                ) as resp:
-                    html = await resp.text()
-                    soup = BeautifulSoup(html, "html.parser")
-                    for tag in elements_to_filter:
-                        for element in soup.find_all(tag):
-                            element.decompose()
-                    return soup.get_text(separator=" ", strip=True)
+        cache_key = normalize_url(url)
+        cached = await page_cache.get(cache_key)
+        if cached is not None:
+            logging.debug(f"Page cache hit: {url}")
+            pages.inc(1, "cached")
+            count("pages_cached")
+            return cached
+
+        return await page_flights.do(
+            cache_key,
+            lambda: self.download(url, cache_key, headers, timeout)
+        )
 
+    async def download(self, url, cache_key, headers, timeout):
+        """
+        Downloads a page and extracts its text, caching it on success.
+        The download time and outcome go to the domain's history (see
+        url_scheduler.DomainStats).
+        Returns:
+            str | None: Extracted text or None if failed.
+        """
+        start = time.monotonic()
+        try:
+            session = get_session()
+            async with session.get(
+                url, headers=headers, timeout=aiohttp.ClientTimeout(
+                    total=timeout
+                )
+            ) as resp:
+                html = await self.read_capped(resp)
+                text = await extract_text_async(html)
+                outcome = "ok" if resp.ok else "failed"
+                if resp.ok:
+                    await page_cache.set(cache_key, text)
+        except asyncio.CancelledError:
+            domain_stats.record_cancelled(
+                domain_of(url), time.monotonic() - start
+            )
+            raise
         except Exception as e:
             logging.warning(f"Skipping site: {e}")
-            return None
+            outcome, text = "failed", None
+        domain_stats.record(
+            domain_of(url), time.monotonic() - start, outcome == "failed"
+        )
+        pages.inc(1, outcome)
+        count(f"pages_{outcome}")
+        return text
 
     def clean_text_gen(self, text):
         """
@@ -81,23 +162,7 @@ class ScraperAgent:
             str: Cleaned sentence longer than 15 and shorter than 1024 chars.
         """
 
-        if not isinstance(text, str):
-            if isinstance(text, list):
-                text = " ".join(str(x) for x in text)
-            else:
-                text = str(text)
-
-        text = re.sub(r"\[\w+\]", "", text)
-        text = re.sub(r"([^\w\s]{2,}|_{2,}|-{2,})", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        sentences = re.split(r"(?<=[.!?])\s+", text)
-
-        for s in sentences:
-            cleaned = "".join(
-                c for c in s if 32 <= ord(c) <= 126 or c in "\n\r\t"
-            ).strip()
-            if 15 < len(cleaned) < 1024 and not cleaned.isdigit():
-                yield cleaned
+        yield from clean_sentences(text)
 
     async def limited_fetch(self,
                             url,
@@ -124,65 +189,284 @@ class ScraperAgent:
         search_results: list[str],
         user_query: str,
         top_k: int = __TOPK_RESULTS__,
-        n_jobs: int = 5
-    ) -> list[str]:
+        n_jobs: int = 5,
+        session: RetrievalSession | None = None,
+        on_page=None
+    ) -> list[Document]:
         """
         Extracts the most relevant text chunks for the user's query from web
-        pages using LangChain and AzureOpenAIEmbeddings.
+        pages using AzureOpenAIEmbeddings.
         Optimized for low RAM usage and parallel requests.
+        The pages to download are chosen by a UrlScheduler: duplicate links
+        are skipped, the queries' results are interleaved and each domain
+        gets a limited number of pages and concurrent downloads.
         Args:
-            search_results (list[str]): List of URLs to extract text from.
+            search_results (list[list[str]]): Links of each search query,
+            best ranked first (or a flat list of URLs).
             user_query (str): The user's query string.
-            top_k (int): Number of most similar chunks to return.
-            n_jobs (int): Number of maximum processes to spawn.
+            top_k (int): Maximum number of pages to download and number of
+            most similar chunks to return.
+            n_jobs (int): Maximum number of concurrent downloads.
+            session (RetrievalSession | None): Retrieval index of the current
+            analysis. URLs already scraped in the session are skipped, new
+            chunks are added to it and the query runs against all chunks
+            indexed so far. If None, a new session is used.
         Returns:
-            list[str]: List of relevant text chunks.
+            list[Document]: Relevant text chunks, closest first, with their
+            'source' URL and retrieval 'score' in the metadata.
         """
-        headers = {
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/115.0.0.0 Safari/537.36"
-            ),
-            "Accept": (
-                "text/html,application/xhtml+xml,application/xml;q=0.9,"
-                "image/webp,*/*;q=0.8"
-            ),
-            "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Referer": "https://www.google.com/",
-        }
+        headers = HEADERS
+        if session is None:
+            session = RetrievalSession(self.embeddings)
 
-        sem = asyncio.Semaphore(n_jobs)
-
-        links = []
+        scheduler = UrlScheduler(
+            top_k, seen=session.seen_urls, n_queries=len(search_results)
+        )
         for query_urls in search_results:
-            if isinstance(query_urls, list):
-                for url in query_urls:
-                    if self.is_valid_url(url):
-                        links.append(url)
-            else:
-                if self.is_valid_url(query_urls):
-                    links.append(query_urls)
-        links = links[:top_k]
-
-        tasks = [
-            self.limited_fetch(url, headers, sem, timeout=__API_TIMEOUT__)
-            for url in links
-        ]
-        texts = await asyncio.gather(*tasks)
-
-        docs = []
-        for text in texts:
-            if text:
-                for chunk in self.clean_text_gen(text):
-                    docs.append(Document(page_content=chunk))
-
-        if not docs:
+            if not isinstance(query_urls, list):
+                query_urls = [query_urls]
+            scheduler.add(
+                [url for url in query_urls if self.is_valid_url(url)]
+            )
+        scheduler.close()
+        fetched = []
+
+        async def fetch(url):
+            # pages are kept in the order the scheduler chose them
+            slot = len(fetched)
+            fetched.append((url, None))
+            text = await self.fetch_site(
+                url, headers, timeout=__API_TIMEOUT__
+            )
+            if on_page is not None:
+                await on_page(url, text)
+            fetched[slot] = (url, text)
+
+        await scheduler.run(fetch, n_jobs)
+        self._log_scheduling(scheduler)
+
+        # all pages cleaned in one call, off the event loop, without
+        # boilerplate and duplicate sentences; near-duplicates of chunks
+        # already in the session are dropped before embedding
+        result = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), deduplicate_pages, fetched
+        )
+        chunks = await asyncio.to_thread(
+            session.near_duplicates.filter,
+            list(zip(result.chunks, result.sources)), result.signatures
+        )
+        logging.info(
+            f"Chunks: {len(chunks)} of {result.counts['sentences']} sentences "
+            f"({result.counts['boilerplate']} boilerplate, "
+            f"{result.counts['duplicates']} duplicates, "
+            f"{len(result.chunks) - len(chunks)} near-duplicates)."
+        )
+
+        await session.add_texts(
+            [text for text, _ in chunks], [url for _, url in chunks]
+        )
+
+        if not len(session):
+            return []
+
+        return await session.search_documents(user_query, k=top_k)
+
+    async def run_pipeline(
+        self,
+        url_batches,
+        user_query: str,
+        top_k: int = __TOPK_RESULTS__,
+        n_jobs: int = 5,
+        session: RetrievalSession | None = None,
+        on_page=None,
+        on_urls=None,
+        n_queries: int | None = None,
+        min_pages: int = __PIPELINE_MIN_PAGES__,
+        min_chunks: int = __PIPELINE_MIN_CHUNKS__,
+        grace: float = __PIPELINE_GRACE__,
+        n_chunks: int | None = None,
+    ) -> list[Document]:
+        """
+        Streaming version of run: the links of each query start downloading
+        as soon as the query returns, and pages are cleaned, deduplicated
+        and indexed in batches as they arrive, while the next ones download.
+        Downloads are scheduled as in run, as the batches arrive.
+        Downloaded pages wait in a queue of n_jobs pages, so downloads pause
+        while indexing falls behind.
+        Once min_pages pages brought new chunks, the pipeline stops as soon
+        as min_chunks new chunks are indexed, or grace seconds later at the
+        latest: the searches and downloads still running are cancelled, so
+        slow sites do not hold the analysis up to __API_TIMEOUT__.
+        Args:
+            url_batches: Async generator of URL lists, e.g.
+            SearchAgent.stream_queries. It is closed when the pipeline ends.
+            user_query (str): The user's query string.
+            top_k (int): Maximum number of pages to download and number of
+            chunks to return.
+            n_jobs (int): Maximum number of concurrent downloads.
+            session (RetrievalSession | None): Retrieval index of the current
+            analysis (see run). If None, a new session is used.
+            on_page: Optional async callback receiving (url, text) of each
+            downloaded page, text None if it failed.
+            on_urls: Optional async callback receiving each URL batch.
+            n_queries (int | None): Number of URL batches expected: until
+            they all arrive, each batch gets an equal share of the top_k
+            downloads (see UrlScheduler).
+            min_pages (int): Pages with new chunks before an early cutoff.
+            min_chunks (int): New chunks that end the pipeline early.
+            grace (float): Seconds left to the other pages once min_pages
+            pages brought new chunks.
+            n_chunks (int | None): Number of chunks to return, if not top_k
+            (e.g. the Verifier's candidates).
+        Returns:
+            list[Document]: Relevant text chunks, closest first, with their
+            'source' URL and retrieval 'score' in the metadata.
+        """
+        if session is None:
+            session = RetrievalSession(self.embeddings)
+        loop = asyncio.get_running_loop()
+        scheduler = UrlScheduler(
+            top_k, seen=session.seen_urls, n_queries=n_queries
+        )
+        arrived = asyncio.Queue(maxsize=n_jobs)
+        stream = PageStream()
+        downloads = []
+
+        async def fetch(url):
+            # the download slot is held until the page is queued
+            downloads.append(asyncio.current_task())
+            text = await self.fetch_site(
+                url, HEADERS, timeout=__API_TIMEOUT__
+            )
+            if on_page is not None:
+                await on_page(url, text)
+            await arrived.put((url, text))
+
+        async def collect():
+            try:
+                async for urls in url_batches:
+                    if on_urls is not None:
+                        await on_urls(urls)
+                    scheduler.add(
+                        [url for url in urls if self.is_valid_url(url)]
+                    )
+            finally:
+                scheduler.close()
+                await url_batches.aclose()
+
+        async def feed():
+            collector = asyncio.create_task(collect())
+            try:
+                await scheduler.run(fetch, n_jobs)
+            finally:
+                # no download left to start: drop the searches still running
+                collector.cancel()
+                await asyncio.gather(collector, return_exceptions=True)
+            if not collector.cancelled() and collector.exception():
+                raise collector.exception()
+
+        def select(cleaned):
+            # boilerplate/exact dedup, signatures and near-duplicates of
+            # one batch, in a thread: stream and index are per request
+            chunks, sources = stream.add(cleaned)
+            return session.near_duplicates.filter(
+                list(zip(chunks, sources)), minhash_signatures(chunks)
+            )
+
+        feeder = asyncio.create_task(feed())
+        useful_pages = set()
+        added = 0
+        deadline = None
+        try:
+            while True:
+                timeout = (
+                    None if deadline is None
+                    else max(0.0, deadline - loop.time())
+                )
+                batch = await self._next_pages(arrived, feeder, timeout)
+                if not batch:
+                    break
+                cleaned = await loop.run_in_executor(
+                    get_executor(), clean_page_sentences, batch
+                )
+                chunks = await asyncio.to_thread(select, cleaned)
+                added += await session.add_texts(
+                    [text for text, _ in chunks], [url for _, url in chunks]
+                )
+                useful_pages.update(url for _, url in chunks)
+                if len(useful_pages) >= min_pages:
+                    if added >= min_chunks:
+                        break
+                    if deadline is None:
+                        deadline = loop.time() + grace
+        finally:
+            feeder.cancel()
+            stragglers = sum(not task.done() for task in downloads)
+            for task in downloads:
+                task.cancel()
+            await asyncio.gather(feeder, *downloads, return_exceptions=True)
+
+        self._log_scheduling(scheduler)
+        if stragglers:
+            logging.info(f"Early cutoff: {stragglers} downloads cancelled.")
+            pages.inc(stragglers, "cancelled")
+            count("pages_cancelled", stragglers)
+        logging.info(
+            f"Chunks: {added} from {stream.pages} pages "
+            f"({stream.counts['sentences']} sentences, "
+            f"{stream.counts['boilerplate']} boilerplate, "
+            f"{stream.counts['duplicates']} duplicates)."
+        )
+
+        if not len(session):
             return []
 
-        vectorstore = FAISS.from_documents(docs, self.embeddings)
-        results = vectorstore.similarity_search(user_query, k=top_k)
-        relevant_chunks = [doc.page_content for doc in results]
-        return relevant_chunks
+        # boilerplate is known once every page is counted: its chunks stay
+        # out of the evidence, whichever batch they were indexed with
+        boilerplate = stream.boilerplate()
+        n_chunks = n_chunks or top_k
+        documents = await session.search_documents(
+            user_query, k=n_chunks + len(boilerplate)
+        )
+        return [
+            document for document in documents
+            if dedup_key(document.page_content) not in boilerplate
+        ][:n_chunks]
+
+    @staticmethod
+    def _log_scheduling(scheduler: UrlScheduler) -> None:
+        counters = scheduler.counters
+        logging.info(
+            f"Links: {counters['started']} downloaded of {counters['links']}"
+            f" ({counters['duplicates']} duplicates, "
+            f"{counters['over_quota']} over a domain quota)."
+        )
+        count("links_duplicate", counters["duplicates"])
+        count("links_over_quota", counters["over_quota"])
+
+    @staticmethod
+    async def _next_pages(arrived, feeder, timeout):
+        """
+        Waits for downloaded pages.
+        Returns:
+            list[tuple[str, str | None]]: (url, text) of the pages arrived,
+            empty once every download is done or on timeout.
+        Raises:
+            Exception: The feeder's error, if it failed.
+        """
+        batch = []
+        if arrived.empty() and not feeder.done():
+            getter = asyncio.ensure_future(arrived.get())
+            await asyncio.wait(
+                {getter, feeder}, timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter.done():
+                batch.append(getter.result())
+            else:
+                getter.cancel()
+        while not arrived.empty():
+            batch.append(arrived.get_nowait())
+        if not batch and feeder.done():
+            feeder.result()
+        return batch
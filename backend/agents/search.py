@@ -5,28 +5,50 @@ Search Agents: enhances and gets search results from user query.
 
 import logging
 import json
+import asyncio
 
-from langchain_setup import llm
-from langchain_setup import google_search
+from langchain_setup import get_llm, ainvoke_llm
+from langchain_setup import get_google_search, search_endpoint
 from .prompt_templates import QUERY_DEFINER_PROMPT
-from config import __N_QUERIES__
+from .prompt_templates import QUERY_BATCH_DEFINER_PROMPT
+from budget import charge
+import http_client
+from tracing import span
+from config import (
+    __N_QUERIES__, __SEARCH_CONCURRENCY__, __SEARCH_TIMEOUT__,
+    __BATCH_QUERY_GROUP_SIZE__
+)
 
 
 class SearchAgent:
     def __init__(self):
-        self.google_search = google_search
-        self.llm = llm
-
-    def define_queries(self, name, context, language="en-US") -> list[str]:
+        self.google_search = get_google_search()
+        self.llm = get_llm()
 
+    async def define_queries(
+        self, name, context, language="en-US", cache=True
+    ) -> list[str]:
+        """
+        Generates the search queries of a subject.
+        Args:
+            name (str): Subject name.
+            context (str): Subject context.
+            language (str): Queries language.
+            cache (bool): Whether the completion may come from llm_cache
+              (False to get new queries, e.g. on a retry).
+        Returns:
+            list[str]: The queries, empty if the reply is not JSON.
+        """
         prompt_template = QUERY_DEFINER_PROMPT
-        response = self.llm.invoke(
+        response = await ainvoke_llm(
             prompt_template.format(
                 name=name,
                 context=context,
                 language=language,
                 top_k=__N_QUERIES__
-            )
+            ),
+            model=self.llm,
+            cache=cache
         )
 
         response_content = getattr(
@@ -44,26 +66,164 @@ class SearchAgent:
             print(f"Parsing error JSON define_queries: {e}")
             return []
 
-    async def run(
-        self, subject: str, context: str, language: str
-    ) -> list[str]:
+    async def define_queries_batch(
+        self, subjects: list[tuple[str, str]], language="en-US",
+        group_size: int = __BATCH_QUERY_GROUP_SIZE__
+    ) -> list[list[str]]:
+        """
+        Generates the search queries of many subjects with one prompt for
+        each group of group_size subjects, run concurrently.
+        Args:
+            subjects (list[tuple[str, str]]): (name, context) pairs.
+            language (str): Queries language.
+            group_size (int): Subjects per prompt.
+        Returns:
+            list[list[str]]: Queries of each subject, in input order. Empty
+            for the subjects the model did not answer for.
+        """
+        queries = [[] for _ in subjects]
 
-        links = []
-        queries = self.define_queries(subject, context, language)
-        logging.debug(f"define_queries: queries generate: {queries}")
+        async def define_group(start):
+            group = [
+                {"id": str(i), "name": name, "context": context}
+                for i, (name, context) in enumerate(
+                    subjects[start:start + group_size], start=start
+                )
+            ]
+            try:
+                response = await ainvoke_llm(
+                    QUERY_BATCH_DEFINER_PROMPT.format(
+                        subjects=json.dumps(group, ensure_ascii=False),
+                        language=language,
+                        top_k=__N_QUERIES__
+                    ),
+                    model=self.llm
+                )
+                content = getattr(response, 'content', str(response))
+                answers = json.loads(content.strip())
+            except Exception as e:
+                logging.warning(f"define_queries_batch: group failed: {e}")
+                return
+            if not isinstance(answers, dict):
+                return
+            for item in group:
+                answer = answers.get(item["id"])
+                if isinstance(answer, list):
+                    queries[int(item["id"])] = [str(q) for q in answer]
+
+        await asyncio.gather(*[
+            define_group(start)
+            for start in range(0, len(subjects), group_size)
+        ])
+        return queries
+
+    async def search(self, query, semaphore, timeout=__SEARCH_TIMEOUT__):
+        """
+        Runs a single Serper query without blocking the event loop, rate
+        limited and retried by search_endpoint.
+        Args:
+            query (str): Search engine query.
+            semaphore (asyncio.Semaphore): Bounds concurrent Serper calls.
+            timeout (int): Timeout in seconds for each attempt.
+        Returns:
+            list[str]: Organic result links, empty if the query failed or
+            the request has no searches left.
+        """
+        # the worker's pooled session, reopened if the app restarted
+        self.google_search.aiosession = http_client.get_session()
+
+        async def attempt():
+            return await asyncio.wait_for(
+                self.google_search.aresults(query), timeout=timeout
+            )
 
-        for query in queries:
+        async with semaphore:
             logging.info(f"Search query: {query}")
-            search_result = self.google_search.results(query)
+            try:
+                charge("searches")
+                search_result = await search_endpoint.call(attempt)
+            except Exception as e:
+                logging.warning(f"Skipping query {query!r}: {e!r}")
+                return []
 
-            organic = search_result.get("organic", [])
+        organic = search_result.get("organic", [])
 
-            query_links = [
-                item["link"]
-                for item in organic
-                if "link" in item
-            ]
-            if query_links:
-                links.append(query_links)
+        return [
+            item["link"]
+            for item in organic
+            if "link" in item
+        ]
+
+    async def run(
+        self, subject: str, context: str, language: str,
+        n_jobs: int = __SEARCH_CONCURRENCY__
+    ) -> list[list[str]]:
+        """
+        Generates the search queries and runs them concurrently.
+        Args:
+            subject (str): Person or company name.
+            context (str): Search context.
+            language (str): Queries language.
+            n_jobs (int): Maximum number of concurrent Serper queries.
+        Returns:
+            list[list[str]]: Result links grouped by query, in query order.
+            Queries that failed or returned no links are omitted.
+        """
+        queries = await self.define_queries(subject, context, language)
+        logging.debug(f"define_queries: queries generate: {queries}")
+
+        return await self.run_queries(queries, n_jobs)
+
+    async def run_queries(
+        self, queries: list[str], n_jobs: int = __SEARCH_CONCURRENCY__
+    ) -> list[list[str]]:
+        """
+        Runs the given queries concurrently, without query generation.
+        Args:
+            queries (list[str]): Search engine queries.
+            n_jobs (int): Maximum number of concurrent Serper queries.
+        Returns:
+            list[list[str]]: Result links grouped by query, in query order.
+        """
+        sem = asyncio.Semaphore(n_jobs)
+        results = await asyncio.gather(*[
+            self.search(query, sem) for query in queries
+        ])
 
-        return links
+        return [query_links for query_links in results if query_links]
+
+    async def stream_queries(
+        self, queries: list[str], n_jobs: int = __SEARCH_CONCURRENCY__
+    ):
+        """
+        Runs the given queries concurrently, yielding the links of each
+        query as soon as it returns (see ScraperAgent.run_pipeline).
+        Closing the generator cancels the queries still running.
+        Args:
+            queries (list[str]): Search engine queries.
+            n_jobs (int): Maximum number of concurrent Serper queries.
+        Yields:
+            list[str]: Result links of a query, in completion order.
+            Queries that failed or returned no links are skipped.
+        """
+        sem = asyncio.Semaphore(n_jobs)
+        # at most one item per query, then None
+        results = asyncio.Queue()
+
+        async def search(query):
+            results.put_nowait(await self.search(query, sem))
+
+        async def search_all():
+            try:
+                with span("search"):
+                    await asyncio.gather(*[search(q) for q in queries])
+            finally:
+                results.put_nowait(None)
+
+        task = asyncio.create_task(search_all())
+        try:
+            while (query_links := await results.get()) is not None:
+                if query_links:
+                    yield query_links
+        finally:
+            task.cancel()
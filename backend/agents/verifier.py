@@ -1,58 +1,156 @@
-
 """
 Verifier agent: validates scraper text chunks and provides feedback
 """
 import json
+import asyncio
 
-from langchain_setup import llm
+from langchain_setup import get_llm, ainvoke_llm
+from prompt_packing import as_documents, chunk_budget, pack_chunks
+from prompt_packing import chunk_cost, render_chunks, shard_chunks
+from tracing import count
+from url_scheduler import domain_of
+from config import (
+    __VERIFIER_PROMPT_TOKENS__,
+    __VERIFIER_PROMPT_CHUNKS__,
+    __VERIFIER_MAX_SHARDS__,
+    __VERIFIER_CONCURRENCY__,
+)
 from .prompt_templates import VERIFIER_PROMPT
 
 
 class VerifierAgent():
 
     def __init__(self):
-        self.llm = llm
+        self.llm = get_llm()
 
-    async def run(self, text_chunks, language):
+    async def run(self, text_chunks, language,
+                  max_tokens=__VERIFIER_PROMPT_TOKENS__,
+                  max_chunks=__VERIFIER_PROMPT_CHUNKS__,
+                  max_shards=__VERIFIER_MAX_SHARDS__,
+                  concurrency=__VERIFIER_CONCURRENCY__):
         """
         Verifies the consistency and reliability of the provided information
           chunks using AzureChatOpenAI.
         Requires Azure OpenAI environment variables as set in __init__.
+        The chunks are packed into a prompt of at most max_tokens tokens
+        and max_chunks chunks, best retrieval score first (see
+        prompt_packing). When they do not fit in one prompt, they are split
+        by source domain into up to max_shards prompts (map), verified
+        concurrently, and the verdicts merged (reduce, see merge_verdicts).
         Args:
-            text_chunks: List of strings, each representing extracted
-              information from different sources.
+            text_chunks: List of Documents (or strings), each representing
+              extracted information from different sources.
             language: the output language
+            max_tokens: Token budget of each prompt.
+            max_chunks: Maximum number of chunks of each prompt.
+            max_shards: Maximum number of prompts (1: a single prompt).
+            concurrency: Maximum number of prompts verified at a time.
         Returns:
             Dictionary with keys:
                 - 'verified': 'OK' if all information is consistent, otherwise
                   a JSON string with reasons and suggested retry query.
-                - 'data': the input texts.
+                - 'data': the chunks included in the prompts (Documents).
                 - 'error_details': parsed error details or 'NO'.
         """
 
-        if not isinstance(text_chunks, list):
-            text_chunks = [str(text_chunks)]
-        texts = [str(x) for x in text_chunks if x]
-
         prompt_template = VERIFIER_PROMPT
 
-        result = self.llm.invoke(
-            prompt_template.format(
-                text_chunks=texts,
-                language=language)
-        )
-        content = getattr(result, 'content', str(result))
-
-        if content != "OK":
-            try:
-                error_details = json.loads(content)
-            except Exception:
-                error_details = content
+        budget = chunk_budget(prompt_template, max_tokens, language=language)
+        max_shards = max(1, max_shards)
+        chunks = pack_chunks(
+            as_documents(text_chunks), budget * max_shards
+        )[:max_chunks * max_shards]
+        if (len(chunks) <= max_chunks
+                and sum(chunk_cost(chunk) for chunk in chunks) <= budget):
+            shards = [chunks]
+        else:
+            shards = shard_chunks(
+                chunks, budget, max_shards,
+                key=lambda chunk: domain_of(chunk.metadata.get("source", "")),
+                max_chunks=max_chunks
+            )
+            # chunks the shards could not hold are not shown to the LLM
+            kept = {id(chunk) for shard in shards for chunk in shard}
+            chunks = [chunk for chunk in chunks if id(chunk) in kept]
+        count("verifier_shards", len(shards))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def verify(shard):
+            async with semaphore:
+                result = await ainvoke_llm(
+                    prompt_template.format(
+                        text_chunks=render_chunks(shard),
+                        language=language),
+                    model=self.llm
+                )
+            return getattr(result, 'content', str(result))
+
+        tasks = [asyncio.ensure_future(verify(shard)) for shard in shards]
+        try:
+            contents = await asyncio.gather(*tasks)
+        finally:
+            # a failed shard fails the verification: stop the others
+            for task in tasks:
+                task.cancel()
+
+        if len(contents) == 1:
+            content = contents[0]
+            error_details = parse_verdict(content)
         else:
-            error_details = "NO"
+            content, error_details = merge_verdicts(contents)
 
         return {
             "verified": content,
-            "data": texts,
+            "data": chunks,
             "error_details": error_details,
         }
+
+
+def parse_verdict(content: str):
+    """
+    Error details of a Verifier reply.
+    Returns:
+        'NO' if the reply is 'OK', otherwise the parsed JSON or the reply.
+    """
+    if content == "OK":
+        return "NO"
+    try:
+        return json.loads(content)
+    except Exception:
+        return content
+
+
+def merge_verdicts(contents: list[str]) -> tuple[str, dict | str]:
+    """
+    Reduces the replies of the Verifier shards into one verdict: 'OK' if
+    every shard is consistent, otherwise the contradictions of all shards
+    (each once) and the suggested_retry of the shard with the most.
+    Args:
+        contents (list[str]): Reply of each shard, the best evidence first.
+    Returns:
+        tuple: The merged reply ('OK' or a JSON string) and its error
+        details (see parse_verdict).
+    """
+    consistent = True
+    whys = []
+    retry, most = None, 0
+    for content in contents:
+        details = parse_verdict(content)
+        if details == "NO":
+            continue
+        consistent = False
+        if not isinstance(details, dict):
+            details = {"whys": [str(details)]}
+        shard_whys = details.get("whys") or []
+        if not isinstance(shard_whys, list):
+            shard_whys = [shard_whys]
+        for why in shard_whys:
+            if why not in whys:
+                whys.append(why)
+        if details.get("suggested_retry") and (
+                retry is None or len(shard_whys) > most):
+            retry, most = details["suggested_retry"], len(shard_whys)
+    if consistent:
+        return "OK", "NO"
+    error_details = {"whys": whys, "suggested_retry": retry}
+    return json.dumps(error_details, ensure_ascii=False), error_details
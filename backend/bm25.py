@@ -0,0 +1,95 @@
+
+"""
+BM25 keyword retrieval over an incremental in-memory inverted index.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+_TOKENS = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercased word tokens of a text.
+    """
+    return _TOKENS.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 scorer. Documents are identified by their insertion order and
+    can be added at any time; statistics are always up to date.
+    Attributes:
+        k1: Term frequency saturation.
+        b: Document length normalization.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[int, int]] = defaultdict(dict)
+        self._lengths: list[int] = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: list[str]) -> None:
+        """
+        Indexes texts, with ids following the ones already indexed.
+        """
+        for text in texts:
+            doc_id = len(self._lengths)
+            tokens = tokenize(text)
+            for term, tf in Counter(tokens).items():
+                self._postings[term][doc_id] = tf
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """
+        Returns the k best matching documents.
+        Args:
+            query (str): Query text.
+            k (int): Number of documents to return.
+        Returns:
+            list[tuple[int, float]]: (id, score) pairs, best first. Documents
+            sharing no term with the query are not returned.
+        """
+        n = len(self._lengths)
+        if not n or k <= 0:
+            return []
+        avg_length = self._total_length / n or 1
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) /
+                           (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[doc_id] / avg_length
+                )
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[int]], k: int = 60
+) -> list[tuple[int, float]]:
+    """
+    Fuses rankings of the same documents: each document scores
+    sum(1 / (k + rank)) over the rankings it appears in.
+    Args:
+        rankings (list[list[int]]): Document ids, best first, per ranking.
+        k (int): Rank smoothing constant.
+    Returns:
+        list[tuple[int, float]]: (id, fused score) pairs, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
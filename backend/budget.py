@@ -0,0 +1,110 @@
+
+"""
+Request budget: caps the wall time and upstream calls of one analysis.
+"""
+import time
+import asyncio
+from contextvars import ContextVar
+
+from config import (
+    __REQUEST_TIME_BUDGET__,
+    __REQUEST_MAX_LLM_CALLS__,
+    __REQUEST_MAX_SEARCHES__,
+)
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a stage cannot complete within the request budget.
+    """
+
+
+class RequestBudget:
+    """
+    Tracks the elapsed time and the upstream calls charged by the agents
+    during one analysis.
+    Attributes:
+        started_at: Monotonic start time.
+        limits: Maximum number of calls for each kind.
+        counters: Calls charged so far for each kind.
+    """
+
+    def __init__(
+        self,
+        seconds: float = __REQUEST_TIME_BUDGET__,
+        max_llm_calls: int = __REQUEST_MAX_LLM_CALLS__,
+        max_searches: int = __REQUEST_MAX_SEARCHES__,
+    ):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.limits = {"llm_calls": max_llm_calls, "searches": max_searches}
+        self.counters = {"llm_calls": 0, "searches": 0}
+
+    def charge(self, kind: str, amount: int = 1) -> None:
+        """
+        Counts calls of one kind against their limit.
+        Raises:
+            BudgetExceeded: if the calls would exceed the limit (they are
+            not counted).
+        """
+        used = self.counters.get(kind, 0) + amount
+        limit = self.limits.get(kind)
+        if limit is not None and used > limit:
+            raise BudgetExceeded(f"limit of {limit} {kind} reached")
+        self.counters[kind] = used
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining(self) -> float:
+        return max(0.0, self.seconds - self.elapsed())
+
+    def exhausted(self, reserve: float = 0.0) -> bool:
+        """
+        True when the time budget is spent or any call limit is reached.
+        Args:
+            reserve (float): Seconds to keep back, counted as spent.
+        """
+        return self.remaining() <= reserve or any(
+            self.counters.get(kind, 0) >= limit
+            for kind, limit in self.limits.items()
+        )
+
+    async def limit(self, coro, reserve: float = 0.0):
+        """
+        Awaits a coroutine, cancelling it when the time budget runs out.
+        Args:
+            coro: Coroutine to await.
+            reserve (float): Seconds of the budget kept back for later
+            stages, in which the coroutine is cancelled.
+        Raises:
+            BudgetExceeded: if the budget ran out first. The timeouts of
+            the coroutine itself propagate unchanged.
+        """
+        timeout = max(0.0, self.remaining() - reserve)
+        try:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            if self.remaining() > reserve:
+                # the coroutine's own timeout, with budget left
+                raise
+            raise BudgetExceeded(
+                f"time budget of {self.seconds}s exceeded"
+            ) from None
+
+
+# Budget of the analysis running in the current task, if any
+current_budget: ContextVar[RequestBudget | None] = ContextVar(
+    "current_budget", default=None
+)
+
+
+def charge(kind: str, amount: int = 1) -> None:
+    """
+    Charges the budget of the current analysis, if one is active.
+    Raises:
+        BudgetExceeded: if the analysis reached its limit of calls.
+    """
+    budget = current_budget.get()
+    if budget is not None:
+        budget.charge(kind, amount)
@@ -0,0 +1,263 @@
+
+"""
+Caching utilities: size-bounded LRU caches with TTL, in-process and in the
+shared state store (see state).
+"""
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from state import MemoryStore, create_store
+from config import (
+    __STATE_BACKEND__,
+    __PAGE_CACHE_TTL__,
+    __PAGE_CACHE_MAX_BYTES__,
+    __PAGE_CACHE_DISK_MAX_BYTES__,
+    __RESULT_CACHE_TTL__,
+    __RESULT_CACHE_MAX_BYTES__,
+    __LLM_CACHE_TTL__,
+    __LLM_CACHE_MAX_BYTES__,
+)
+
+
+# Query parameters that only track the visit (campaigns, click IDs)
+_TRACKING_PARAMS = {
+    "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "igshid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi", "mkt_tok",
+    "srsltid", "ref_src",
+}
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param in _TRACKING_PARAMS or param.startswith("utm_")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that equivalent addresses share a cache key.
+    Lowercases scheme and host, drops default ports, fragments, trailing
+    slashes and tracking parameters, and sorts query parameters.
+    Args:
+        url (str): URL to normalize.
+    Returns:
+        str: Normalized URL.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (
+        ("http", 80), ("https", 443)
+    ):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(name)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def analysis_key(subject: str, context: str, language: str) -> str:
+    """
+    Hash of the normalized analysis inputs: case and whitespace
+    differences do not produce distinct keys.
+    """
+    normalized = [
+        " ".join(str(value).lower().split())
+        for value in (subject, context, language)
+    ]
+    return hashlib.sha256(
+        "\x00".join(normalized).encode("utf-8")
+    ).hexdigest()
+
+
+def completion_key(prompt: str, model: str, temperature) -> str:
+    """
+    Hash of an LLM call: the rendered prompt (its template and variables),
+    the model deployment and the sampling temperature.
+    """
+    return hashlib.sha256(
+        f"{model}\x00{temperature}\x00{prompt}".encode("utf-8")
+    ).hexdigest()
+
+
+class TieredCache:
+    """
+    Two-tier cache: an in-process MemoryStore in front of an optional shared
+    store (SQLite or Redis, see state) used by all workers and surviving
+    their restarts. Shared hits are promoted to memory.
+    Attributes:
+        name: Cache name, used in logs and stats.
+        memory: In-process tier.
+        shared: Shared tier, or None if disabled.
+        counters: Hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        ttl: float,
+        shared=None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryStore(max_bytes)
+        self.shared = shared
+        self.counters = {
+            "memory_hits": 0, "shared_hits": 0, "misses": 0, "sets": 0
+        }
+
+    async def get(self, key: str) -> str | None:
+        """
+        Looks up a key in memory, then in the shared tier.
+        Args:
+            key (str): Cache key.
+        Returns:
+            str | None: Cached value or None on miss.
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            self.counters["memory_hits"] += 1
+            return data.decode("utf-8")
+        if self.shared is not None:
+            try:
+                data = await asyncio.to_thread(self.shared.get, key)
+            except Exception as e:
+                logging.warning(f"{self.name} cache: shared read failed: {e}")
+                data = None
+            if data is not None:
+                value = data.decode("utf-8")
+                self.counters["shared_hits"] += 1
+                self.memory.set(key, data, self.ttl)
+                return value
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        Stores a value in every tier.
+        Args:
+            key (str): Cache key.
+            value (str): Value to cache.
+        """
+        self.counters["sets"] += 1
+        data = value.encode("utf-8")
+        self.memory.set(key, data, self.ttl)
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.set, key, data, self.ttl)
+            except Exception as e:
+                logging.warning(f"{self.name} cache: shared write failed: {e}")
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and tier sizes.
+        """
+        hits = self.counters["memory_hits"] + self.counters["shared_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "shared_backend": getattr(self.shared, "backend", None),
+        }
+
+
+def shared_tier(namespace: str, max_bytes: int | None = None):
+    """
+    Creates the shared tier of a cache with the configured state backend,
+    or returns None with the 'memory' backend (the in-process tier already
+    covers it) or if the backend cannot be opened.
+    """
+    if __STATE_BACKEND__ == "memory":
+        return None
+    try:
+        return create_store(namespace, max_bytes)
+    except Exception as e:
+        logging.warning(f"{namespace} cache: shared tier disabled: {e}")
+        return None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution: later
+    callers await the result of the call already in flight.
+    Attributes:
+        coalesced: Number of calls served by an execution in flight.
+        cancel_orphans: If True, an execution is cancelled once all its
+        callers are cancelled; otherwise it runs to completion.
+    """
+
+    def __init__(self, cancel_orphans: bool = False):
+        self._flights: dict[str, asyncio.Task] = {}
+        self._callers: dict[str, int] = {}
+        self.coalesced = 0
+        self.cancel_orphans = cancel_orphans
+
+    async def do(self, key: str, fn):
+        """
+        Runs fn() for key, or joins the execution already running for it.
+        A cancelled caller does not cancel the shared execution, unless
+        cancel_orphans is set and no other caller is waiting for it.
+        Args:
+            key (str): Coalescing key.
+            fn: Callable returning a coroutine.
+        Returns:
+            The result of fn().
+        """
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.coalesced += 1
+        self._callers[key] = self._callers.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if (self.cancel_orphans and self._callers[key] == 1
+                    and not task.done()):
+                task.cancel()
+            raise
+        finally:
+            self._callers[key] -= 1
+            if not self._callers[key]:
+                del self._callers[key]
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+
+# Cache of extracted page texts, keyed by normalized URL
+page_cache = TieredCache(
+    "pages",
+    max_bytes=__PAGE_CACHE_MAX_BYTES__,
+    ttl=__PAGE_CACHE_TTL__,
+    shared=shared_tier("pages", __PAGE_CACHE_DISK_MAX_BYTES__),
+)
+
+# Concurrent downloads of the same page (e.g. by the analyses of a batch),
+# cancelled when every analysis waiting for them stopped (early cutoff)
+page_flights = SingleFlight(cancel_orphans=True)
+
+# Cache of analysis results, keyed by version and analysis_key
+result_cache = TieredCache(
+    "results",
+    max_bytes=__RESULT_CACHE_MAX_BYTES__,
+    ttl=__RESULT_CACHE_TTL__,
+    shared=shared_tier("results", __RESULT_CACHE_MAX_BYTES__),
+)
+
+# Cache of LLM completions, keyed by completion_key
+llm_cache = TieredCache(
+    "llm",
+    max_bytes=__LLM_CACHE_MAX_BYTES__,
+    ttl=__LLM_CACHE_TTL__,
+    shared=shared_tier("llm", __LLM_CACHE_MAX_BYTES__),
+)
@@ -1,3 +1,4 @@
+import os
 import logging
 
 __VERSION__ = "0.5.5"
@@ -6,3 +7,109 @@ __N_QUERIES__ = 5
 __API_TIMEOUT__ = 30
 __DEBUG_LEVEL__ = logging.INFO
 __N_VALIDATION_RETRIES__ = 10
+__LLM_CONCURRENCY__ = 8
+__SEARCH_CONCURRENCY__ = 5
+__SEARCH_TIMEOUT__ = 10
+__HTTP_POOL_LIMIT__ = 100
+__HTTP_POOL_LIMIT_PER_HOST__ = 8
+__HTTP_DNS_TTL__ = 300
+__HTTP_KEEPALIVE_TIMEOUT__ = 30
+__CACHE_DIR__ = os.getenv("TRUSTME_CACHE_DIR")  # None: memory-only caches
+__PAGE_CACHE_TTL__ = 6 * 3600
+__PAGE_CACHE_MAX_BYTES__ = 64 * 1024 * 1024
+__PAGE_CACHE_DISK_MAX_BYTES__ = 512 * 1024 * 1024
+__EMBEDDING_CACHE_MAX_ITEMS__ = 20_000
+__EMBEDDING_CACHE_DISK_ITEMS__ = 100_000
+__RETRIEVAL_INDEX__ = "auto"  # auto, flat, hnsw or ivf
+__RETRIEVAL_ANN_THRESHOLD__ = 5000
+__RETRIEVAL_HNSW_M__ = 32
+__REQUEST_TIME_BUDGET__ = 90  # seconds, below gunicorn's timeout
+__REQUEST_MAX_LLM_CALLS__ = 15
+__REQUEST_MAX_SEARCHES__ = 30
+__SCORER_TIME_RESERVE__ = 15  # seconds of the budget kept for the scoring
+# an upstream deadline this close to the end of the budget is the budget's
+__REQUEST_DEADLINE_SLACK__ = 1  # seconds
+# sqlite: jobs shared by all workers and kept across restarts; memory: per
+# worker (a single process only)
+__JOB_BACKEND__ = os.getenv("TRUSTME_JOB_BACKEND", "sqlite")
+__JOB_DIR__ = os.getenv("TRUSTME_JOB_DIR") or __CACHE_DIR__ or ".trustme"
+__JOB_CONCURRENCY__ = 4  # analyses run at once by each worker process
+__JOB_RETENTION__ = 3600  # seconds finished jobs are kept
+__JOB_POLL_INTERVAL__ = 1.0
+__RESULT_CACHE_TTL__ = 15 * 60
+__RESULT_CACHE_MAX_BYTES__ = 8 * 1024 * 1024
+# Completions of the LLM prompts (query generation, verification)
+__LLM_CACHE_TTL__ = 6 * 3600
+__LLM_CACHE_MAX_BYTES__ = 16 * 1024 * 1024
+__EXTRACTION_ENGINE__ = "auto"  # auto, selectolax, lxml or bs4
+__EXTRACTION_POOL__ = "thread"  # thread or process
+__EXTRACTION_WORKERS__ = 4
+__SCRAPER_MAX_BYTES__ = 2 * 1024 * 1024
+# Early cutoff of the search/scrape pipeline: once __PIPELINE_MIN_PAGES__
+# pages brought evidence, the scrape stops when __PIPELINE_MIN_CHUNKS__ new
+# chunks are indexed, or __PIPELINE_GRACE__ seconds later at the latest
+__PIPELINE_MIN_PAGES__ = 3
+__PIPELINE_MIN_CHUNKS__ = 60
+__PIPELINE_GRACE__ = 3.0
+# URL scheduling of the scrape: pages and concurrent downloads allowed per
+# domain in an analysis (None: unlimited), and the download history of the
+# domains, kept per worker: a domain goes back one rank for every
+# __SCHEDULER_SLOW_SECONDS__ of its average download time, and by up to
+# __SCHEDULER_FAILURE_PENALTY__ ranks for its failure rate
+__SCHEDULER_DOMAIN_QUOTA__ = 3
+__SCHEDULER_DOMAIN_CONCURRENCY__ = 2
+__SCHEDULER_SLOW_SECONDS__ = 2.0
+__SCHEDULER_FAILURE_PENALTY__ = 5
+__SCHEDULER_HISTORY_DOMAINS__ = 4096
+__DEDUP_THRESHOLD__ = 0.6  # estimated Jaccard similarity of near-duplicates
+__BOILERPLATE_MIN_PAGES__ = 3
+__BOILERPLATE_RATIO__ = 0.5  # share of a request's pages
+__TOKENIZER_ENCODING__ = "cl100k_base"  # tiktoken encoding of the LLM
+__VERIFIER_PROMPT_TOKENS__ = 6000
+# Evidence larger than one Verifier prompt is split by source domain into
+# up to __VERIFIER_MAX_SHARDS__ prompts, checked concurrently (1: disabled)
+__VERIFIER_MAX_SHARDS__ = 4
+__VERIFIER_CONCURRENCY__ = 4
+# Each Verifier prompt holds at most __VERIFIER_PROMPT_CHUNKS__ chunks, and
+# __VERIFIER_CANDIDATES__ chunks are retrieved to fill the shards
+__VERIFIER_PROMPT_CHUNKS__ = __TOPK_RESULTS__
+__VERIFIER_CANDIDATES__ = __VERIFIER_PROMPT_CHUNKS__ * __VERIFIER_MAX_SHARDS__
+__SCORER_PROMPT_TOKENS__ = 12000
+__RETRIEVAL_MODE__ = "hybrid"  # hybrid (BM25 + vectors), vector or bm25
+__RETRIEVAL_CANDIDATES__ = 50  # per retriever, fused and reranked
+__RETRIEVAL_RRF_K__ = 60
+__EMBEDDING_TIMEOUT__ = 20  # seconds, then retrieval falls back to BM25
+__RERANKER_MODEL__ = None  # sentence-transformers cross-encoder, e.g.
+# "cross-encoder/ms-marco-MiniLM-L-6-v2"
+__REDIS_URL__ = os.getenv("TRUSTME_REDIS_URL")  # e.g. redis://host:6379/0
+# Backend of the state shared by workers (caches, rate-limit counters):
+# memory (per worker), sqlite (in __CACHE_DIR__) or redis
+__STATE_BACKEND__ = os.getenv("TRUSTME_STATE_BACKEND") or (
+    "redis" if __REDIS_URL__ else "sqlite" if __CACHE_DIR__ else "memory"
+)
+__RATE_LIMIT__ = None  # analyses per client per minute, None: unlimited
+# Client-side limits of each worker for the upstream APIs (divide the
+# deployment quotas by the number of workers), None: unlimited
+__LLM_REQUESTS_PER_MINUTE__ = 120
+__LLM_TOKENS_PER_MINUTE__ = 150_000
+__LLM_CALL_TIMEOUT__ = 45  # seconds per attempt
+__LLM_DEADLINE__ = 80  # seconds per call, retries included
+__EMBEDDING_REQUESTS_PER_MINUTE__ = 300
+__EMBEDDING_TOKENS_PER_MINUTE__ = 300_000
+__SEARCH_REQUESTS_PER_MINUTE__ = 120
+__SEARCH_DEADLINE__ = 20
+__RETRY_MAX_ATTEMPTS__ = 4
+__RETRY_BACKOFF_BASE__ = 0.5  # seconds, doubled at each attempt
+__RETRY_BACKOFF_CAP__ = 8.0
+__CIRCUIT_FAILURE_THRESHOLD__ = 5  # consecutive failures
+__CIRCUIT_RESET_TIMEOUT__ = 30  # seconds before a probe call
+__BATCH_MAX_SUBJECTS__ = 100  # analyses per /analyze/batch call
+__BATCH_CONCURRENCY__ = 8  # analyses of a batch run at once
+__BATCH_QUERY_GROUP_SIZE__ = 10  # subjects per query generation prompt
+__EMBEDDING_BATCH_WINDOW__ = 0.02  # seconds the calls of a batch are merged
+__EMBEDDING_BATCH_MAX_TEXTS__ = 2048  # texts per upstream call
+__TRACE_HEADER__ = "X-Trace-Id"  # request/response header of trace IDs
+__TRACE_LOG__ = True  # log each request's spans as one JSON line
+# Estimated prices in USD per 1000 tokens (gpt-4.1, text-embedding-3-small)
+__LLM_PRICE_PER_1K_TOKENS__ = {"prompt": 0.002, "completion": 0.008}
+__EMBEDDING_PRICE_PER_1K_TOKENS__ = 0.00002
@@ -0,0 +1,312 @@
+
+"""
+Chunk deduplication before embedding: boilerplate suppression across the
+pages of one request, exact dedup and MinHash near-duplicate detection.
+"""
+import re
+import zlib
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from text_cleaning import clean_sentences, dedup_key
+from config import (
+    __DEDUP_THRESHOLD__,
+    __BOILERPLATE_MIN_PAGES__,
+    __BOILERPLATE_RATIO__,
+)
+
+SHINGLE_SIZE = 3  # words per shingle
+NUM_PERM = 128  # estimates Jaccard similarity within about 0.04
+BANDS = 32  # LSH bands of 4 rows: pairs from Jaccard ~0.45 become candidates
+BATCH_SIZE = 1024  # sentences hashed per vectorized step
+# Entries kept per LSH bucket: templated text fills some buckets, which
+# would otherwise make every lookup compare against all of them
+BUCKET_SIZE = 32
+
+_WORDS = re.compile(r"\w+")
+_NUMBERS = re.compile(r"\d+")
+
+# Multiply-shift hashing of 32-bit shingle hashes: the high 32 bits of
+# (a * x + b) mod 2**64, with odd a. Taking the minimum before the shift
+# selects the same shingle, so the shift runs on the signatures only
+_rng = np.random.default_rng(0x7E57)
+_A = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64) * 2 + 1
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+
+
+def _shingles(sentence: str) -> list[int]:
+    words = _WORDS.findall(sentence.lower()) or [sentence]
+    return [
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    ]
+
+
+def minhash_signatures(sentences: list[str]) -> np.ndarray:
+    """
+    Computes the MinHash signatures of word shingles, batch by batch.
+    The last column hashes the numbers quoted by each sentence.
+    Args:
+        sentences (list[str]): Sentences to sign.
+    Returns:
+        np.ndarray: (len(sentences), NUM_PERM + 1) uint32 signatures.
+    """
+    signatures = [np.empty((0, NUM_PERM + 1), dtype=np.uint32)]
+    for start in range(0, len(sentences), BATCH_SIZE):
+        batch = sentences[start:start + BATCH_SIZE]
+        hashes, offsets = [], []
+        for sentence in batch:
+            offsets.append(len(hashes))
+            hashes.extend(_shingles(sentence))
+        values = np.asarray(hashes, dtype=np.uint64)[:, None] * _A + _B
+        numbers = np.asarray([
+            zlib.crc32(" ".join(_NUMBERS.findall(s)).encode("ascii"))
+            for s in batch
+        ], dtype=np.uint32)
+        signatures.append(np.column_stack([
+            (np.minimum.reduceat(values, offsets, axis=0) >> 32)
+            .astype(np.uint32),
+            numbers,
+        ]))
+    return np.concatenate(signatures)
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of MinHash signatures. A chunk is a near-duplicate when its
+    estimated Jaccard similarity with an indexed chunk reaches the threshold
+    and both quote the same numbers: updated figures are distinct evidence.
+    Attributes:
+        threshold: Minimum estimated Jaccard similarity of near-duplicates.
+    """
+
+    def __init__(self, threshold: float = __DEDUP_THRESHOLD__):
+        self.threshold = threshold
+        self._buckets = [{} for _ in range(BANDS)]
+        self._signatures = np.empty((256, NUM_PERM + 1), dtype=np.uint32)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, signature: np.ndarray) -> bool:
+        """
+        Indexes a signature unless a near-duplicate is already indexed.
+        Args:
+            signature (np.ndarray): MinHash signature.
+        Returns:
+            bool: True if added, False if it is a near-duplicate.
+        """
+        raw = signature[:NUM_PERM].tobytes()
+        step = len(raw) // BANDS
+        keys = [raw[i:i + step] for i in range(0, len(raw), step)]
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, keys):
+                candidates.update(bucket.get(key, ()))
+            if candidates:
+                indexed = self._signatures[list(candidates)]
+                matches = np.count_nonzero(
+                    indexed[:, :NUM_PERM] == signature[:NUM_PERM], axis=1
+                )
+                if np.any(
+                    (matches >= self.threshold * NUM_PERM)
+                    & (indexed[:, NUM_PERM] == signature[NUM_PERM])
+                ):
+                    return False
+            if self._size == len(self._signatures):
+                self._signatures = np.resize(
+                    self._signatures, (2 * self._size, NUM_PERM + 1)
+                )
+            i = self._size
+            self._signatures[i] = signature
+            self._size += 1
+            for bucket, key in zip(self._buckets, keys):
+                entries = bucket.get(key)
+                if entries is None:
+                    bucket[key] = [i]
+                else:
+                    entries.append(i)
+                    if len(entries) > BUCKET_SIZE:
+                        del entries[0]
+        return True
+
+    def filter(self, items: list, signatures: np.ndarray) -> list:
+        """
+        Returns the items (chunks, or chunks with their metadata) that are
+        not near-duplicates of indexed ones or of each other, indexing them.
+        """
+        return [
+            item for item, signature in zip(items, signatures)
+            if self.add(signature)
+        ]
+
+
+class PageStream:
+    """
+    Incremental deduplicate_pages for the pages of one request arriving in
+    batches (see ScraperAgent.run_pipeline). Each batch yields the
+    sentences not received before; boilerplate is only known once every
+    page is counted, so it is left out of the results at the end (see
+    boilerplate), which makes them independent of the order and batching of
+    the pages.
+    Attributes:
+        pages: Number of pages received.
+    """
+
+    def __init__(
+        self,
+        min_pages: int = __BOILERPLATE_MIN_PAGES__,
+        ratio: float = __BOILERPLATE_RATIO__,
+    ):
+        self.min_pages = min_pages
+        self.ratio = ratio
+        self.pages = 0
+        self._page_count = defaultdict(int)
+        self._host_pages = defaultdict(int)
+        self._host_count = defaultdict(int)
+        self._occurrences = defaultdict(int)
+
+    def count(self, pages: list[tuple[str, list[str]]]) -> None:
+        """
+        Counts the pages each sentence appears on, overall and by host.
+        """
+        for url, sentences in pages:
+            host = urlsplit(url).hostname or ""
+            self._host_pages[host] += 1
+            for key in {dedup_key(s) for s in sentences}:
+                self._page_count[key] += 1
+                self._host_count[key, host] += 1
+        self.pages += len(pages)
+
+    def boilerplate(self) -> set[bytes]:
+        """
+        Returns the dedup_key of the boilerplate sentences of the pages
+        counted so far: those found on at least min_pages pages and a ratio
+        share of the pages, of the request or of one of its hosts.
+        """
+        min_count = max(self.min_pages, self.ratio * self.pages)
+        found = {
+            key for key, count in self._page_count.items()
+            if count >= min_count
+        }
+        found.update(
+            key for (key, host), count in self._host_count.items()
+            if count >= max(self.min_pages,
+                            self.ratio * self._host_pages[host])
+        )
+        return found
+
+    @property
+    def counts(self) -> dict:
+        """
+        Sentences received, and those dropped as boilerplate or as
+        duplicates, with the pages counted so far.
+        """
+        boilerplate = self.boilerplate()
+        counts = {"sentences": 0, "boilerplate": 0, "duplicates": 0}
+        for key, occurrences in self._occurrences.items():
+            counts["sentences"] += occurrences
+            if key in boilerplate:
+                counts["boilerplate"] += occurrences
+            else:
+                counts["duplicates"] += occurrences - 1
+        return counts
+
+    def add(
+        self, pages: list[tuple[str, list[str]]]
+    ) -> tuple[list[str], list[str]]:
+        """
+        Counts a batch of cleaned pages and returns their sentences not
+        received before, boilerplate included (see boilerplate).
+        Args:
+            pages (list[tuple[str, list[str]]]): (url, sentences) of each
+            page.
+        Returns:
+            tuple[list[str], list[str]]: New chunks in page order and their
+            source URLs.
+        """
+        self.count(pages)
+        chunks, sources = [], []
+        for url, sentences in pages:
+            for sentence in sentences:
+                key = dedup_key(sentence)
+                self._occurrences[key] += 1
+                if self._occurrences[key] == 1:
+                    chunks.append(sentence)
+                    sources.append(url)
+        return chunks, sources
+
+
+def boilerplate_keys(
+    pages: list[tuple[str, list[str]]],
+    min_pages: int = __BOILERPLATE_MIN_PAGES__,
+    ratio: float = __BOILERPLATE_RATIO__,
+) -> set[bytes]:
+    """
+    Finds the sentences repeated across the pages of one request: site
+    chrome found on many pages of the same host, or text (cookie banners,
+    share widgets) found on many pages of the request.
+    Args:
+        pages (list[tuple[str, list[str]]]): (url, sentences) of each page.
+        min_pages (int): Minimum number of pages of a boilerplate sentence.
+        ratio (float): Minimum share of the pages (of the request, or of
+        the host) of a boilerplate sentence.
+    Returns:
+        set[bytes]: dedup_key of every boilerplate sentence.
+    """
+    stream = PageStream(min_pages, ratio)
+    stream.count(pages)
+    return stream.boilerplate()
+
+
+def clean_page_sentences(
+    pages: list[tuple[str, str | None]]
+) -> list[tuple[str, list[str]]]:
+    """
+    Splits the extracted text of each page into clean sentences, skipping
+    pages without text. Runs in the extraction pool.
+    """
+    return [(url, clean_sentences(text)) for url, text in pages if text]
+
+
+@dataclass
+class DedupResult:
+    """
+    Unique chunks of a request with their source URLs and MinHash
+    signatures, and the number of sentences dropped by each stage.
+    """
+    chunks: list[str]
+    sources: list[str]
+    signatures: np.ndarray
+    counts: dict = field(default_factory=dict)
+
+
+def deduplicate_pages(pages: list[tuple[str, str | None]]) -> DedupResult:
+    """
+    Cleans the pages of one request into unique chunks, dropping boilerplate
+    and exact duplicates, and signs them for near-duplicate detection
+    (see NearDuplicateIndex). Runs in the extraction pool.
+    Args:
+        pages (list[tuple[str, str | None]]): (url, extracted text) of each
+        page; pages without text are skipped.
+    Returns:
+        DedupResult: Chunks in page order, their sources and signatures.
+    """
+    stream = PageStream()
+    chunks, sources = stream.add(clean_page_sentences(pages))
+    boilerplate = stream.boilerplate()
+    kept = [
+        i for i, chunk in enumerate(chunks)
+        if dedup_key(chunk) not in boilerplate
+    ]
+    chunks = [chunks[i] for i in kept]
+    return DedupResult(
+        chunks, [sources[i] for i in kept], minhash_signatures(chunks),
+        stream.counts
+    )
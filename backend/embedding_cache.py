@@ -0,0 +1,475 @@
+
+"""
+Embedding cache: avoids re-embedding identical text chunks.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from langchain_setup import resilient_embeddings
+from state import create_store
+from process_local import ProcessLocal
+from config import (
+    __CACHE_DIR__,
+    __STATE_BACKEND__,
+    __EMBEDDING_CACHE_MAX_ITEMS__,
+    __EMBEDDING_CACHE_DISK_ITEMS__,
+    __EMBEDDING_BATCH_WINDOW__,
+    __EMBEDDING_BATCH_MAX_TEXTS__,
+)
+
+
+def embedding_key(text: str, deployment: str) -> str:
+    """
+    Content hash of a chunk for a given embedding deployment.
+    """
+    return hashlib.sha256(
+        f"{deployment}\x00{text}".encode("utf-8")
+    ).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk vector store shared by all workers: float32 vectors live in a
+    memory-mapped array of fixed capacity, indexed by a SQLite table.
+    When full, the least recently used slot is overwritten.
+    Each slot also holds the key digest, written last, so that readers can
+    detect a slot being overwritten by another process.
+    """
+
+    def __init__(self, directory: str, namespace: str, capacity: int):
+        self.directory = directory
+        self.namespace = namespace
+        self.capacity = capacity
+        self.dim = None
+        self._vectors = None
+        self._digests = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._local = ProcessLocal(self._connect)
+        self._local.get()  # fails early on a bad path
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # each forked worker opens its own connection on first use
+        return self._local.get()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            os.path.join(self.directory, f"{self.namespace}.sqlite3"),
+            timeout=5, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, slot INTEGER UNIQUE, dim INTEGER, "
+            "accessed_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS vectors_accessed "
+            "ON vectors(accessed_at)"
+        )
+        return conn
+
+    def _open(self, dim: int) -> None:
+        if self.dim == dim:
+            return
+        base = os.path.join(self.directory, f"{self.namespace}-{dim}")
+        mode = "r+" if os.path.exists(f"{base}.f32") else "w+"
+        self._vectors = np.memmap(
+            f"{base}.f32", dtype=np.float32, mode=mode,
+            shape=(self.capacity, dim)
+        )
+        self._digests = np.memmap(
+            f"{base}.keys", dtype=np.uint8, mode=mode,
+            shape=(self.capacity, 32)
+        )
+        self.dim = dim
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """
+        Reads the cached vectors for the given keys.
+        Returns:
+            dict: key -> vector, for keys found.
+        """
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            rows = []
+            # stay below SQLite's limit of bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows.extend(self._conn.execute(
+                    "SELECT key, slot, dim FROM vectors WHERE key IN "
+                    f"({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            for key, slot, dim in rows:
+                self._open(dim)
+                digest = bytes.fromhex(key)
+                if bytes(self._digests[slot]) != digest:
+                    continue
+                vector = np.array(self._vectors[slot])
+                if bytes(self._digests[slot]) == digest:
+                    found[key] = vector
+            if found:
+                self._conn.executemany(
+                    "UPDATE vectors SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+        return found
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        """
+        Writes vectors, evicting least recently used slots when full.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                keys = list(items)
+                present = set()
+                # stay below SQLite's limit of bound parameters
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    present.update(key for key, in self._conn.execute(
+                        "SELECT key FROM vectors WHERE key IN "
+                        f"({','.join('?' * len(batch))})", batch
+                    ))
+                # beyond the capacity, only the last vectors can be kept
+                new = [
+                    key for key in keys if key not in present
+                ][-self.capacity:]
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM vectors"
+                ).fetchone()[0]
+                free = list(range(count, min(self.capacity, count + len(new))))
+                overflow = len(new) - len(free)
+                if overflow > 0:
+                    # the least recently used rows, in one indexed pass
+                    lru = (
+                        "SELECT rowid FROM vectors "
+                        "ORDER BY accessed_at, rowid LIMIT ?"
+                    )
+                    free += [slot for slot, in self._conn.execute(
+                        f"SELECT slot FROM vectors WHERE rowid IN ({lru})",
+                        (overflow,)
+                    )]
+                    self._conn.execute(
+                        f"DELETE FROM vectors WHERE rowid IN ({lru})",
+                        (overflow,)
+                    )
+                rows = []
+                for key, slot in zip(new, free):
+                    vector = np.asarray(items[key], dtype=np.float32)
+                    self._open(len(vector))
+                    self._digests[slot] = 0
+                    self._vectors[slot] = vector
+                    self._digests[slot] = np.frombuffer(
+                        bytes.fromhex(key), dtype=np.uint8
+                    )
+                    rows.append((key, slot, len(vector), now))
+                self._conn.executemany(
+                    "INSERT INTO vectors VALUES (?, ?, ?, ?)", rows
+                )
+                if rows:
+                    self._vectors.flush()
+                    self._digests.flush()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class KeyValueVectorStore:
+    """
+    Vector store on a shared key-value store (see state): each vector is
+    kept as float32 bytes under its key.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        return {
+            key: np.frombuffer(value, dtype=np.float32).copy()
+            for key, value in zip(keys, self.store.get_many(keys))
+            if value is not None
+        }
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        self.store.set_many({
+            key: np.asarray(vector, dtype=np.float32).tobytes()
+            for key, vector in items.items()
+        })
+
+
+def create_vector_store(backend: str = __STATE_BACKEND__):
+    """
+    Creates the shared tier of the embedding cache for the configured state
+    backend: memory-mapped EmbeddingStore files with 'sqlite', the key-value
+    store with 'redis', none with 'memory'.
+    """
+    try:
+        if backend == "sqlite":
+            return EmbeddingStore(
+                os.path.join(__CACHE_DIR__ or ".", "embeddings"),
+                "embeddings", __EMBEDDING_CACHE_DISK_ITEMS__
+            )
+        if backend == "redis":
+            return KeyValueVectorStore(create_store("embeddings"))
+    except Exception as e:
+        logging.warning(f"Embedding cache: shared tier disabled: {e}")
+    return None
+
+
+# Set by the analyses of a batch (see main.batch_events): only their calls
+# wait for others to merge with, the other analyses are not delayed
+batching: ContextVar[bool] = ContextVar("embedding_batching", default=False)
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper merging the async calls made within `window` seconds
+    of each other by the concurrent analyses of a batch (where batching is
+    set) into one upstream call of up to max_texts distinct texts. Other
+    calls, and sync ones, go straight to the model.
+    Attributes:
+        counters: Calls received and upstream calls made.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        window: float = __EMBEDDING_BATCH_WINDOW__,
+        max_texts: int = __EMBEDDING_BATCH_MAX_TEXTS__,
+    ):
+        self.underlying = underlying
+        self.window = window
+        self.max_texts = max_texts
+        # keeps the cache keys of CachedEmbeddings
+        self.deployment = getattr(underlying, "deployment", None)
+        self.model = getattr(underlying, "model", None)
+        self._pending = []  # (texts, future) waiting for the next call
+        self._pending_texts = 0
+        self._timer = None
+        self._tasks = set()
+        self.counters = {"calls": 0, "upstream_calls": 0}
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        self.counters["calls"] += 1
+        if not self.window or not batching.get():
+            self.counters["upstream_calls"] += 1
+            return await self.underlying.aembed_documents(texts)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self.max_texts:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        self._pending_texts = 0
+        if pending:
+            task = asyncio.ensure_future(self._send(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, pending) -> None:
+        unique = list(dict.fromkeys(
+            text for texts, _ in pending for text in texts
+        ))
+        self.counters["upstream_calls"] += 1
+        try:
+            vectors = await self.underlying.aembed_documents(unique)
+        except asyncio.CancelledError:
+            for _, future in pending:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_text = dict(zip(unique, vectors))
+        for texts, future in pending:
+            if not future.done():
+                future.set_result([by_text[text] for text in texts])
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that looks up chunks by content hash in a bounded
+    in-memory LRU of float32 arrays, then in an optional shared vector store
+    (see create_vector_store), and sends only the misses to the wrapped
+    model in one batched call.
+    Attributes:
+        counters: Hit/miss and upstream call counters.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        max_items: int = __EMBEDDING_CACHE_MAX_ITEMS__,
+        store=None,
+    ):
+        self.underlying = underlying
+        self.deployment = (
+            getattr(underlying, "deployment", None)
+            or getattr(underlying, "model", None)
+            or type(underlying).__name__
+        )
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self.store = store
+        self.counters = {
+            "memory_hits": 0, "shared_hits": 0, "misses": 0,
+            "upstream_calls": 0,
+        }
+
+    def _remember(self, key: str, vector) -> None:
+        self._memory[key] = np.asarray(vector, dtype=np.float32)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _lookup_memory(self, keys: list[str]) -> dict:
+        found = {}
+        for key in keys:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                found[key] = vector
+        self.counters["memory_hits"] += len(found)
+        return found
+
+    def _lookup_shared(self, keys: list[str]) -> dict:
+        if self.store is None or not keys:
+            return {}
+        try:
+            found = self.store.get_many(keys)
+        except Exception as e:
+            logging.warning(f"Embedding cache: shared read failed: {e}")
+            return {}
+        self.counters["shared_hits"] += len(found)
+        return found
+
+    def _store_shared(self, items: dict) -> None:
+        if self.store is None or not items:
+            return
+        try:
+            self.store.put_many(items)
+        except Exception as e:
+            logging.warning(f"Embedding cache: shared write failed: {e}")
+
+    def _split(self, texts: list[str]):
+        keys = [embedding_key(text, self.deployment) for text in texts]
+        found = self._lookup_memory(list(dict.fromkeys(keys)))
+        return keys, found
+
+    def _missing(self, texts, keys, found) -> dict[str, str]:
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in found:
+                missing[key] = text
+        return missing
+
+    def _merge(self, keys, found, missing_keys, vectors) -> list:
+        self.counters["misses"] += len(missing_keys)
+        computed = {
+            key: np.asarray(vector, dtype=np.float32)
+            for key, vector in zip(missing_keys, vectors)
+        }
+        found.update(computed)
+        for key in dict.fromkeys(keys):
+            self._remember(key, found[key])
+        return [found[key].tolist() for key in keys], computed
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found = self._split(texts)
+        missing = self._missing(texts, keys, found)
+        found.update(self._lookup_shared(list(missing)))
+        missing = self._missing(texts, keys, found)
+        vectors = []
+        if missing:
+            self.counters["upstream_calls"] += 1
+            vectors = self.underlying.embed_documents(list(missing.values()))
+        result, computed = self._merge(keys, found, list(missing), vectors)
+        self._store_shared(computed)
+        return result
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found = self._split(texts)
+        missing = self._missing(texts, keys, found)
+        if self.store is not None and missing:
+            found.update(
+                await asyncio.to_thread(self._lookup_shared, list(missing))
+            )
+            missing = self._missing(texts, keys, found)
+        vectors = []
+        if missing:
+            self.counters["upstream_calls"] += 1
+            vectors = await self.underlying.aembed_documents(
+                list(missing.values())
+            )
+        result, computed = self._merge(keys, found, list(missing), vectors)
+        if self.store is not None and computed:
+            await asyncio.to_thread(self._store_shared, computed)
+        return result
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and cache sizes.
+        """
+        hits = self.counters["memory_hits"] + self.counters["shared_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "shared_backend": (
+                __STATE_BACKEND__ if self.store is not None else None
+            ),
+        }
+
+
+# Shared cached embeddings for the agents
+cached_embeddings = CachedEmbeddings(
+    BatchedEmbeddings(resilient_embeddings), store=create_vector_store()
+)
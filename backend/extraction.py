@@ -0,0 +1,200 @@
+
+"""
+HTML text extraction engines, run off the event loop in a worker pool.
+"""
+import re
+import codecs
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+from config import (
+    __EXTRACTION_ENGINE__,
+    __EXTRACTION_POOL__,
+    __EXTRACTION_WORKERS__,
+)
+
+# Elements whose content is never useful evidence
+FILTERED_TAGS = ['script', 'style', 'footer',
+                 'header', 'nav', 'aside', 'form', 'noscript']
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="...;
+# charset=..."> in the head of a page
+_META_CHARSET = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE
+)
+
+
+def decode_html(body: bytes, charset: str | None = None) -> str:
+    """
+    Decodes a page body: with the charset of the Content-Type header, else
+    the one declared by a <meta> tag, else as UTF-8 when valid (a character
+    cut by a truncated download is dropped), else with the encoding guessed
+    by charset_normalizer.
+    Args:
+        body (bytes): Page body, possibly truncated.
+        charset (str | None): Charset of the Content-Type header, if any.
+    Returns:
+        str: Decoded text, undecodable bytes replaced.
+    """
+    match = _META_CHARSET.search(body[:4096])
+    declared = match.group(1).decode("ascii") if match else None
+    for encoding in (charset, declared):
+        if encoding:
+            try:
+                return body.decode(encoding, errors="replace")
+            except LookupError:
+                pass
+    try:
+        return codecs.getincrementaldecoder("utf-8")().decode(body)
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+
+        best = from_bytes(body[:64 * 1024]).best()
+        if best is not None:
+            return body.decode(best.encoding, errors="replace")
+    except ImportError:
+        pass
+    return body.decode("utf-8", errors="replace")
+
+
+def extract_bs4(html: str) -> str:
+    """
+    Pure-Python engine: BeautifulSoup with html.parser.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup.find_all(FILTERED_TAGS):
+        element.decompose()
+    return soup.get_text(separator=" ", strip=True)
+
+
+def extract_lxml(html: str) -> str:
+    """
+    libxml2 engine: strips filtered elements and comments in one pass.
+    Documents lxml rejects (XML declaration with an encoding, no element)
+    go to extract_bs4.
+    """
+    import lxml.html
+    from lxml import etree
+
+    if not html.strip():
+        return ""
+    try:
+        root = lxml.html.fromstring(html)
+    except (ValueError, etree.ParserError):
+        return extract_bs4(html)
+    etree.strip_elements(root, *FILTERED_TAGS, etree.Comment, with_tail=False)
+    return " ".join(
+        text.strip() for text in root.itertext() if text.strip()
+    )
+
+
+def extract_selectolax(html: str) -> str:
+    """
+    Lexbor engine (selectolax): fastest when installed.
+    """
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(FILTERED_TAGS)
+    if tree.root is None:
+        return ""
+    return tree.root.text(separator=" ", strip=True)
+
+
+ENGINES = {
+    "selectolax": extract_selectolax,
+    "lxml": extract_lxml,
+    "bs4": extract_bs4,
+}
+
+
+def available_engines() -> list[str]:
+    """
+    Returns the installed engines, fastest first.
+    """
+    engines = []
+    for name, module in (("selectolax", "selectolax.lexbor"),
+                         ("lxml", "lxml.html")):
+        try:
+            __import__(module)
+            engines.append(name)
+        except ImportError:
+            pass
+    return engines + ["bs4"]
+
+
+def resolve_engine(engine: str = __EXTRACTION_ENGINE__) -> str:
+    """
+    Resolves 'auto' to the fastest installed engine.
+    """
+    if engine == "auto":
+        return available_engines()[0]
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown extraction engine: {engine}")
+    return engine
+
+
+def extract_text(html: str, engine: str = "bs4") -> str:
+    """
+    Extracts the visible text of a page, without filtered elements.
+    Args:
+        html (str): Page HTML.
+        engine (str): Engine name (see ENGINES).
+    Returns:
+        str: Text with elements separated by single spaces.
+    """
+    return ENGINES[engine](html)
+
+
+_engine = None
+_executor: Executor | None = None
+
+
+def get_executor() -> Executor:
+    """
+    Returns this process' extraction pool, creating it on first use so that
+    each forked worker gets its own.
+    """
+    global _executor
+    if _executor is None:
+        if __EXTRACTION_POOL__ == "process":
+            _executor = ProcessPoolExecutor(__EXTRACTION_WORKERS__)
+        else:
+            _executor = ThreadPoolExecutor(
+                __EXTRACTION_WORKERS__, thread_name_prefix="extract"
+            )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def extract_text_async(html: str, engine: str | None = None) -> str:
+    """
+    Runs extract_text in the extraction pool, keeping the event loop free.
+    Args:
+        html (str): Page HTML.
+        engine (str | None): Engine name. If None, uses the configured one.
+    Returns:
+        str: Extracted text.
+    """
+    global _engine
+    if engine is None:
+        if _engine is None:
+            _engine = resolve_engine()
+            logging.info(f"HTML extraction engine: {_engine}")
+        engine = _engine
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), extract_text, html, engine
+    )
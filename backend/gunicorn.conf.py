@@ -1,4 +1,5 @@
 # Gunicorn configuration file
+import os
 import multiprocessing
 
 # timeout
@@ -17,3 +18,19 @@ bind = "0.0.0.0:8000"
 # worker nodes
 worker_class = "uvicorn.workers.UvicornWorker"
 workers = max(1, multiprocessing.cpu_count() // 2)
+
+# preloading: the master imports the app once and the workers (including
+# the ones replacing recycled workers) are forked from it, sharing its
+# modules copy-on-write. Clients and connections are still created in each
+# worker on first use (see process_local.py). Code changes then need a
+# full restart rather than a HUP.
+preload_app = os.getenv("TRUSTME_PRELOAD", "1") != "0"
+
+
+def on_starting(server):
+    """
+    Also imports the client integrations in the master when preloading.
+    """
+    if server.cfg.preload_app:
+        from langchain_setup import preload_imports
+        preload_imports()
@@ -0,0 +1,74 @@
+
+"""
+HTTP client setup: one pooled aiohttp session for each worker process.
+"""
+import logging
+import aiohttp
+
+from config import (
+    __HTTP_POOL_LIMIT__,
+    __HTTP_POOL_LIMIT_PER_HOST__,
+    __HTTP_DNS_TTL__,
+    __HTTP_KEEPALIVE_TIMEOUT__,
+)
+
+_session: aiohttp.ClientSession | None = None
+
+
+def create_session(
+    limit: int = __HTTP_POOL_LIMIT__,
+    limit_per_host: int = __HTTP_POOL_LIMIT_PER_HOST__,
+    dns_ttl: int = __HTTP_DNS_TTL__,
+    keepalive_timeout: int = __HTTP_KEEPALIVE_TIMEOUT__,
+) -> aiohttp.ClientSession:
+    """
+    Creates a ClientSession backed by a pooled connector.
+    Args:
+        limit (int): Maximum number of open connections.
+        limit_per_host (int): Maximum number of connections for each host.
+        dns_ttl (int): Seconds DNS resolutions are cached for.
+        keepalive_timeout (int): Seconds idle connections are kept open.
+    Returns:
+        aiohttp.ClientSession: A new session.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def open_session() -> aiohttp.ClientSession:
+    """
+    Opens the shared session. Called at application startup.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+        logging.info("Shared HTTP session opened.")
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Closes the shared session. Called at application shutdown.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logging.info("Shared HTTP session closed.")
+    _session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared session, opening it if startup did not run
+    (e.g. when agents are used outside of the FastAPI app).
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_session()
+    return _session
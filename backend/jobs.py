@@ -0,0 +1,393 @@
+
+"""
+Analysis jobs: a pluggable priority queue and a worker pool that run the
+inference pipeline in the background.
+"""
+import os
+import json
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+
+from cache import analysis_key
+from process_local import ProcessLocal
+from config import (
+    __JOB_BACKEND__,
+    __JOB_DIR__,
+    __JOB_CONCURRENCY__,
+    __JOB_RETENTION__,
+    __JOB_POLL_INTERVAL__,
+    __REQUEST_TIME_BUDGET__,
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+@dataclass
+class Job:
+    """
+    One queued analysis. Higher priority jobs run first.
+    """
+    request: dict
+    key: str
+    priority: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: dict | None = None
+    error: str | None = None
+
+
+class MemoryJobStore:
+    """
+    In-process job store. Jobs are only visible to the worker process that
+    received them: for a single process (and tests) only.
+    """
+
+    def __init__(self):
+        self._jobs: dict[str, Job] = {}
+        self._heap = []
+
+    async def add(self, job: Job) -> Job:
+        existing = await self.find_active(job.key)
+        if existing is not None:
+            return existing
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, (-job.priority, job.created_at, job.id))
+        return job
+
+    async def claim(self) -> Job | None:
+        while self._heap:
+            _, _, job_id = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job is not None and job.status == QUEUED:
+                job.status = RUNNING
+                job.started_at = time.time()
+                return job
+        return None
+
+    async def update(self, job: Job) -> None:
+        self._jobs[job.id] = job
+
+    async def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def find_active(self, key: str) -> Job | None:
+        for job in self._jobs.values():
+            if job.key == key and job.status in ACTIVE_STATUSES:
+                return job
+        return None
+
+    async def purge(self, finished_before: float) -> None:
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and job.finished_at < finished_before:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """
+    Job store in a SQLite (WAL) database, shared by all gunicorn workers:
+    any worker can claim a queued job or answer a status request. A unique
+    index on the key of the active jobs deduplicates them across workers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = ProcessLocal(self._connect)
+        self._local.get()  # fails early on a bad path
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # each forked worker opens its own connection on first use
+        return self._local.get()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, timeout=5, check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, key TEXT, priority INTEGER, status TEXT, "
+            "created_at REAL, started_at REAL, finished_at REAL, "
+            "request TEXT, result TEXT, error TEXT)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_queue "
+            "ON jobs(status, priority, created_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_key ON jobs(key, status)"
+        )
+        active = f"status IN ('{QUEUED}', '{RUNNING}')"
+        try:
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key "
+                f"ON jobs(key) WHERE {active}"
+            )
+        except sqlite3.IntegrityError:
+            # duplicates queued before the index existed: keep the oldest
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ? WHERE "
+                f"{active} AND rowid NOT IN (SELECT MIN(rowid) FROM jobs "
+                f"WHERE {active} GROUP BY key)", (FAILED, "duplicate")
+            )
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key "
+                f"ON jobs(key) WHERE {active}"
+            )
+        return conn
+
+    @staticmethod
+    def _row_to_job(row) -> Job:
+        (job_id, key, priority, status, created_at, started_at,
+         finished_at, request, result, error) = row
+        return Job(
+            id=job_id, key=key, priority=priority, status=status,
+            created_at=created_at, started_at=started_at,
+            finished_at=finished_at, request=json.loads(request),
+            result=json.loads(result) if result else None, error=error,
+        )
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    @staticmethod
+    def _job_to_row(job: Job) -> tuple:
+        return (
+            job.id, job.key, job.priority, job.status, job.created_at,
+            job.started_at, job.finished_at, json.dumps(job.request),
+            json.dumps(job.result) if job.result is not None else None,
+            job.error
+        )
+
+    def _insert(self, job: Job) -> Job:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # ignored if an identical job is active (jobs_active_key)
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO jobs VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._job_to_row(job)
+                ).rowcount
+                row = None if inserted else self._conn.execute(
+                    "SELECT * FROM jobs WHERE key = ? AND status IN (?, ?)",
+                    (job.key, *ACTIVE_STATUSES)
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job if row is None else self._row_to_job(row)
+
+    def _write(self, job: Job) -> None:
+        self._execute(
+            "INSERT OR REPLACE INTO jobs VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._job_to_row(job)
+        )
+
+    def _claim(self) -> Job | None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? "
+                    "ORDER BY priority DESC, created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job = self._row_to_job(row)
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ? WHERE id = ?",
+                    (job.status, job.started_at, job.id)
+                )
+                self._conn.execute("COMMIT")
+                return job
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _purge(self, finished_before: float) -> None:
+        self._execute(
+            "DELETE FROM jobs WHERE finished_at < ?", (finished_before,)
+        )
+        # jobs of a worker that died mid-run
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+            "WHERE status = ? AND started_at < ?",
+            (FAILED, "worker lost", time.time(), RUNNING,
+             time.time() - 2 * __REQUEST_TIME_BUDGET__)
+        )
+
+    async def add(self, job: Job) -> Job:
+        return await asyncio.to_thread(self._insert, job)
+
+    async def claim(self) -> Job | None:
+        return await asyncio.to_thread(self._claim)
+
+    async def update(self, job: Job) -> None:
+        await asyncio.to_thread(self._write, job)
+
+    async def get(self, job_id: str) -> Job | None:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        )
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def find_active(self, key: str) -> Job | None:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT * FROM jobs WHERE key = ? AND status IN (?, ?) "
+            "ORDER BY created_at LIMIT 1", (key, *ACTIVE_STATUSES)
+        )
+        return self._row_to_job(rows[0]) if rows else None
+
+    async def purge(self, finished_before: float) -> None:
+        await asyncio.to_thread(self._purge, finished_before)
+
+
+class JobManager:
+    """
+    Runs queued analyses with a bounded pool of worker tasks.
+    Identical (subject, context, language) jobs already queued or running
+    are deduplicated by the store: submitting one returns the existing job.
+    Attributes:
+        store: Job store backend (may be set before start, e.g. by the
+        app lifespan).
+        runner: Async callable running one analysis from its request dict
+        and returning the result dict.
+        concurrency: Number of worker tasks.
+    """
+
+    def __init__(
+        self,
+        store,
+        runner,
+        concurrency: int = __JOB_CONCURRENCY__,
+        retention: float = __JOB_RETENTION__,
+        poll_interval: float = __JOB_POLL_INTERVAL__,
+    ):
+        self.store = store
+        self.runner = runner
+        self.concurrency = concurrency
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._workers: list[asyncio.Task] = []
+        self._last_purge = 0.0
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logging.info(f"Job manager started with {self.concurrency} workers.")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, request: dict, priority: int = 0) -> Job:
+        """
+        Queues an analysis, or returns the identical job already in flight.
+        Args:
+            request (dict): AnalysisRequest fields.
+            priority (int): Higher values run first.
+        Returns:
+            Job: The queued (or existing) job.
+        """
+        key = analysis_key(
+            request["subject"], request["context"], request["language"]
+        )
+        job = Job(request=request, key=key, priority=priority)
+        stored = await self.store.add(job)
+        if stored.id != job.id:
+            logging.info(f"Job deduplicated: {stored.id}")
+            return stored
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Job | None:
+        return await self.store.get(job_id)
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                job = await self.store.claim()
+            except Exception as e:
+                logging.error(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), timeout=self.poll_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                await self._purge()
+                continue
+            await self._run(job)
+
+    async def _purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        try:
+            await self.store.purge(now - self.retention)
+        except Exception as e:
+            logging.warning(f"Job purge failed: {e}")
+
+    async def _run(self, job: Job) -> None:
+        logging.info(f"Job started: {job.id}")
+        try:
+            job.result = await self.runner(job.request)
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = FAILED
+            job.error = "cancelled"
+            job.finished_at = time.time()
+            await asyncio.shield(self.store.update(job))
+            raise
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(getattr(e, "detail", e))
+        job.finished_at = time.time()
+        await self.store.update(job)
+        logging.info(f"Job {job.status}: {job.id}")
+
+
+def create_job_store(backend: str = __JOB_BACKEND__):
+    """
+    Creates the configured job store ('sqlite', in __JOB_DIR__, or
+    'memory').
+    """
+    if backend == "sqlite":
+        return SQLiteJobStore(os.path.join(__JOB_DIR__, "jobs.sqlite3"))
+    if backend == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"Unknown job backend: {backend}")
@@ -1,47 +1,232 @@
 
 """
-Langchain setup: creates instances of langchain tools/models.
+Langchain setup: creates instances of langchain tools/models, lazily in
+each worker process.
 """
 import os
+import asyncio
+import importlib
 from dotenv import load_dotenv
 from pydantic import SecretStr
-from langchain_openai import AzureChatOpenAI
-from langchain_openai import AzureOpenAIEmbeddings
-from langchain_community.utilities import GoogleSerperAPIWrapper
-from langsmith import Client
+from langchain_core.messages import AIMessage
 
-from config import __TOPK_RESULTS__
+from config import __TOPK_RESULTS__, __LLM_CONCURRENCY__
+from config import (
+    __LLM_REQUESTS_PER_MINUTE__, __LLM_TOKENS_PER_MINUTE__,
+    __LLM_CALL_TIMEOUT__, __LLM_DEADLINE__,
+    __EMBEDDING_REQUESTS_PER_MINUTE__, __EMBEDDING_TOKENS_PER_MINUTE__,
+    __EMBEDDING_TIMEOUT__,
+    __SEARCH_REQUESTS_PER_MINUTE__, __SEARCH_TIMEOUT__, __SEARCH_DEADLINE__,
+)
+from budget import charge
+from cache import completion_key, llm_cache
+from process_local import per_process
+from prompt_packing import count_tokens, load_tokenizer
+from resilience import Endpoint, ResilientEmbeddings
+from tracing import count, record_llm_usage
 
 load_dotenv()
 
 
-# Initializes an LLM istance
-llm = AzureChatOpenAI(
-    api_key=SecretStr(os.getenv("AZURE_OPENAI_API_KEY") or ""),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-    model=os.getenv("AZURE_OPENAI_MODEL", "gpt-4.1"),
-    temperature=0.2
-)
+# The clients are created on first use in each worker process (see
+# process_local), and their integrations imported only then or by
+# preload_imports.
+
+@per_process
+def get_llm():
+    """
+    Returns this process' chat model instance.
+    """
+    from langchain_openai import AzureChatOpenAI
 
-# Initializes the embedding model instance
-embeddings = AzureOpenAIEmbeddings(
-    azure_deployment=os.environ.get(
-        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT"
-    ),
-    azure_endpoint=os.environ.get(
-        "AZURE_OPENAI_ENDPOINT"
+    return AzureChatOpenAI(
+        api_key=SecretStr(os.getenv("AZURE_OPENAI_API_KEY") or ""),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
+        model=os.getenv("AZURE_OPENAI_MODEL", "gpt-4.1"),
+        temperature=0.2,
+        max_retries=0  # retried by llm_endpoint
     )
-)
 
-# Initializes Langsmith Client
-langsmith_client = Client(
-    api_key=os.getenv("LANGSMITH_API_KEY")
+
+@per_process
+def get_embeddings():
+    """
+    Returns this process' embedding model instance.
+    """
+    from langchain_openai import AzureOpenAIEmbeddings
+
+    return AzureOpenAIEmbeddings(
+        azure_deployment=os.environ.get(
+            "AZURE_OPENAI_EMBEDDING_DEPLOYMENT"
+        ),
+        azure_endpoint=os.environ.get(
+            "AZURE_OPENAI_ENDPOINT"
+        ),
+        max_retries=0  # retried by embedding_endpoint
+    )
+
+
+@per_process
+def get_google_search():
+    """
+    Returns this process' Serper wrapper.
+    """
+    from langchain_community.utilities import GoogleSerperAPIWrapper
+
+    return GoogleSerperAPIWrapper(
+        serper_api_key=os.getenv("SERPER_API_KEY"),
+        k=__TOPK_RESULTS__
+    )
+
+
+# Modules imported on first use by the clients and the retrieval index
+_CLIENT_MODULES = (
+    "langchain_openai", "langchain_community.utilities", "faiss"
 )
 
 
-# Inizializza GoogleSerperAPIWrapper
-google_search = GoogleSerperAPIWrapper(
-    serper_api_key=os.getenv("SERPER_API_KEY"),
-    k=__TOPK_RESULTS__
+def preload_imports() -> None:
+    """
+    Imports the client integrations without creating any client, and loads
+    the tokenizer. Called by the gunicorn master when preloading the app,
+    so that the workers share these modules copy-on-write instead of
+    importing them after the fork.
+    """
+    for module in _CLIENT_MODULES:
+        importlib.import_module(module)
+    load_tokenizer()
+
+
+# Rate limits, retries and circuit breakers of the upstream APIs
+llm_endpoint = Endpoint(
+    "llm",
+    requests_per_minute=__LLM_REQUESTS_PER_MINUTE__,
+    tokens_per_minute=__LLM_TOKENS_PER_MINUTE__,
+    timeout=__LLM_CALL_TIMEOUT__,
+    deadline=__LLM_DEADLINE__,
+)
+embedding_endpoint = Endpoint(
+    "embeddings",
+    requests_per_minute=__EMBEDDING_REQUESTS_PER_MINUTE__,
+    tokens_per_minute=__EMBEDDING_TOKENS_PER_MINUTE__,
+    timeout=__EMBEDDING_TIMEOUT__,
+    deadline=__EMBEDDING_TIMEOUT__,
+)
+search_endpoint = Endpoint(
+    "search",
+    requests_per_minute=__SEARCH_REQUESTS_PER_MINUTE__,
+    timeout=__SEARCH_TIMEOUT__,
+    deadline=__SEARCH_DEADLINE__,
 )
+endpoints = [llm_endpoint, embedding_endpoint, search_endpoint]
+
+# Embeddings with the limits of embedding_endpoint for async calls
+resilient_embeddings = ResilientEmbeddings(
+    get_embeddings, embedding_endpoint,
+    deployment=os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"),
+)
+
+# Bounds concurrent LLM round trips for this worker process
+llm_semaphore = asyncio.Semaphore(__LLM_CONCURRENCY__)
+
+# Completion tokens charged up front, settled with the reported usage
+_COMPLETION_TOKENS_ESTIMATE = 500
+
+
+def prompt_tokens(prompt) -> int:
+    """
+    Estimated tokens of a call with this prompt, completion included.
+    """
+    if isinstance(prompt, str):
+        text = prompt
+    else:
+        text = " ".join(
+            str(getattr(message, "content", message)) for message in prompt
+        )
+    return count_tokens(text) + _COMPLETION_TOKENS_ESTIMATE
+
+
+def cache_key(prompt, model) -> str | None:
+    """
+    Key of a call in llm_cache, None if the prompt is not a string.
+    """
+    if not isinstance(prompt, str):
+        return None
+    deployment = (
+        getattr(model, "deployment_name", None)
+        or getattr(model, "model_name", None) or type(model).__name__
+    )
+    return completion_key(
+        prompt, deployment, getattr(model, "temperature", None)
+    )
+
+
+async def ainvoke_llm(prompt, model=None, cache=True):
+    """
+    Invokes the chat model without blocking the event loop.
+    Concurrent calls are bounded by __LLM_CONCURRENCY__ for each worker,
+    rate limited and retried by llm_endpoint, and each call is charged to
+    the current request budget. Token usage is recorded in the metrics.
+    Completions of string prompts are cached in llm_cache (see
+    cache.completion_key): a hit makes no call and charges nothing.
+    Args:
+        prompt: Formatted prompt (string or list of messages).
+        model: Chat model to use. If None, uses get_llm().
+        cache (bool): Whether to look up and store the completion.
+    Returns:
+        The model response message.
+    """
+    model = model or get_llm()
+    key = cache_key(prompt, model) if cache else None
+    if key is not None:
+        content = await llm_cache.get(key)
+        if content is not None:
+            count("llm_cache_hits")
+            return AIMessage(content=content)
+    charge("llm_calls")
+    tokens = prompt_tokens(prompt)
+    async with llm_semaphore:
+        response = await llm_endpoint.call(
+            model.ainvoke, prompt, tokens=tokens
+        )
+    usage = getattr(response, "usage_metadata", None) or {}
+    llm_endpoint.settle(tokens, usage.get("total_tokens"))
+    record_llm_usage(
+        usage.get("input_tokens", tokens - _COMPLETION_TOKENS_ESTIMATE),
+        usage.get("output_tokens")
+        or count_tokens(str(getattr(response, "content", ""))),
+    )
+    content = getattr(response, "content", None)
+    metadata = getattr(response, "response_metadata", None) or {}
+    # truncated or filtered completions are not kept
+    if (key is not None and content and isinstance(content, str)
+            and metadata.get("finish_reason", "stop") == "stop"):
+        await llm_cache.set(key, content)
+    return response
+
+
+async def astream_llm(prompt, model=None):
+    """
+    Streams the chat model response without blocking the event loop.
+    Bounded, charged and recorded like ainvoke_llm (with estimated token
+    counts); failures are retried until the first chunk arrives.
+    Args:
+        prompt: Formatted prompt (string or list of messages).
+        model: Chat model to use. If None, uses get_llm().
+    Yields:
+        Response message chunks.
+    """
+    charge("llm_calls")
+    tokens = prompt_tokens(prompt)
+    completion = []
+    async with llm_semaphore:
+        async for chunk in llm_endpoint.stream(
+            (model or get_llm()).astream, prompt, tokens=tokens
+        ):
+            completion.append(str(getattr(chunk, "content", "")))
+            yield chunk
+    record_llm_usage(
+        tokens - _COMPLETION_TOKENS_ESTIMATE,
+        count_tokens("".join(completion))
+    )
@@ -2,19 +2,43 @@
 """
 Main FastAPI application for Trust.me API.
 """
+import json
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from agents.search import SearchAgent
 from agents.verifier import VerifierAgent
 from agents.scorer import ScorerAgent
 from agents.scraper import ScraperAgent
-from pydantic import BaseModel
+from retrieval import RetrievalSession
+from budget import RequestBudget, BudgetExceeded, current_budget
+from langchain_setup import endpoints
+from prompt_packing import load_tokenizer
+from resilience import DeadlineExceeded
+from metrics import registry, verification_attempts
+from tracing import TraceMiddleware, span
+import http_client
+import extraction
+from cache import page_cache, result_cache, llm_cache, analysis_key
+from cache import SingleFlight
+from embedding_cache import batching, cached_embeddings
+from jobs import JobManager, create_job_store
+from state import RateLimiter, create_store
+from url_scheduler import domain_stats
+from pydantic import BaseModel, Field
 from collections import defaultdict
 import logging
 
 from config import __VERSION__, __DEBUG_LEVEL__, __N_VALIDATION_RETRIES__
+from config import __RATE_LIMIT__
+from config import __BATCH_MAX_SUBJECTS__, __BATCH_CONCURRENCY__
+from config import __TRACE_HEADER__
+from config import __SCORER_TIME_RESERVE__, __REQUEST_DEADLINE_SLACK__
+from config import __VERIFIER_CANDIDATES__
 
 # Load env variables
 load_dotenv()
@@ -24,13 +48,33 @@ logging.basicConfig(
 )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads the tokenizer (in a thread: it may be downloaded), opens the
+    worker's shared HTTP session, opens the job store and starts the job
+    workers at startup, and stops them at shutdown. Nothing is opened at
+    import, which the gunicorn master does before forking the workers.
+    """
+    await asyncio.to_thread(load_tokenizer)
+    await http_client.open_session()
+    if job_manager.store is None:
+        job_manager.store = await asyncio.to_thread(create_job_store)
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await http_client.close_session()
+    extraction.shutdown_executor()
+
+
 # FastAPI Setup
 app = FastAPI(
     title="Trust.me API",
     version=__VERSION__,
     description=(
         "TrustMe: automatic agentic trust validation for online identities"
-    )
+    ),
+    lifespan=lifespan
 )
 
 
@@ -41,8 +85,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[__TRACE_HEADER__],
 )
 
+# Per-request trace IDs, stage spans and latency metrics
+app.add_middleware(TraceMiddleware)
+
 
 # Data structures setup
 
@@ -69,24 +117,172 @@ class AnalysisResponse(BaseModel):
     details: str  # string representing the LLM details based on search results
 
 
-@app.post("/analyze", response_model=AnalysisResponse)
-async def analyze(request: AnalysisRequest):
-    return await inference(request)
+class BatchRequest(BaseModel):
+    """
+    Request model for the batch analysis endpoint.
+    Attributes:
+        requests: Analyses to run (at most __BATCH_MAX_SUBJECTS__)
+        concurrency: Analyses of the batch run at once
+    """
+    requests: list[AnalysisRequest] = Field(
+        min_length=1, max_length=__BATCH_MAX_SUBJECTS__
+    )
+    concurrency: int = Field(
+        __BATCH_CONCURRENCY__, ge=1, le=__BATCH_CONCURRENCY__
+    )
+
+
+class JobRequest(AnalysisRequest):
+    """
+    Request model for the analysis job endpoint.
+    Attributes:
+        priority: Higher priority jobs run first (default 0)
+    """
+    priority: int = 0
+
+
+class JobResponse(BaseModel):
+    """
+    Response model for the analysis job endpoints.
+    Attributes:
+        id: Job identifier
+        status: queued, running, done or failed
+        result: AnalysisResponse, once done
+        error: Error message, if failed
+    """
+    id: str
+    status: str
+    priority: int
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: AnalysisResponse | None = None
+    error: str | None = None
+
+
+# Analyses per client per minute, counted in the shared state store so that
+# the limit holds across workers
+rate_limiter = (
+    RateLimiter(create_store("ratelimit"), __RATE_LIMIT__)
+    if __RATE_LIMIT__ else None
+)
+
+
+async def rate_limit(http_request: Request) -> None:
+    """
+    Rejects clients above __RATE_LIMIT__ analyses per minute with 429.
+    If the state store is unreachable, requests are let through.
+    """
+    if rate_limiter is None:
+        return
+    client = http_request.client.host if http_request.client else "unknown"
+    try:
+        allowed = await asyncio.to_thread(rate_limiter.hit, client)
+    except Exception as e:
+        logging.warning(f"Rate limiter unavailable: {e}")
+        return
+    if not allowed:
+        raise HTTPException(status_code=429, detail="Too many requests")
+
 
+@app.post(
+    "/analyze", response_model=AnalysisResponse,
+    dependencies=[Depends(rate_limit)]
+)
+async def analyze(request: AnalysisRequest, refresh: bool = False):
+    """
+    Trust analysis endpoint. Results are cached (see cached_inference);
+    pass refresh=true to bypass the cache.
+    """
+    return await cached_inference(request, refresh=refresh)
 
-async def inference(request: AnalysisRequest):
+
+# Concurrent identical analyses share one pipeline execution
+result_flights = SingleFlight()
+
+
+def result_key(request: AnalysisRequest) -> str:
+    """
+    Result cache key: API version plus the normalized analysis inputs.
+    """
+    return f"{__VERSION__}:" + analysis_key(
+        request.subject, request.context, request.language
+    )
+
+
+async def store_result(key: str, response: AnalysisResponse) -> None:
+    """
+    Caches a successful analysis. Failed analyses (score 0) are not cached.
+    """
+    if response.trust_score:
+        await result_cache.set(key, response.model_dump_json())
+
+
+async def cached_inference(
+    request: AnalysisRequest, refresh: bool = False, queries=None
+):
+    """
+    Runs inference behind the result cache. Identical concurrent requests
+    are coalesced into one execution.
+    Args:
+        request: AnalysisRequest object.
+        refresh: If True, skips the cache lookup and coalescing, and stores
+        the new result.
+        queries: Search queries already generated for the request, if any.
+    Returns:
+        AnalysisResponse with trust_score and details.
+    """
+    key = result_key(request)
+
+    async def run():
+        response = await inference(request, queries=queries)
+        await store_result(key, response)
+        return response
+
+    if refresh:
+        return await run()
+
+    cached = await result_cache.get(key)
+    if cached is not None:
+        logging.info("Result cache hit.")
+        return AnalysisResponse.model_validate_json(cached)
+    return await result_flights.do(key, run)
+
+
+async def inference(request: AnalysisRequest, emit=None, queries=None):
     """
     Main endpoint for trust analysis.
     Orchestrates search, scraping, validation, and scoring using agent classes.
+    When validation fails, retries search only the verifier's suggested_retry
+    query and merge the new chunks into the evidence already collected;
+    without one, the queries are generated again (bypassing the LLM cache).
+    A retry that brings no new evidence is not verified again.
+    The whole analysis is bounded by a RequestBudget (time and calls);
+    searching and verifying stop early enough to leave the scoring
+    __SCORER_TIME_RESERVE__ seconds.
     Requires environment variables for all agent classes (see docstrings).
     Args:
         request: AnalysisRequest object containing subject and context.
+        emit: Optional async callback receiving (event, data) as each stage
+        completes (see analysis_events).
+        queries: Search queries of the first attempt, if already generated
+        (see batch_events). If empty, they are generated here.
     Returns:
         AnalysisResponse with trust_score and details.
     """
 
     logging.info("Beginning scoring of subject...")
 
+    async def notify(event, **data):
+        if emit is not None:
+            await emit(event, data)
+
+    async def on_page(url, text):
+        await notify("page", url=url, ok=text is not None)
+
+    async def on_token(text):
+        await notify("score_token", text=text)
+
     checked = False
     counter = 0
     checked_data = None
@@ -95,18 +291,55 @@ async def inference(request: AnalysisRequest):
     verification_log = defaultdict(list)
     verification_log["searches"] = []
     verification_log["whys"] = []
+    retrieval_session = RetrievalSession()
+    retry_query = None
+    verifications = 0
+    budget = RequestBudget()
+    budget_token = current_budget.set(budget)
 
     try:
         while not checked:
-            logging.info("Beginning SerpAPI Searches.")
-            search_results = await SearchAgent().run(
-                request.subject, request.context, request.language
-            )
-
-            logging.info("Beginning Scraping and Preprocessing.")
-            scraped_data = await ScraperAgent().run(
-                search_results,
-                request.subject + request.context
+            if retry_query:
+                # Incremental retry: only the verifier's follow-up query,
+                # merged into the evidence collected so far
+                logging.info(f"Beginning retry search: {retry_query}")
+                queries = [f'"{request.subject}" {retry_query}']
+            else:
+                logging.info("Beginning SerpAPI Searches.")
+                if counter or not queries:
+                    # a retry needs new queries, not the cached ones
+                    with span("queries"):
+                        queries = await budget.limit(
+                            SearchAgent().define_queries(
+                                request.subject, request.context,
+                                request.language, cache=not counter
+                            ),
+                            reserve=__SCORER_TIME_RESERVE__
+                        )
+            await notify("queries", attempt=counter, queries=queries)
+
+            async def on_urls(urls, attempt=counter):
+                await notify("urls", attempt=attempt, urls=[urls])
+
+            # Pipelined: each query's pages download as soon as it returns,
+            # and the slowest ones are dropped once evidence is sufficient
+            logging.info("Beginning Searches, Scraping and Preprocessing.")
+            evidence_size = len(retrieval_session)
+            with span("scrape"):
+                scraped_data = await budget.limit(
+                    ScraperAgent().run_pipeline(
+                        SearchAgent().stream_queries(queries),
+                        f"{request.subject} {request.context}",
+                        n_chunks=__VERIFIER_CANDIDATES__,
+                        session=retrieval_session,
+                        on_page=on_page if emit is not None else None,
+                        on_urls=on_urls if emit is not None else None,
+                        n_queries=len(queries)
+                    ),
+                    reserve=__SCORER_TIME_RESERVE__
+                )
+            await notify(
+                "evidence", attempt=counter, chunks=len(retrieval_session)
             )
 
             logging.debug(f"scraped_data: {scraped_data}")
@@ -117,12 +350,39 @@ async def inference(request: AnalysisRequest):
                     details="Nessun dato recuperato dalle fonti."
                 )
 
+            if counter and len(retrieval_session) == evidence_size:
+                # The retry (follow-up or regenerated queries) brought no
+                # new evidence: the verdict would not change, so regenerate
+                # the queries instead of verifying again
+                logging.info("Retry found no new evidence.")
+                retry_query = None
+                if (counter > __N_VALIDATION_RETRIES__
+                        or budget.exhausted(__SCORER_TIME_RESERVE__)):
+                    checked = None
+                    break
+                counter += 1
+                continue
+
             logging.info("Beginning Validation.")
-            checked_data = await VerifierAgent().run(
-                scraped_data, request.language
-            )
+            with span("verify"):
+                checked_data = await budget.limit(
+                    VerifierAgent().run(scraped_data, request.language),
+                    reserve=__SCORER_TIME_RESERVE__
+                )
+            verifications += 1
 
             logging.debug(f"checked_data: {checked_data}")
+            if checked_data:
+                error_details = checked_data.get("error_details")
+                await notify(
+                    "verification",
+                    attempt=counter,
+                    verified=checked_data.get("verified") == "OK",
+                    error_details=(
+                        error_details if isinstance(error_details, dict)
+                        else None
+                    )
+                )
             if not checked_data or not checked_data.get("data"):
                 logging.warning("Validation returned no data.")
                 return AnalysisResponse(
@@ -134,15 +394,18 @@ async def inference(request: AnalysisRequest):
                 checked = True
                 verification_log["searches"].append(checked_data["data"])
             else:
+                error_details = checked_data["error_details"]
+                if not isinstance(error_details, dict):
+                    error_details = {"whys": [str(error_details)]}
                 verification_log["searches"].append(checked_data["data"])
-                verification_log["whys"].append(
-                    checked_data["error_details"]["whys"]
-                )
-                if counter > __N_VALIDATION_RETRIES__:
+                verification_log["whys"].append(error_details.get("whys"))
+                if (counter > __N_VALIDATION_RETRIES__
+                        or budget.exhausted(__SCORER_TIME_RESERVE__)):
                     checked = None
                     break
                 else:
                     counter += 1
+                    retry_query = error_details.get("suggested_retry")
 
         if not checked:
             logging.warning("Validation failed or exceeded timeout.")
@@ -154,9 +417,13 @@ async def inference(request: AnalysisRequest):
             )
 
         logging.info("Beginning Scoring.")
-        score, details = await ScorerAgent().run(
-            verification_log, request.language
-        )
+        with span("score"):
+            score, details = await budget.limit(
+                ScorerAgent().run(
+                    verification_log, request.language,
+                    on_token=on_token if emit is not None else None
+                )
+            )
 
         if not details or not score:
             logging.warning("Scoring failed or returned no details.")
@@ -167,9 +434,242 @@ async def inference(request: AnalysisRequest):
 
         logging.info("Analysis complete.")
         return AnalysisResponse(trust_score=score, details=details)
+    except (BudgetExceeded, DeadlineExceeded) as e:
+        if (isinstance(e, DeadlineExceeded)
+                and not budget.exhausted(__REQUEST_DEADLINE_SLACK__)):
+            # an upstream giving up with time left is a failure, not the
+            # budget's: only deadlines cut short by the budget give a score
+            logging.error(e)
+            raise HTTPException(status_code=500, detail=str(e))
+        logging.warning(f"Request budget exceeded: {e}")
+        return AnalysisResponse(
+            trust_score=0.0,
+            details=("Validazione non disponibile o "
+                     "nessun risultato prodotto."
+                     )
+        )
     except Exception as e:
         logging.error(e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        current_budget.reset(budget_token)
+        if verifications:
+            verification_attempts.observe(verifications)
+
+
+@app.post("/analyze/stream", dependencies=[Depends(rate_limit)])
+async def analyze_stream(request: AnalysisRequest, refresh: bool = False):
+    """
+    Streaming variant of /analyze, using Server-Sent Events.
+    Emits 'queries', 'urls' (once per query), 'page', 'evidence' and
+    'verification' events for each attempt, 'score_token' events while the
+    scorer explanation is generated, then a final 'result'
+    (AnalysisResponse) or 'error' event.
+    A cached result is sent right away as the 'result' event, unless
+    refresh=true. Closing the connection cancels the analysis.
+    """
+    return StreamingResponse(
+        analysis_events(request, refresh=refresh),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Formats a Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def analysis_events(request: AnalysisRequest, refresh: bool = False):
+    """
+    Runs inference in a background task and yields its stage events as SSE.
+    The task is cancelled if the consumer stops early (client disconnect).
+    Args:
+        request: AnalysisRequest object.
+        refresh: If True, skips the result cache lookup.
+    Yields:
+        str: Server-Sent Events.
+    """
+    key = result_key(request)
+    if not refresh:
+        cached = await result_cache.get(key)
+        if cached is not None:
+            yield sse_event("result", json.loads(cached))
+            return
+
+    queue = asyncio.Queue()
+
+    async def emit(event, data):
+        await queue.put((event, data))
+
+    task = asyncio.create_task(inference(request, emit=emit))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (item := await queue.get()) is not None:
+            yield sse_event(*item)
+        try:
+            response = task.result()
+            await store_result(key, response)
+            yield sse_event("result", response.model_dump())
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail})
+    finally:
+        if not task.done():
+            logging.info("Stream closed by client: cancelling analysis.")
+            task.cancel()
+
+
+@app.post("/analyze/batch", dependencies=[Depends(rate_limit)])
+async def analyze_batch(request: BatchRequest, refresh: bool = False):
+    """
+    Batch variant of /analyze for many subjects, using Server-Sent Events.
+    Emits a 'result' event ({index, subject, result}) or an 'error' event
+    ({index, subject, detail}) as each analysis finishes, then 'done'.
+    Cached results are sent first, unless refresh=true. Closing the
+    connection cancels the analyses still running.
+    """
+    return StreamingResponse(
+        batch_events(request, refresh=refresh),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def batch_queries(
+    requests: dict[int, AnalysisRequest]
+) -> dict[int, list[str]]:
+    """
+    Generates the search queries of many analyses with grouped prompts,
+    one group per language (see SearchAgent.define_queries_batch).
+    Args:
+        requests: Analyses by index.
+    Returns:
+        Queries by index; empty for the analyses the model skipped.
+    """
+    by_language = defaultdict(list)
+    for index, request in requests.items():
+        by_language[request.language].append(index)
+    agent = SearchAgent()
+
+    async def define(language, indexes):
+        queries = await agent.define_queries_batch(
+            [(requests[i].subject, requests[i].context) for i in indexes],
+            language
+        )
+        return dict(zip(indexes, queries))
+
+    results = {}
+    with span("queries"):
+        groups = await asyncio.gather(*[
+            define(language, indexes)
+            for language, indexes in by_language.items()
+        ])
+    for group in groups:
+        results.update(group)
+    return results
+
+
+async def batch_events(batch: BatchRequest, refresh: bool = False):
+    """
+    Runs the analyses of a batch and yields each result as SSE when it
+    finishes. The analyses share the worker's HTTP pool, page cache and
+    embedding calls (see BatchedEmbeddings); their search queries are
+    generated with grouped prompts, and at most batch.concurrency of them
+    run at once.
+    Args:
+        batch: BatchRequest object.
+        refresh: If True, skips the result cache lookups.
+    Yields:
+        str: Server-Sent Events.
+    """
+    pending = {}
+    for index, request in enumerate(batch.requests):
+        cached = None if refresh else await result_cache.get(
+            result_key(request)
+        )
+        if cached is None:
+            pending[index] = request
+        else:
+            yield sse_event("result", {
+                "index": index, "subject": request.subject,
+                "result": json.loads(cached),
+            })
+
+    queries = await batch_queries(pending) if pending else {}
+    semaphore = asyncio.Semaphore(batch.concurrency)
+
+    async def run(index, request):
+        # in this task's context only
+        batching.set(True)
+        async with semaphore:
+            try:
+                response = await cached_inference(
+                    request, refresh=refresh, queries=queries.get(index)
+                )
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                return sse_event("error", {
+                    "index": index, "subject": request.subject,
+                    "detail": detail,
+                })
+        return sse_event("result", {
+            "index": index, "subject": request.subject,
+            "result": response.model_dump(),
+        })
+
+    tasks = [
+        asyncio.create_task(run(index, request))
+        for index, request in pending.items()
+    ]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+        yield sse_event("done", {"count": len(batch.requests)})
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def run_job(request: dict) -> dict:
+    """
+    Runs one queued analysis for the job manager.
+    """
+    response = await cached_inference(AnalysisRequest(**request))
+    return response.model_dump()
+
+
+# its store is opened by each worker, in the lifespan
+job_manager = JobManager(None, run_job)
+
+
+@app.post(
+    "/analyses", response_model=JobResponse, status_code=202,
+    dependencies=[Depends(rate_limit)]
+)
+async def submit_analysis(request: JobRequest):
+    """
+    Queues an analysis and returns its job right away.
+    An identical analysis already queued or running is returned instead of
+    starting a new one.
+    """
+    job = await job_manager.submit(
+        request.model_dump(exclude={"priority"}), priority=request.priority
+    )
+    return JobResponse(**vars(job))
+
+
+@app.get("/analyses/{job_id}", response_model=JobResponse)
+async def get_analysis(job_id: str):
+    """
+    Returns the status of an analysis job, and its result once done.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(**vars(job))
 
 
 @app.get("/health")
@@ -181,6 +681,93 @@ def health():
     return {"status": "ok", "version": __VERSION__}
 
 
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Cache statistics endpoint.
+    Returns hit/miss counters and sizes for each cache of this worker.
+    """
+    return {
+        "pages": page_cache.stats(),
+        "embeddings": cached_embeddings.stats(),
+        "llm": llm_cache.stats(),
+        "results": {
+            **result_cache.stats(),
+            "coalesced": result_flights.coalesced,
+            "in_flight": len(result_flights),
+        },
+    }
+
+
+@app.get("/upstream/stats")
+def upstream_stats():
+    """
+    Upstream API statistics endpoint.
+    Returns call outcomes, circuit state and available rate limit for each
+    upstream API (LLM, embeddings, search) of this worker, and the
+    download history of the slowest page domains.
+    """
+    stats = {endpoint.name: endpoint.stats() for endpoint in endpoints}
+    stats["domains"] = domain_stats.stats()
+    return stats
+
+
+# Mirrors of the cache and upstream counters, refreshed at each scrape
+cache_hits = registry.counter(
+    "trustme_cache_hits_total", "Cache hits by cache and tier.",
+    ("cache", "tier")
+)
+cache_misses = registry.counter(
+    "trustme_cache_misses_total", "Cache misses by cache.", ("cache",)
+)
+upstream_events = registry.counter(
+    "trustme_upstream_events_total",
+    "Upstream API call outcomes (calls, retries, throttled, ...).",
+    ("endpoint", "event")
+)
+upstream_wait = registry.counter(
+    "trustme_upstream_wait_seconds_total",
+    "Time spent waiting for upstream rate limits.", ("endpoint",)
+)
+circuit_state = registry.gauge(
+    "trustme_upstream_circuit_state",
+    "Circuit breaker state: 0 closed, 1 half open, 2 open.", ("endpoint",)
+)
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+@registry.collector
+def collect_stats() -> None:
+    for name, stats in (
+        ("pages", page_cache.stats()),
+        ("embeddings", cached_embeddings.stats()),
+        ("results", result_cache.stats()),
+        ("llm", llm_cache.stats()),
+    ):
+        cache_hits.set(stats["memory_hits"], name, "memory")
+        cache_hits.set(stats["shared_hits"], name, "shared")
+        cache_misses.set(stats["misses"], name)
+    for endpoint in endpoints:
+        stats = endpoint.stats()
+        for event in ("calls", "successes", "failures", "retries",
+                      "throttled", "transient", "timeouts", "rejected"):
+            upstream_events.set(stats[event], endpoint.name, event)
+        upstream_wait.set(stats["wait_seconds"], endpoint.name)
+        circuit_state.set(_CIRCUIT_STATES[stats["circuit"]], endpoint.name)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics endpoint for this worker: request and stage latency
+    histograms, LLM and embedding tokens with their estimated cost, pages
+    fetched, cache hits and upstream call outcomes.
+    """
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.get("/")
 def main_page():
     """
@@ -0,0 +1,184 @@
+
+"""
+Process metrics in the Prometheus text format: counters and histograms
+updated on the hot path, plus collectors reading the stats of the caches
+and upstream endpoints when /metrics is scraped.
+"""
+import bisect
+import math
+
+# Latency buckets, in seconds
+TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120
+)
+
+
+def _escape(value) -> str:
+    return (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, value: float, *labels) -> None:
+        """
+        Sets the value, for collectors mirroring a count kept elsewhere.
+        """
+        self._values[labels] = value
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.label_names, labels)} " \
+                  f"{_number(value)}"
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets, optionally split by labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labels: tuple = (),
+        buckets: tuple = TIME_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the buckets, sum, count]
+        self._series = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket" \
+                      f"{_labels(self.label_names, labels, le)} {cumulative}"
+            suffix = _labels(self.label_names, labels)
+            yield f"{self.name}_sum{suffix} {_number(series[-2])}"
+            yield f"{self.name}_count{suffix} {series[-1]}"
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down.
+    """
+
+    kind = "gauge"
+
+
+class Registry:
+    """
+    Metrics of the worker process, rendered by /metrics.
+    Collectors are called at each scrape to refresh the metrics that mirror
+    other components' stats.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        """
+        Registers fn(), called before each render. Usable as a decorator.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    "trustme_request_seconds", "HTTP request latency.",
+    ("route", "method", "status")
+)
+stage_seconds = registry.histogram(
+    "trustme_stage_seconds", "Latency of each analysis stage.", ("stage",)
+)
+verification_attempts = registry.histogram(
+    "trustme_verification_attempts", "Verifier rounds per analysis.",
+    buckets=(1, 2, 3, 5, 8, 13)
+)
+llm_tokens = registry.counter(
+    "trustme_llm_tokens_total", "LLM tokens by analysis stage.",
+    ("stage", "kind")
+)
+embedding_tokens = registry.counter(
+    "trustme_embedding_tokens_total", "Tokens sent to the embedding model."
+)
+cost_usd = registry.counter(
+    "trustme_cost_usd_total", "Estimated upstream cost in USD.", ("model",)
+)
+pages = registry.counter(
+    "trustme_pages_total", "Pages fetched, by outcome.", ("outcome",)
+)
+page_bytes = registry.counter(
+    "trustme_page_bytes_total", "Bytes of HTML downloaded."
+)
@@ -0,0 +1,72 @@
+
+"""
+Per-process lazy values: clients and connections created on first use in
+each worker process, so that a gunicorn master loading the app before
+forking (preload_app) never hands its own to the workers.
+"""
+import os
+import threading
+
+
+class ProcessLocal:
+    """
+    Value created by factory() on first use in each process.
+    After a fork the child creates its own on first use; the inherited one
+    is kept referenced but never closed, since closing e.g. a SQLite
+    connection in the child can release the parent's file locks.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._pid = None
+        self._value = None
+        self._inherited = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns this process' value, creating it if needed.
+        """
+        pid = os.getpid()
+        if self._pid != pid:
+            if self._pid is not None:
+                # the lock may have been held by another thread at fork
+                self._lock = threading.Lock()
+            with self._lock:
+                if self._pid != pid:
+                    if self._pid is not None:
+                        self._inherited.append(self._value)
+                    self._value = self.factory()
+                    self._pid = pid
+        return self._value
+
+    def created(self) -> bool:
+        """
+        Whether the value was already created in this process.
+        """
+        return self._pid == os.getpid()
+
+    def reset(self) -> None:
+        """
+        Forgets the value, so that the next get() creates a new one.
+        """
+        with self._lock:
+            self._pid = None
+            self._value = None
+
+
+def per_process(factory):
+    """
+    Decorator turning a zero-argument factory into a getter returning the
+    same instance within a process and a new one in each forked worker.
+    The ProcessLocal is available as the getter's `local` attribute.
+    """
+    local = ProcessLocal(factory)
+
+    def get():
+        return local.get()
+
+    get.__name__ = factory.__name__
+    get.__doc__ = factory.__doc__
+    get.local = local
+    return get
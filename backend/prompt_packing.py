@@ -0,0 +1,211 @@
+
+"""
+Prompt packing: fits ranked evidence chunks into a token budget.
+"""
+import json
+import logging
+from functools import lru_cache
+
+from langchain_core.documents import Document
+
+from config import __TOKENIZER_ENCODING__
+
+# Conservative estimate used without a tokenizer: BPE tokens average more
+# than 3 bytes of text in the languages the agents handle
+_BYTES_PER_TOKEN = 3
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(__TOKENIZER_ENCODING__)
+    except Exception as e:
+        # logged once: the failure is cached like the encoding
+        logging.warning(f"Tokenizer unavailable, estimating tokens: {e}")
+        return None
+
+
+def load_tokenizer() -> bool:
+    """
+    Loads the tokenizer encoding, downloading it on first use, so that no
+    request waits for it. Blocking: called at startup, off the event loop.
+    Returns:
+        bool: True if tokens are counted with the tokenizer, False if they
+        are estimated.
+    """
+    return _encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with the local tokenizer (tiktoken), or
+    overestimates them from its size when the tokenizer is unavailable.
+    """
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    return -(-len(text.encode("utf-8")) // _BYTES_PER_TOKEN)
+
+
+def as_documents(chunks) -> list[Document]:
+    """
+    Normalizes evidence chunks (Documents or strings) into Documents,
+    dropping empty ones.
+    """
+    if not isinstance(chunks, list):
+        chunks = [chunks]
+    return [
+        chunk if isinstance(chunk, Document)
+        else Document(page_content=str(chunk))
+        for chunk in chunks
+        if chunk and (not isinstance(chunk, Document) or chunk.page_content)
+    ]
+
+
+def format_chunk(chunk: Document) -> str:
+    """
+    Renders a chunk with its source, as shown to the LLM.
+    """
+    source = chunk.metadata.get("source")
+    if source:
+        return f"{chunk.page_content} (source: {source})"
+    return chunk.page_content
+
+
+def chunk_cost(chunk: Document) -> int:
+    """
+    Tokens a chunk takes in a prompt: its JSON string and a separator.
+    """
+    return count_tokens(
+        json.dumps(format_chunk(chunk), ensure_ascii=False)
+    ) + 1
+
+
+def pack_chunks(chunks: list[Document], budget: int) -> list[Document]:
+    """
+    Selects the chunks to include in a prompt: best retrieval score first,
+    each text once, until the token budget is spent. A chunk that does not
+    fit is skipped and smaller ones are still tried.
+    Args:
+        chunks (list[Document]): Candidate chunks, with an optional 'score'
+        in the metadata (higher is better). Ties keep their order.
+        budget (int): Tokens available for the chunks.
+    Returns:
+        list[Document]: Selected chunks, best first.
+    """
+    ranked = sorted(
+        enumerate(chunks),
+        key=lambda item: (-item[1].metadata.get("score", 0.0), item[0])
+    )
+    packed = []
+    seen = set()
+    for _, chunk in ranked:
+        if chunk.page_content in seen:
+            continue
+        cost = chunk_cost(chunk)
+        if cost > budget:
+            continue
+        seen.add(chunk.page_content)
+        packed.append(chunk)
+        budget -= cost
+    return packed
+
+
+def render_chunks(chunks: list[Document]) -> str:
+    """
+    Renders packed chunks as the JSON list given to the prompts.
+    """
+    return json.dumps([format_chunk(chunk) for chunk in chunks],
+                      ensure_ascii=False)
+
+
+def chunk_budget(template, budget: int, **variables) -> int:
+    """
+    Tokens left for the chunks once the rest of the prompt is filled in.
+    Args:
+        template (PromptTemplate): Prompt template.
+        budget (int): Token budget of the whole prompt.
+        **variables: Template variables other than the chunks, which must be
+        the only one missing.
+    Returns:
+        int: Tokens available for the chunks.
+    """
+    missing = [
+        name for name in template.input_variables if name not in variables
+    ]
+    overhead = count_tokens(
+        template.format(**variables, **{name: "" for name in missing})
+    )
+    return max(0, budget - overhead)
+
+
+def shard_chunks(
+    chunks: list[Document], budget: int, max_shards: int, key=None,
+    max_chunks: int | None = None
+) -> list[list[Document]]:
+    """
+    Splits ranked chunks into the fewest shards (at most max_shards) of at
+    most budget tokens and max_chunks chunks each, keeping the chunks of a
+    group together when they fit in one shard. Groups go largest first to
+    the least loaded shard, so that the shards have similar sizes.
+    Args:
+        chunks (list[Document]): Chunks, best first (see pack_chunks).
+        budget (int): Tokens available for the chunks of each shard.
+        max_shards (int): Maximum number of shards.
+        key: Optional callable returning the group of a chunk, e.g. its
+        source domain. Without it, each chunk is its own group.
+        max_chunks (int): Maximum number of chunks of each shard (None: no
+        limit).
+    Returns:
+        list[list[Document]]: Shards, each best first, the shard with the
+        best chunk first. Chunks that fit in no shard (larger than budget,
+        or beyond max_shards shards) are left out.
+    """
+    max_chunks = max_chunks or len(chunks) or 1
+    costs = [chunk_cost(chunk) for chunk in chunks]
+    groups = {}
+    for i, chunk in enumerate(chunks):
+        if costs[i] > budget:
+            continue
+        groups.setdefault(key(chunk) if key else i, []).append(i)
+    # groups larger than a shard are cut into shard-sized pieces
+    pieces = []
+    for members in groups.values():
+        piece, size = [], 0
+        for i in members:
+            if piece and (size + costs[i] > budget
+                          or len(piece) >= max_chunks):
+                pieces.append((size, piece))
+                piece, size = [], 0
+            piece.append(i)
+            size += costs[i]
+        pieces.append((size, piece))
+    pieces.sort(key=lambda piece: (-piece[0], piece[1][0]))
+
+    total = sum(size for size, _ in pieces)
+    count = sum(len(piece) for _, piece in pieces)
+    n = max(1, min(max_shards, max(
+        -(-total // max(budget, 1)), -(-count // max_chunks)
+    )))
+    while True:
+        shards = [[0, []] for _ in range(n)]
+        left = []
+        for size, piece in pieces:
+            fits = [
+                shard for shard in shards if shard[0] + size <= budget
+                and len(shard[1]) + len(piece) <= max_chunks
+            ]
+            if fits:
+                shard = min(fits, key=lambda shard: shard[0])
+                shard[0] += size
+                shard[1].extend(piece)
+            else:
+                left.append(piece)
+        if not left or n >= max_shards:
+            break
+        n += 1
+    result = [sorted(members) for _, members in shards if members]
+    result.sort(key=lambda members: members[0])
+    return [[chunks[i] for i in members] for members in result]
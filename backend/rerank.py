@@ -0,0 +1,55 @@
+
+"""
+Optional local cross-encoder reranker, run on CPU off the event loop.
+"""
+import asyncio
+import logging
+import threading
+
+from config import __RERANKER_MODEL__
+from tracing import span
+
+_model = None
+_unavailable = False
+_lock = threading.Lock()
+
+
+def get_reranker(model_name: str | None = __RERANKER_MODEL__):
+    """
+    Returns the cross-encoder, loading it on first use, or None if
+    reranking is disabled or sentence-transformers is not installed.
+    """
+    global _model, _unavailable
+    if not model_name or _unavailable:
+        return None
+    with _lock:
+        if _model is None and not _unavailable:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                _model = CrossEncoder(model_name, device="cpu")
+                logging.info(f"Reranker loaded: {model_name}")
+            except Exception as e:
+                logging.warning(f"Reranker disabled: {e}")
+                _unavailable = True
+    return _model
+
+
+async def rerank(query: str, texts: list[str]) -> list[float] | None:
+    """
+    Scores each text's relevance to the query with the cross-encoder.
+    Args:
+        query (str): Query text.
+        texts (list[str]): Candidate texts.
+    Returns:
+        list[float] | None: One score per text (higher is more relevant),
+        or None if reranking is unavailable.
+    """
+    model = await asyncio.to_thread(get_reranker)
+    if model is None or not texts:
+        return None
+    with span("rerank"):
+        scores = await asyncio.to_thread(
+            model.predict, [(query, text) for text in texts]
+        )
+    return [float(score) for score in scores]
@@ -0,0 +1,475 @@
+
+"""
+Resilience of the upstream calls (Azure OpenAI chat and embeddings, Serper):
+client-side rate limits, retries with jittered exponential backoff, deadlines
+and circuit breakers.
+"""
+import asyncio
+import logging
+import random
+import sys
+import time
+from collections.abc import Callable
+
+import aiohttp
+from langchain_core.embeddings import Embeddings
+
+from budget import current_budget
+from prompt_packing import count_tokens
+from tracing import count, record_embedding_usage
+from config import (
+    __RETRY_MAX_ATTEMPTS__,
+    __RETRY_BACKOFF_BASE__,
+    __RETRY_BACKOFF_CAP__,
+    __CIRCUIT_FAILURE_THRESHOLD__,
+    __CIRCUIT_RESET_TIMEOUT__,
+)
+
+# Errors worth retrying when they carry no HTTP status
+_TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    aiohttp.ClientConnectionError,
+)
+
+# Marks a stream that ended before its first item
+_END = object()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling the upstream while its circuit is open.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a call cannot complete before its deadline.
+    """
+
+
+def classify(error: Exception) -> str | None:
+    """
+    Classifies an upstream error.
+    Returns:
+        str | None: 'throttled' for 429, 'transient' for timeouts, connection
+        errors and 408/5xx responses, None for errors not worth retrying.
+    """
+    status = getattr(error, "status_code", None) or getattr(
+        error, "status", None
+    )
+    if status == 429:
+        return "throttled"
+    if isinstance(status, int) and (status == 408 or status >= 500):
+        return "transient"
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return "transient"
+    # openai is imported with the clients, only once they can raise
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(error, openai.APIConnectionError):
+        return "transient"
+    return None
+
+
+def retry_after(error: Exception) -> float | None:
+    """
+    Seconds to wait requested by the upstream (Retry-After headers), if any.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(
+        error, "headers", None
+    ) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def backoff_delay(
+    attempt: int,
+    base: float = __RETRY_BACKOFF_BASE__,
+    cap: float = __RETRY_BACKOFF_CAP__,
+) -> float:
+    """
+    Exponential backoff with full jitter: uniform in
+    [0, min(cap, base * 2 ** attempt)], so retrying tasks spread out.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Token bucket shared by the tasks of a worker. Waiters are served in
+    arrival order.
+    Attributes:
+        rate: Tokens added per second.
+        capacity: Maximum tokens, i.e. the largest burst.
+        tokens: Tokens available (negative after a debit).
+    """
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = per_minute / 60
+        # one second of quota: upstreams enforce per-minute quotas over
+        # windows of a few seconds
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(
+        self, amount: float = 1.0, timeout: float | None = None
+    ) -> float:
+        """
+        Takes tokens, waiting until they are available. Requests larger
+        than the capacity wait for a full bucket and leave it in debt, so
+        the next callers wait for the excess.
+        Args:
+            amount (float): Tokens to take.
+            timeout (float | None): Maximum seconds to wait.
+        Returns:
+            float: Seconds waited.
+        Raises:
+            DeadlineExceeded: if the tokens would not be available in time.
+        """
+        async with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            wait = max(0.0, (needed - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                raise DeadlineExceeded(
+                    f"rate limit wait of {wait:.1f}s exceeds the deadline"
+                )
+            if wait:
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= amount
+            return wait
+
+    def debit(self, amount: float) -> None:
+        """
+        Takes tokens without waiting, e.g. to settle an estimate with the
+        actual usage (a negative amount gives tokens back).
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after consecutive failures. Once open, calls
+    are rejected until reset_timeout has passed; then a single probe call is
+    let through, which closes the circuit on success or opens it again.
+    Attributes:
+        failures: Consecutive failures.
+        opened_at: Monotonic time the circuit opened, None if closed.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = __CIRCUIT_FAILURE_THRESHOLD__,
+        reset_timeout: float = __CIRCUIT_RESET_TIMEOUT__,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """
+        True if a call may be made now.
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release(self) -> None:
+        """
+        Frees the probe slot of a call that ended without an outcome.
+        """
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class Endpoint:
+    """
+    Guards the calls to one upstream service: request and token rate limits,
+    a timeout per attempt, retries with backoff within a deadline per call,
+    and a circuit breaker. A 429 pauses every caller of the endpoint for the
+    delay the upstream asks, instead of letting each task retry on its own.
+    Attributes:
+        name: Endpoint name, used in logs and metrics.
+        requests: Requests per minute bucket, or None.
+        tokens: Tokens per minute bucket, or None.
+        breaker: The endpoint's circuit breaker.
+        counters: Outcome counters.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        timeout: float = 30.0,
+        deadline: float = 60.0,
+        max_attempts: int = __RETRY_MAX_ATTEMPTS__,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.name = name
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = (
+            TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        )
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self._paused_until = 0.0
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+            "throttled": 0, "transient": 0, "timeouts": 0, "rejected": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _deadline(self) -> float:
+        """
+        Monotonic deadline of a call: its own deadline, or the end of the
+        current request budget if sooner.
+        """
+        seconds = self.deadline
+        budget = current_budget.get()
+        if budget is not None:
+            seconds = min(seconds, budget.remaining())
+        return time.monotonic() + seconds
+
+    async def _admit(self, tokens: float, deadline: float) -> None:
+        started = time.monotonic()
+        pause = self._paused_until - started
+        if pause > 0:
+            if started + pause >= deadline:
+                raise DeadlineExceeded(f"{self.name}: throttled upstream")
+            await asyncio.sleep(pause)
+        if self.requests is not None:
+            await self.requests.acquire(1, deadline - time.monotonic())
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens, deadline - time.monotonic())
+        self.counters["wait_seconds"] += time.monotonic() - started
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError(f"{self.name}: circuit open")
+
+    def settle(self, estimated: float, actual: float | None) -> None:
+        """
+        Corrects the tokens charged for a call with its actual usage.
+        """
+        if self.tokens is not None and actual is not None:
+            self.tokens.debit(actual - estimated)
+
+    async def call(self, fn, *args, tokens: float = 0, **kwargs):
+        """
+        Awaits fn(*args, **kwargs) under the endpoint's limits, retrying
+        throttled and transient failures until the deadline.
+        Args:
+            fn: Coroutine function calling the upstream.
+            tokens (float): Estimated tokens of the call.
+        Returns:
+            The result of fn.
+        Raises:
+            CircuitOpenError: if the circuit is open.
+            DeadlineExceeded: if the call could not complete in time.
+            Exception: the upstream error, if not retryable or out of
+            attempts.
+        """
+        deadline = self._deadline()
+        for attempt in range(self.max_attempts):
+            try:
+                await self._admit(tokens, deadline)
+            except DeadlineExceeded:
+                self.counters["timeouts"] += 1
+                raise
+            self.counters["calls"] += 1
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    fn(*args, **kwargs), timeout=min(self.timeout, remaining)
+                )
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                delay = self._failed(e, attempt)
+                if delay is None or time.monotonic() + delay >= deadline:
+                    self.counters["failures"] += 1
+                    if isinstance(e, TimeoutError):
+                        raise DeadlineExceeded(
+                            f"{self.name}: no response in time"
+                        ) from e
+                    raise
+                logging.info(
+                    f"{self.name}: retrying in {delay:.1f}s after {e!r}"
+                )
+                self.counters["retries"] += 1
+                count("upstream_retries")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.counters["successes"] += 1
+            return result
+
+    def _failed(self, error: Exception, attempt: int) -> float | None:
+        """
+        Records a failed attempt.
+        Returns:
+            float | None: Seconds to wait before retrying, or None if the
+            call should not be retried.
+        """
+        kind = classify(error)
+        if kind is None:
+            # the upstream answered: the request itself is at fault
+            self.breaker.record_success()
+            return None
+        self.counters[kind] += 1
+        if isinstance(error, TimeoutError):
+            self.counters["timeouts"] += 1
+        delay = backoff_delay(attempt)
+        if kind == "throttled":
+            delay = max(delay, retry_after(error) or 0.0)
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + delay
+            )
+            # throttling is not an outage: leave the circuit as it is
+            self.breaker.release()
+        else:
+            self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts:
+            return None
+        return delay
+
+    async def stream(self, fn, *args, tokens: float = 0, **kwargs):
+        """
+        Iterates fn(*args, **kwargs) under the endpoint's limits. Failures
+        are retried until the first item arrives, not after.
+        Args:
+            fn: Function returning an async iterator over the upstream.
+            tokens (float): Estimated tokens of the call.
+        Yields:
+            The items of the iterator.
+        """
+        async def first():
+            iterator = aiter(fn(*args, **kwargs))
+            try:
+                return iterator, await anext(iterator)
+            except StopAsyncIteration:
+                return iterator, _END
+            except BaseException:
+                aclose = getattr(iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+                raise
+
+        iterator, item = await self.call(first, tokens=tokens)
+        if item is _END:
+            return
+        yield item
+        async for item in iterator:
+            yield item
+
+    def stats(self) -> dict:
+        """
+        Returns the endpoint's counters, circuit state and available rate.
+        """
+        return {
+            **self.counters,
+            "circuit": self.breaker.state,
+            "paused_seconds": max(
+                0.0, self._paused_until - time.monotonic()
+            ),
+            "requests_available": (
+                self.requests.tokens if self.requests else None
+            ),
+            "tokens_available": self.tokens.tokens if self.tokens else None,
+        }
+
+
+class ResilientEmbeddings(Embeddings):
+    """
+    Embeddings wrapper sending the async calls through an Endpoint, charged
+    with the tokens of the texts. Sync calls go straight to the model.
+    The model can be given as a getter (e.g. a per-process lazy client),
+    called at each use; its deployment name is then passed explicitly.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings | Callable[[], Embeddings],
+        endpoint: Endpoint,
+        deployment: str | None = None,
+    ):
+        self._underlying = underlying
+        self.endpoint = endpoint
+        # keeps the cache keys of CachedEmbeddings
+        self.deployment = (
+            deployment or getattr(underlying, "deployment", None)
+        )
+        self.model = getattr(underlying, "model", None)
+
+    @property
+    def underlying(self) -> Embeddings:
+        if isinstance(self._underlying, Embeddings):
+            return self._underlying
+        return self._underlying()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        tokens = sum(count_tokens(text) for text in texts)
+        vectors = await self.endpoint.call(
+            self.underlying.aembed_documents, texts, tokens=tokens
+        )
+        record_embedding_usage(tokens)
+        return vectors
+
+    async def aembed_query(self, text: str) -> list[float]:
+        tokens = count_tokens(text)
+        vector = await self.endpoint.call(
+            self.underlying.aembed_query, text, tokens=tokens
+        )
+        record_embedding_usage(tokens)
+        return vector
@@ -0,0 +1,267 @@
+
+"""
+Retrieval session: incremental hybrid (BM25 + vector) index scoped to one
+analysis.
+"""
+import asyncio
+import logging
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from dedup import NearDuplicateIndex
+from embedding_cache import cached_embeddings
+from rerank import rerank
+from tracing import span
+from config import (
+    __RETRIEVAL_INDEX__,
+    __RETRIEVAL_ANN_THRESHOLD__,
+    __RETRIEVAL_HNSW_M__,
+    __RETRIEVAL_MODE__,
+    __RETRIEVAL_CANDIDATES__,
+    __RETRIEVAL_RRF_K__,
+    __EMBEDDING_TIMEOUT__,
+)
+
+
+class RetrievalSession:
+    """
+    Vector and BM25 indexes that grow as new chunks arrive and are queried
+    in place, instead of being rebuilt for every scrape.
+    The vector index kind is chosen from the corpus size: exact (flat)
+    search for small corpora, approximate (HNSW or IVF) search once the
+    corpus exceeds __RETRIEVAL_ANN_THRESHOLD__ vectors.
+    In 'hybrid' mode the BM25 and vector rankings are fused (reciprocal rank
+    fusion), then optionally reranked (see rerank). If the embedding
+    endpoint fails or exceeds __EMBEDDING_TIMEOUT__, the session goes on
+    with BM25 alone.
+    Attributes:
+        texts: Indexed chunks, in insertion order.
+        sources: Source URL of each indexed chunk, when known.
+        seen_urls: Keys of the URLs already scraped for this analysis
+        (see url_scheduler.url_key).
+        near_duplicates: MinHash index of the chunks seen so far, used to
+        drop near-duplicates before they are embedded.
+        index_kind: 'flat', 'hnsw' or 'ivf'.
+        mode: 'hybrid', 'vector' or 'bm25'.
+        vectors_enabled: False once embeddings are off or have failed.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings = cached_embeddings,
+        index: str = __RETRIEVAL_INDEX__,
+        ann_threshold: int = __RETRIEVAL_ANN_THRESHOLD__,
+        mode: str = __RETRIEVAL_MODE__,
+    ):
+        """
+        Args:
+            embeddings (Embeddings): Embedding model for chunks and queries.
+            index (str): 'auto', 'flat', 'hnsw' or 'ivf'.
+            ann_threshold (int): Corpus size above which 'auto' switches
+            from flat to HNSW.
+            mode (str): 'hybrid', 'vector' or 'bm25' (no embeddings).
+        """
+        if index not in ("auto", "flat", "hnsw", "ivf"):
+            raise ValueError(f"Unknown index kind: {index}")
+        if mode not in ("hybrid", "vector", "bm25"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        self.embeddings = embeddings
+        self.mode = mode
+        self.vectors_enabled = mode != "bm25"
+        self.bm25 = BM25Index()
+        self.index_setting = index
+        self.ann_threshold = ann_threshold
+        self.texts: list[str] = []
+        self.sources: dict[str, str] = {}
+        self.seen_urls: set[str] = set()
+        self.near_duplicates = NearDuplicateIndex()
+        self.index_kind = None
+        self._index = None
+        self._vectors = None
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def _target_kind(self, size: int) -> str:
+        if self.index_setting == "auto":
+            return "hnsw" if size > self.ann_threshold else "flat"
+        if self.index_setting != "flat" and size <= self.ann_threshold:
+            # too few vectors to train/justify an ANN index yet
+            return "flat"
+        return self.index_setting
+
+    def _build(self, kind: str, vectors: np.ndarray):
+        # imported on first use (or by preload_imports), not at startup
+        import faiss
+
+        dim = vectors.shape[1]
+        if kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, __RETRIEVAL_HNSW_M__)
+        elif kind == "ivf":
+            nlist = max(1, int(np.sqrt(len(vectors))))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+            index.train(vectors)
+            index.nprobe = max(1, nlist // 8)
+        else:
+            index = faiss.IndexFlatL2(dim)
+        index.add(vectors)
+        logging.debug(f"Retrieval index built: {kind}, {len(vectors)} items")
+        return index
+
+    async def add_texts(
+        self, texts: list[str], sources: list[str] | None = None
+    ) -> int:
+        """
+        Indexes (and embeds, unless in BM25 mode) the chunks not already in
+        the session.
+        Args:
+            texts (list[str]): Text chunks.
+            sources (list[str] | None): Source URL of each chunk.
+        Returns:
+            int: Number of chunks added.
+        """
+        new_texts = []
+        for i, text in enumerate(texts):
+            if text and text not in self._seen:
+                self._seen.add(text)
+                new_texts.append(text)
+                if sources is not None:
+                    self.sources[text] = sources[i]
+        if not new_texts:
+            return 0
+
+        self.texts.extend(new_texts)
+        self.bm25.add(new_texts)
+        if self.vectors_enabled:
+            await self._add_vectors(new_texts)
+        return len(new_texts)
+
+    def _disable_vectors(self, error: Exception) -> None:
+        logging.warning(
+            f"Embeddings unavailable, falling back to BM25: {error!r}"
+        )
+        self.vectors_enabled = False
+
+    async def _embed(self, method, value):
+        try:
+            with span("embed"):
+                return await asyncio.wait_for(
+                    method(value), timeout=__EMBEDDING_TIMEOUT__
+                )
+        except Exception as e:
+            self._disable_vectors(e)
+            return None
+
+    async def _add_vectors(self, new_texts: list[str]) -> None:
+        # vector ids follow text ids: once a batch fails, vectors stay off
+        embedded = await self._embed(
+            self.embeddings.aembed_documents, new_texts
+        )
+        if embedded is None:
+            return
+        vectors = np.asarray(embedded, dtype=np.float32)
+        self._vectors = (
+            vectors if self._vectors is None
+            else np.vstack([self._vectors, vectors])
+        )
+
+        kind = self._target_kind(len(self._vectors))
+        if self._index is None or kind != self.index_kind:
+            self._index = self._build(kind, self._vectors)
+            self.index_kind = kind
+        else:
+            self._index.add(vectors)
+
+    async def similarity_search(self, query: str, k: int) -> list[str]:
+        """
+        Returns the k chunks closest to the query.
+        Args:
+            query (str): Query text.
+            k (int): Number of chunks to return.
+        Returns:
+            list[str]: Most similar chunks, closest first.
+        """
+        return [
+            text for text, _ in
+            await self.similarity_search_with_score(query, k)
+        ]
+
+    async def _vector_search(
+        self, query: str, k: int
+    ) -> list[tuple[int, float]]:
+        if self._index is None or not self.vectors_enabled or k <= 0:
+            return []
+        embedded = await self._embed(self.embeddings.aembed_query, query)
+        if embedded is None:
+            return []
+        vector = np.asarray([embedded], dtype=np.float32)
+        distances, ids = self._index.search(
+            vector, min(k, self._index.ntotal)
+        )
+        return [
+            (int(i), float(d)) for i, d in zip(ids[0], distances[0])
+            if i != -1
+        ]
+
+    async def similarity_search_with_score(
+        self, query: str, k: int
+    ) -> list[tuple[str, float]]:
+        """
+        Returns the k chunks closest to the query with their L2 distance.
+        """
+        return [
+            (self.texts[i], distance)
+            for i, distance in await self._vector_search(query, k)
+        ]
+
+    async def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """
+        Ranks the chunks for the query with the session's retrieval mode.
+        Args:
+            query (str): Query text.
+            k (int): Number of chunks to return.
+        Returns:
+            list[tuple[int, float]]: (chunk id, score) pairs, best first.
+            Scores are fused reciprocal ranks, or reranker scores.
+        """
+        candidates = max(k, __RETRIEVAL_CANDIDATES__)
+        rankings = []
+        if self.mode != "bm25":
+            ranking = await self._vector_search(query, candidates)
+            if ranking:
+                rankings.append([i for i, _ in ranking])
+        if self.mode != "vector" or not rankings:
+            rankings.append(
+                [i for i, _ in self.bm25.search(query, candidates)]
+            )
+        ranked = reciprocal_rank_fusion(rankings, __RETRIEVAL_RRF_K__)
+        ranked = ranked[:candidates]
+
+        scores = await rerank(query, [self.texts[i] for i, _ in ranked])
+        if scores is not None:
+            ranked = sorted(
+                zip((i for i, _ in ranked), scores),
+                key=lambda item: -item[1]
+            )
+        return ranked[:k]
+
+    async def search_documents(self, query: str, k: int) -> list[Document]:
+        """
+        Returns the k best chunks for the query as Documents, with their
+        'source' URL and retrieval 'score' (higher is better) in the
+        metadata.
+        """
+        return [
+            Document(
+                page_content=self.texts[i],
+                metadata={
+                    "source": self.sources.get(self.texts[i]),
+                    "score": score,
+                },
+            )
+            for i, score in await self.search(query, k)
+        ]
@@ -0,0 +1,563 @@
+
+"""
+Shared state: key-value stores with TTL and counters, backed by process
+memory, a SQLite (WAL) file or a Redis-protocol server, so that caches and
+rate-limit counters can be shared by all gunicorn workers and outlive them.
+Stores are synchronous; async callers run them with asyncio.to_thread.
+"""
+import os
+import time
+import queue
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, unquote
+
+from process_local import ProcessLocal
+from config import __CACHE_DIR__, __STATE_BACKEND__, __REDIS_URL__
+
+
+class MemoryStore:
+    """
+    In-process LRU store with TTL and a size cap in bytes. Not shared: used
+    when no shared backend is configured, and in tests. Expired items are
+    purged on write, at most every purge_interval seconds, so that keys
+    never read again (e.g. past rate-limit windows) do not accumulate.
+    """
+
+    backend = "memory"
+
+    def __init__(
+        self, max_bytes: int | None = None, purge_interval: float = 60.0
+    ):
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+        self.size = 0
+        self._items = OrderedDict()  # key -> (expires_at, value, size)
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def _pop(self, key: str) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
+
+    def _purge(self, now: float) -> None:
+        # called with the lock held
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        expired = [
+            key for key, (expires_at, _, _) in self._items.items()
+            if expires_at is not None and expires_at < now
+        ]
+        for key in expired:
+            self._pop(key)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] is not None and item[0] < time.time():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        size = len(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._purge(now)
+            self._pop(key)
+            self._items[key] = (expires_at, value, size)
+            self.size += size
+            while self.max_bytes is not None and self.size > self.max_bytes:
+                self._pop(next(iter(self._items)))
+
+    def set_many(self, items: dict, ttl: float | None = None) -> None:
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            item = self._items.get(key)
+            if item is None or (item[0] is not None and item[0] < now):
+                expires_at = now + ttl if ttl else None
+                value = 0
+            else:
+                expires_at, value = item[0], int(item[1])
+            value += amount
+            self._pop(key)
+            encoded = str(value).encode("ascii")
+            self._items[key] = (expires_at, encoded, len(encoded))
+            self.size += len(encoded)
+            return value
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteStore:
+    """
+    On-disk LRU store with TTL and a size cap in bytes, in a SQLite database
+    in WAL mode that every worker process can open. The total size is kept
+    up to date by triggers, and expired items are purged on write, at most
+    every purge_interval seconds (by each process).
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self, path: str, max_bytes: int | None = None,
+        purge_interval: float = 60.0
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.purge_interval = purge_interval
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = ProcessLocal(self._connect)
+        self._local.get()  # fails early on a bad path
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # each forked worker opens its own connection on first use
+        return self._local.get()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, timeout=5, check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER, "
+            "expires_at REAL, accessed_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires_at)"
+        )
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # running total of the sizes, so that writes need not sum them
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_size ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO cache_size "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM cache"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS cache_size_insert "
+                "AFTER INSERT ON cache BEGIN UPDATE cache_size "
+                "SET total = total + NEW.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS cache_size_delete "
+                "AFTER DELETE ON cache BEGIN UPDATE cache_size "
+                "SET total = total - OLD.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS cache_size_update "
+                "AFTER UPDATE OF size ON cache BEGIN UPDATE cache_size "
+                "SET total = total + NEW.size - OLD.size; END"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "key TEXT PRIMARY KEY, value INTEGER, expires_at REAL)"
+        )
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        now = time.time()
+        found = {}
+        with self._lock:
+            # stay below SQLite's limit of bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, value FROM cache WHERE key IN "
+                    f"({','.join('?' * len(batch))}) "
+                    "AND (expires_at IS NULL OR expires_at >= ?)",
+                    (*batch, now)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE cache SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key, _ in rows]
+                )
+                for key, value in rows:
+                    # TEXT values written by earlier versions
+                    found[key] = (
+                        value.encode("utf-8") if isinstance(value, str)
+                        else bytes(value)
+                    )
+        return [found.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: dict, ttl: float | None = None) -> None:
+        now = time.time()
+        rows = [
+            (key, value, len(value), now + ttl if ttl else None, now)
+            for key, value in items.items()
+            if self.max_bytes is None or len(value) <= self.max_bytes
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # an upsert, not a REPLACE: its delete would skip the trigger
+                self._conn.executemany(
+                    "INSERT INTO cache VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+                    "size = excluded.size, expires_at = excluded.expires_at, "
+                    "accessed_at = excluded.accessed_at", rows
+                )
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float) -> None:
+        # called in the write transaction
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            self._conn.execute(
+                "DELETE FROM cache WHERE expires_at < ?", (now,)
+            )
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute(
+            "SELECT total FROM cache_size"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT key, size FROM cache ORDER BY accessed_at"
+        )
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM counters WHERE key = ? AND expires_at < ?",
+                    (key, now)
+                )
+                self._conn.execute(
+                    "INSERT INTO counters VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = value + ?",
+                    (key, amount, now + ttl if ttl else None, amount)
+                )
+                value = self._conn.execute(
+                    "SELECT value FROM counters WHERE key = ?", (key,)
+                ).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if value == amount:
+            # first hit of a window: drop the windows that have expired
+            with self._lock:
+                self._conn.execute(
+                    "DELETE FROM counters WHERE expires_at < ?", (now,)
+                )
+        return value
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the items in bytes, expired ones not yet purged
+        included.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT total FROM cache_size"
+            ).fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cache"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisError(Exception):
+    """
+    Error reply from a Redis-protocol server.
+    """
+
+
+class RedisStore:
+    """
+    Store on a Redis-protocol server (Redis, Valkey, KeyDB...), spoken over
+    a small pool of RESP connections. Keys are prefixed with the namespace.
+    The size cap is left to the server (maxmemory with an LRU policy).
+    """
+
+    backend = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        namespace: str,
+        pool_size: int = 8,
+        timeout: float = 5.0,
+    ):
+        parts = urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Unsupported Redis URL: {url}")
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.prefix = f"trustme:{namespace}:"
+        self.timeout = timeout
+        self._pools = ProcessLocal(
+            lambda: queue.LifoQueue(maxsize=pool_size)
+        )
+
+    @property
+    def _pool(self) -> queue.LifoQueue:
+        # forked workers never share the parent's sockets
+        return self._pools.get()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    @classmethod
+    def _read(cls, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the Redis server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the Redis server")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [cls._read(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    def _connect(self):
+        sock = socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        )
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._send(conn, setup)
+        return conn
+
+    def _send(self, conn, commands) -> list:
+        sock, reader = conn
+        sock.sendall(b"".join(self._encode(args) for args in commands))
+        replies = [self._read(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def execute(self, *commands) -> list:
+        """
+        Sends commands in one pipeline and returns their replies.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            replies = self._send(conn, commands)
+        except RedisError:
+            self._release(conn)
+            raise
+        except BaseException:
+            conn[0].close()
+            raise
+        self._release(conn)
+        return replies
+
+    def _release(self, conn) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn[0].close()
+
+    def get(self, key: str) -> bytes | None:
+        return self.execute(("GET", self.prefix + key))[0]
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        if not keys:
+            return []
+        return self.execute(("MGET", *(self.prefix + k for k in keys)))[0]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None) -> None:
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: dict, ttl: float | None = None) -> None:
+        if not items:
+            return
+        expiry = ("PX", int(ttl * 1000)) if ttl else ()
+        self.execute(*(
+            ("SET", self.prefix + key, value, *expiry)
+            for key, value in items.items()
+        ))
+
+    def delete(self, key: str) -> None:
+        self.execute(("DEL", self.prefix + key))
+
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        key = self.prefix + key
+        if not ttl:
+            return self.execute(("INCRBY", key, amount))[0]
+        # creating the key with its expiry first keeps a single round trip
+        _, value = self.execute(
+            ("SET", key, 0, "PX", int(ttl * 1000), "NX"),
+            ("INCRBY", key, amount),
+        )
+        return value
+
+    def __len__(self) -> int:
+        """
+        Counts the keys of the namespace, scanning the server's keys in
+        steps (not the whole database, as DBSIZE would).
+        """
+        count, cursor = 0, b"0"
+        while True:
+            cursor, keys = self.execute((
+                "SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 1000
+            ))[0]
+            count += len(keys)
+            if int(cursor) == 0:
+                return count
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait()[0].close()
+            except queue.Empty:
+                return
+
+
+def create_store(
+    namespace: str,
+    max_bytes: int | None = None,
+    backend: str = __STATE_BACKEND__,
+):
+    """
+    Creates a store of the configured backend ('memory', 'sqlite' or
+    'redis'). SQLite stores live in __CACHE_DIR__/<namespace>.sqlite3.
+    Args:
+        namespace (str): Store name, e.g. 'pages'.
+        max_bytes (int | None): Size cap (memory and SQLite backends).
+        backend (str): Backend name.
+    """
+    if backend == "memory":
+        return MemoryStore(max_bytes)
+    if backend == "sqlite":
+        return SQLiteStore(
+            os.path.join(__CACHE_DIR__ or ".", f"{namespace}.sqlite3"),
+            max_bytes
+        )
+    if backend == "redis":
+        return RedisStore(__REDIS_URL__ or "redis://127.0.0.1:6379/0",
+                          namespace)
+    raise ValueError(f"Unknown state backend: {backend}")
+
+
+class RateLimiter:
+    """
+    Fixed-window rate limiter on a (possibly shared) store: at most `limit`
+    hits per key in each window of `window` seconds, across all workers
+    sharing the store.
+    """
+
+    def __init__(self, store, limit: int, window: float = 60.0):
+        self.store = store
+        self.limit = limit
+        self.window = window
+
+    def hit(self, key: str) -> bool:
+        """
+        Counts a hit for key.
+        Returns:
+            bool: True if the hit is within the limit.
+        """
+        window = int(time.time() // self.window)
+        count = self.store.incr(f"{key}:{window}", 1, ttl=self.window)
+        return count <= self.limit
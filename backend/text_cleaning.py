@@ -0,0 +1,107 @@
+
+"""
+Text cleaning: segments extracted page text into clean sentences.
+"""
+import re
+
+# Patterns are compiled once, at import
+_REFERENCES = re.compile(r"\[\w+\]")
+_SYMBOL_RUNS = re.compile(r"([^\w\s]{2,}|_{2,}|-{2,})")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# ASCII control characters, except \t \n \r, plus DEL
+_CONTROL_CHARS = str.maketrans(
+    "", "", "".join(
+        chr(c) for c in [*range(32), 127] if chr(c) not in "\n\r\t"
+    )
+)
+
+# Every byte but ASCII letters and digits, deleted to build dedup keys
+_NON_ALNUM_BYTES = bytes(
+    c for c in range(256) if not (chr(c).isascii() and chr(c).isalnum())
+)
+
+MIN_SENTENCE_LENGTH = 15
+MAX_SENTENCE_LENGTH = 1024
+
+
+def _to_text(text) -> str:
+    if not isinstance(text, str):
+        if isinstance(text, list):
+            text = " ".join(str(x) for x in text)
+        else:
+            text = str(text)
+    return text
+
+
+def _ascii_only(text: str) -> str:
+    """
+    Keeps printable ASCII characters plus \\t \\n \\r, at C speed.
+    """
+    return text.encode("ascii", "ignore").decode("ascii").translate(
+        _CONTROL_CHARS
+    )
+
+
+def dedup_key(sentence: str) -> bytes:
+    """
+    Key under which near-duplicate sentences collide: case, punctuation
+    and spacing differences are ignored.
+    """
+    return sentence.encode("ascii", "ignore").lower().translate(
+        None, _NON_ALNUM_BYTES
+    )
+
+
+def clean_sentences(text, seen: set | None = None) -> list[str]:
+    """
+    Cleans and segments extracted text from scraping.
+    Args:
+        text (str): Raw text extracted from a web page.
+        seen (set | None): Dedup keys of sentences already kept. If given,
+        near-duplicate sentences are dropped and the set is updated.
+    Returns:
+        list[str]: Cleaned sentences longer than 15 and shorter than 1024
+        chars.
+    """
+    text = _REFERENCES.sub("", _to_text(text))
+    text = _SYMBOL_RUNS.sub(" ", text)
+    text = " ".join(text.split())
+
+    # No newline survives the whitespace collapse, so sentences can be
+    # joined on it and filtered in a single pass
+    sentences = _ascii_only(
+        "\n".join(_SENTENCE_END.split(text))
+    ).split("\n")
+
+    cleaned = []
+    for s in sentences:
+        s = s.strip()
+        if not MIN_SENTENCE_LENGTH < len(s) < MAX_SENTENCE_LENGTH:
+            continue
+        if s.isdigit():
+            continue
+        if seen is not None:
+            key = dedup_key(s)
+            if key in seen:
+                continue
+            seen.add(key)
+        cleaned.append(s)
+    return cleaned
+
+
+def clean_pages(texts: list, dedup: bool = True) -> list[str]:
+    """
+    Batch mode: cleans all fetched pages in one call.
+    Args:
+        texts (list): Extracted page texts; None entries are skipped.
+        dedup (bool): Drop near-duplicate sentences across all pages.
+    Returns:
+        list[str]: Cleaned sentences of all pages, in page order.
+    """
+    seen = set() if dedup else None
+    sentences = []
+    for text in texts:
+        if text:
+            sentences.extend(clean_sentences(text, seen))
+    return sentences
@@ -0,0 +1,175 @@
+
+"""
+Per-request tracing: timing spans of the analysis stages and request
+counters (tokens, cost, pages), logged as one JSON line per request and
+summed into the Prometheus metrics.
+"""
+import json
+import logging
+import re
+import time
+import uuid
+from contextvars import ContextVar
+
+from metrics import request_seconds, stage_seconds
+from metrics import llm_tokens, embedding_tokens, cost_usd
+from config import __TRACE_HEADER__, __TRACE_LOG__
+from config import (
+    __LLM_PRICE_PER_1K_TOKENS__, __EMBEDDING_PRICE_PER_1K_TOKENS__
+)
+
+_TRACE_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+
+class Trace:
+    """
+    Spans and counters of one HTTP request.
+    Attributes:
+        trace_id: Request identifier, returned in the __TRACE_HEADER__
+        header.
+        spans: (stage, start offset, seconds) of each finished span.
+        counters: Request totals (tokens, cost, pages, retries...).
+    """
+
+    def __init__(self, trace_id: str | None = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+
+    def summary(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "seconds": round(time.perf_counter() - self.started_at, 4),
+            "spans": [
+                {"stage": stage, "start": round(start, 4),
+                 "seconds": round(seconds, 4)}
+                for stage, start, seconds in self.spans
+            ],
+            **{key: round(value, 6) for key, value in self.counters.items()},
+        }
+
+
+# Trace of the request handled by the current task, if any
+current_trace: ContextVar[Trace | None] = ContextVar(
+    "current_trace", default=None
+)
+# Stage running in the current task, used to label LLM token counts
+current_stage: ContextVar[str] = ContextVar("current_stage", default="other")
+
+
+def count(name: str, amount: float = 1) -> None:
+    """
+    Adds to a counter of the current request's trace, if one is active.
+    """
+    trace = current_trace.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + amount
+
+
+def record_llm_usage(prompt_tokens: int, completion_tokens: int) -> None:
+    """
+    Counts the tokens and estimated cost of an LLM call, by current stage.
+    """
+    stage = current_stage.get()
+    llm_tokens.inc(prompt_tokens, stage, "prompt")
+    llm_tokens.inc(completion_tokens, stage, "completion")
+    cost = (
+        prompt_tokens * __LLM_PRICE_PER_1K_TOKENS__["prompt"]
+        + completion_tokens * __LLM_PRICE_PER_1K_TOKENS__["completion"]
+    ) / 1000
+    cost_usd.inc(cost, "llm")
+    count("llm_prompt_tokens", prompt_tokens)
+    count("llm_completion_tokens", completion_tokens)
+    count("cost_usd", cost)
+
+
+def record_embedding_usage(tokens: int) -> None:
+    """
+    Counts the tokens and estimated cost of an embedding call.
+    """
+    cost = tokens * __EMBEDDING_PRICE_PER_1K_TOKENS__ / 1000
+    embedding_tokens.inc(tokens)
+    cost_usd.inc(cost, "embeddings")
+    count("embedding_tokens", tokens)
+    count("cost_usd", cost)
+
+
+class span:
+    """
+    Times a stage of the analysis: observed in trustme_stage_seconds and
+    recorded in the current trace. Works in sync and async code:
+
+        with span("verify"):
+            ...
+    """
+
+    __slots__ = ("stage", "_started", "_token")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._token = current_stage.set(self.stage)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        ended = time.perf_counter()
+        seconds = ended - self._started
+        current_stage.reset(self._token)
+        stage_seconds.observe(seconds, self.stage)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.spans.append(
+                (self.stage, self._started - trace.started_at, seconds)
+            )
+        return False
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware starting a Trace for each HTTP request: the trace ID is
+    taken from the __TRACE_HEADER__ request header if valid, or generated,
+    and returned in the same response header. When the response is
+    complete (streams included), its latency is observed and the trace is
+    logged if __TRACE_LOG__.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = __TRACE_HEADER__.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = dict(scope["headers"]).get(self.header, b"").decode(
+            "latin-1"
+        )
+        trace = Trace(incoming if _TRACE_ID.fullmatch(incoming) else None)
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (self.header, trace.trace_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            current_trace.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            seconds = time.perf_counter() - trace.started_at
+            request_seconds.observe(
+                seconds, route, scope["method"], str(status)
+            )
+            if __TRACE_LOG__ and (trace.spans or trace.counters):
+                logging.info("trace " + json.dumps({
+                    "route": route, "status": status, **trace.summary()
+                }))
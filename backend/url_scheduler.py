@@ -0,0 +1,299 @@
+
+"""
+URL scheduling of the scrape stage: canonical keys to skip duplicate
+links, interleaving of the search queries' results, per-domain quotas and
+concurrency, and a download history of the domains that pushes slow or
+failing hosts back.
+"""
+import asyncio
+import itertools
+import math
+from collections import Counter, OrderedDict
+from urllib.parse import urlsplit
+
+from cache import normalize_url
+from config import (
+    __SCHEDULER_DOMAIN_QUOTA__,
+    __SCHEDULER_DOMAIN_CONCURRENCY__,
+    __SCHEDULER_SLOW_SECONDS__,
+    __SCHEDULER_FAILURE_PENALTY__,
+    __SCHEDULER_HISTORY_DOMAINS__,
+)
+
+# Second-level labels under which domains are registered (example.co.uk)
+_SECOND_LEVEL = {"ac", "co", "com", "edu", "gov", "net", "org"}
+
+
+def url_key(url: str) -> str:
+    """
+    Canonical key of a URL for deduplication: the normalized URL (see
+    cache.normalize_url) over https and without a leading "www.".
+    Args:
+        url (str): URL.
+    Returns:
+        str: Key shared by the variants of the URL.
+    """
+    _, _, rest = normalize_url(url).partition("://")
+    if rest.startswith("www."):
+        rest = rest[4:]
+    return f"https://{rest}"
+
+
+def domain_of(url: str) -> str:
+    """
+    Registrable domain of a URL (news.example.co.uk -> example.co.uk),
+    guessed from the last labels of the host. IP addresses are kept whole.
+    Args:
+        url (str): URL.
+    Returns:
+        str: Domain, empty if the URL has no host.
+    """
+    host = (urlsplit(url.strip()).hostname or "").rstrip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or ":" in host or host.replace(".", "").isdigit():
+        return host
+    n = 3 if len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL else 2
+    return ".".join(labels[-n:])
+
+
+class DomainStats:
+    """
+    Download history of the domains seen by this worker: moving averages
+    of the download time and of the failure rate, kept for the max_domains
+    most recently used domains.
+    """
+
+    def __init__(
+        self,
+        max_domains: int = __SCHEDULER_HISTORY_DOMAINS__,
+        slow_seconds: float = __SCHEDULER_SLOW_SECONDS__,
+        failure_penalty: float = __SCHEDULER_FAILURE_PENALTY__,
+        alpha: float = 0.3,
+    ):
+        self.max_domains = max_domains
+        self.slow_seconds = slow_seconds
+        self.failure_penalty = failure_penalty
+        self.alpha = alpha
+        # domain -> [average seconds, failure rate, downloads]
+        self._domains = OrderedDict()
+
+    def record(self, domain: str, seconds: float, failed: bool = False):
+        """
+        Records a download of the domain.
+        """
+        entry = self._domains.pop(domain, None)
+        if entry is None:
+            entry = [seconds, float(failed), 0]
+        else:
+            entry[0] += self.alpha * (seconds - entry[0])
+            entry[1] += self.alpha * (float(failed) - entry[1])
+        entry[2] += 1
+        self._domains[domain] = entry
+        while len(self._domains) > self.max_domains:
+            self._domains.popitem(last=False)
+
+    def record_cancelled(self, domain: str, seconds: float) -> None:
+        """
+        Records a download cancelled after seconds, e.g. by an early
+        cutoff: it only counts if slower than the domain's average.
+        """
+        entry = self._domains.get(domain)
+        if entry is None or seconds > entry[0]:
+            self.record(domain, seconds)
+
+    def penalty(self, domain: str) -> float:
+        """
+        Ranks a domain's links are pushed back by: one per slow_seconds of
+        average download time, plus its failure rate times
+        failure_penalty. Domains without history get none.
+        """
+        entry = self._domains.get(domain)
+        if entry is None:
+            return 0.0
+        return (
+            entry[0] / self.slow_seconds + entry[1] * self.failure_penalty
+        )
+
+    def stats(self, n: int = 10) -> dict:
+        """
+        Number of domains tracked, and the n with the largest penalty.
+        """
+        slowest = sorted(
+            self._domains, key=self.penalty, reverse=True
+        )[:n]
+        return {
+            "domains": len(self._domains),
+            "slowest": {
+                domain: {
+                    "seconds": round(self._domains[domain][0], 3),
+                    "failure_rate": round(self._domains[domain][1], 3),
+                    "downloads": self._domains[domain][2],
+                }
+                for domain in slowest
+            },
+        }
+
+
+class UrlScheduler:
+    """
+    Chooses the pages an analysis downloads, and when.
+    Links are added in batches, one per search query, and deduplicated by
+    url_key against each other and the keys in seen (pages already
+    scraped by the analysis, updated as downloads start). Downloads start
+    by rank of the link in its query, so that the queries' results are
+    interleaved, pushed back by the history of the link's domain (see
+    DomainStats.penalty). Each domain gets at most domain_quota pages and
+    domain_concurrency downloads at a time (None: unlimited); while more
+    queries are expected, each gets an equal share of the top_k pages.
+    Attributes:
+        counters: Links added, skipped as duplicates or over a domain
+        quota, and downloads started.
+    """
+
+    domain_quota = __SCHEDULER_DOMAIN_QUOTA__
+    domain_concurrency = __SCHEDULER_DOMAIN_CONCURRENCY__
+
+    def __init__(
+        self,
+        top_k: int,
+        seen: set | None = None,
+        n_queries: int | None = None,
+        history: DomainStats | None = None,
+    ):
+        self.top_k = top_k
+        self.seen = seen if seen is not None else set()
+        self.n_queries = n_queries
+        self.history = history if history is not None else domain_stats
+        self.closed = False
+        self.counters = Counter()
+        # key -> [rank, arrival, query, url, domain]
+        self._pending = {}
+        self._arrival = itertools.count()
+        self._queries = 0
+        self._per_query = Counter()
+        self._per_domain = Counter()
+        self._in_flight = Counter()
+        self._wake = asyncio.Event()
+
+    def add(self, urls: list[str]) -> None:
+        """
+        Adds the links of one query, best ranked first.
+        """
+        query = self._queries
+        self._queries += 1
+        for rank, url in enumerate(urls):
+            self.counters["links"] += 1
+            key = url_key(url)
+            entry = self._pending.get(key)
+            if key in self.seen or entry is not None:
+                self.counters["duplicates"] += 1
+                if entry is not None:
+                    entry[0] = min(entry[0], rank)
+                continue
+            self._pending[key] = [
+                rank, next(self._arrival), query, url, domain_of(url)
+            ]
+        self._wake.set()
+
+    def close(self) -> None:
+        """
+        Marks the end of the links: the per-query shares no longer apply.
+        """
+        self.closed = True
+        self._wake.set()
+
+    def _share(self) -> int | None:
+        if self.closed or not self.n_queries:
+            return None
+        if self._queries >= self.n_queries:
+            return None
+        return math.ceil(self.top_k / self.n_queries)
+
+    def pop(self) -> str | None:
+        """
+        Starts the best link that can download now.
+        Returns:
+            str | None: Its URL, None if no link can start now.
+        """
+        if self.counters["started"] >= self.top_k:
+            return None
+        share = self._share()
+        best, best_key = None, None
+        for key, (rank, arrival, query, url, domain) in list(
+            self._pending.items()
+        ):
+            if (self.domain_quota is not None
+                    and self._per_domain[domain] >= self.domain_quota):
+                del self._pending[key]
+                self.counters["over_quota"] += 1
+                continue
+            if (self.domain_concurrency is not None
+                    and self._in_flight[domain] >= self.domain_concurrency):
+                continue
+            if share is not None and self._per_query[query] >= share:
+                continue
+            score = (rank + self.history.penalty(domain), arrival)
+            if best is None or score < best:
+                best, best_key = score, key
+        if best_key is None:
+            return None
+        _, _, query, url, domain = self._pending.pop(best_key)
+        self.seen.add(best_key)
+        self.counters["started"] += 1
+        self._per_query[query] += 1
+        self._per_domain[domain] += 1
+        self._in_flight[domain] += 1
+        return url
+
+    def done(self, url: str) -> None:
+        """
+        Frees the domain slot of a finished download.
+        """
+        self._in_flight[domain_of(url)] -= 1
+        self._wake.set()
+
+    def exhausted(self) -> bool:
+        """
+        Whether no other download will start: top_k started, or no link
+        left and none to come.
+        """
+        return self.counters["started"] >= self.top_k or (
+            self.closed and not self._pending
+        )
+
+    async def run(self, fetch, n_jobs: int) -> None:
+        """
+        Downloads the links as they are added, n_jobs at a time, until
+        the scheduler is exhausted and every download is done.
+        Args:
+            fetch: Async callable downloading a URL; the download slot is
+            held until it returns.
+            n_jobs (int): Maximum number of concurrent downloads.
+        Raises:
+            Exception: The first error raised by fetch.
+        """
+        running = set()
+        try:
+            while True:
+                self._wake.clear()
+                while len(running) < n_jobs and (url := self.pop()):
+                    task = asyncio.create_task(fetch(url))
+                    task.add_done_callback(
+                        lambda _, url=url: self.done(url)
+                    )
+                    running.add(task)
+                if not running and self.exhausted():
+                    return
+                await self._wake.wait()
+                for task in [task for task in running if task.done()]:
+                    running.discard(task)
+                    if not task.cancelled():
+                        task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+# Download history shared by the analyses of this worker
+domain_stats = DomainStats()
@@ -0,0 +1,157 @@
+
+"""
+Tests of the batched multi-subject analysis: grouped query generation,
+merged embedding calls and the /analyze/batch event stream.
+
+Run from the repository root:
+    pytest tests/backend/batch_tests.py
+"""
+import asyncio
+import json
+
+import pytest
+
+from langchain_core.messages import AIMessage
+
+from fake_services import CountingEmbeddings, fake_completion
+
+import main
+from agents import search
+from embedding_cache import BatchedEmbeddings, batching
+
+
+def test_batched_embeddings_merge_concurrent_calls():
+    upstream = CountingEmbeddings()
+    batched = BatchedEmbeddings(upstream, window=0.01)
+
+    async def run():
+        batching.set(True)
+        return await asyncio.gather(
+            batched.aembed_documents(["a", "bb"]),
+            batched.aembed_documents(["bb", "ccc"]),
+            batched.aembed_query("dddd"),
+        )
+
+    assert asyncio.run(run()) == [
+        [[1.0, 1.0], [2.0, 1.0]], [[2.0, 1.0], [3.0, 1.0]], [4.0, 1.0]
+    ]
+    assert upstream.batches == [["a", "bb", "ccc", "dddd"]]
+
+
+def test_batched_embeddings_flush_when_full_and_share_errors():
+    upstream = CountingEmbeddings(fail=True)
+    batched = BatchedEmbeddings(upstream, window=10, max_texts=2)
+
+    async def run():
+        batching.set(True)
+        return await asyncio.gather(
+            batched.aembed_documents(["a"]),
+            batched.aembed_documents(["b"]),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(asyncio.wait_for(run(), timeout=1))
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert upstream.batches == [["a", "b"]]
+
+
+def test_calls_outside_a_batch_are_not_delayed():
+    upstream = CountingEmbeddings()
+    batched = BatchedEmbeddings(upstream, window=10)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(
+            batched.aembed_documents(["a"]),
+            batched.aembed_query("bb"),
+        ), timeout=1)
+
+    assert asyncio.run(run()) == [[[1.0, 1.0]], [2.0, 1.0]]
+    assert upstream.batches == [["a"], ["bb"]]
+
+
+def test_define_queries_batch_groups_subjects(monkeypatch):
+    prompts = []
+
+    async def fake_llm(prompt, model=None):
+        prompts.append(prompt)
+        answer = json.loads(fake_completion(prompt))
+        answer.pop("1", None)  # the model skips a subject
+        return AIMessage(content=json.dumps(answer))
+
+    monkeypatch.setattr(search, "ainvoke_llm", fake_llm)
+    subjects = [(f"Supplier {i}", "supplier") for i in range(5)]
+
+    queries = asyncio.run(
+        search.SearchAgent().define_queries_batch(subjects, group_size=2)
+    )
+    assert len(prompts) == 3
+    assert queries[0][0] == "Supplier 0 query 0"
+    assert queries[1] == []
+    assert all(queries[i] for i in (0, 2, 3, 4))
+
+
+def test_batch_events_stream_results_as_they_finish(monkeypatch):
+    running = []
+    peak = []
+
+    async def fake_inference(request, emit=None, queries=None):
+        # the analyses of a batch merge their embedding calls
+        assert batching.get()
+        running.append(request.subject)
+        peak.append(len(running))
+        await asyncio.sleep(0.1 * int(request.subject[-1]))
+        running.remove(request.subject)
+        if request.subject.endswith("0"):
+            raise main.HTTPException(status_code=500, detail="failed")
+        assert queries == [f"{request.subject} query {i}" for i in range(5)]
+        return main.AnalysisResponse(trust_score=70, details="ok")
+
+    async def fake_llm(prompt, model=None):
+        return AIMessage(content=fake_completion(prompt))
+
+    async def run():
+        cached = main.AnalysisRequest(
+            subject="Cached", context="supplier", language="en-US"
+        )
+        result = main.AnalysisResponse(trust_score=90, details="c")
+        await main.result_cache.set(
+            main.result_key(cached), result.model_dump_json()
+        )
+        requests = [
+            main.AnalysisRequest(
+                subject=f"Supplier {i}", context="supplier",
+                language="en-US"
+            )
+            for i in (4, 1, 0, 2)
+        ] + [cached]
+        batch = main.BatchRequest(requests=requests, concurrency=2)
+        return [event async for event in main.batch_events(batch)]
+
+    monkeypatch.setattr(main, "inference", fake_inference)
+    monkeypatch.setattr(search, "ainvoke_llm", fake_llm)
+    events = [
+        (event.split("\n")[0][7:], json.loads(event.split("\n")[1][6:]))
+        for event in asyncio.run(run())
+    ]
+
+    assert events[0] == ("result", {
+        "index": 4, "subject": "Cached",
+        "result": {"trust_score": 90.0, "details": "c"},
+    })
+    assert [data.get("index") for _, data in events[1:-1]] == [1, 2, 3, 0]
+    assert events[2] == ("error", {
+        "index": 2, "subject": "Supplier 0", "detail": "failed",
+    })
+    assert events[-1] == ("done", {"count": 5})
+    assert max(peak) == 2
+    assert not batching.get()
+
+
+def test_batch_request_limits():
+    with pytest.raises(ValueError):
+        main.BatchRequest(requests=[])
+    with pytest.raises(ValueError):
+        main.BatchRequest(
+            requests=[{"subject": "a", "context": "b", "language": "en"}],
+            concurrency=1000,
+        )
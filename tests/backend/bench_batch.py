@@ -0,0 +1,126 @@
+
+"""
+Batch benchmark: N related subjects analysed with N /analyze calls
+(sequential, then concurrent) and with one /analyze/batch call, against
+local stub services. Reports wall time and upstream calls of each mode.
+
+Each mode analyses different subjects over different pages, so no mode
+benefits from the caches filled by another.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_batch.py --subjects 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+
+
+def payloads(mode, n):
+    return [
+        {"subject": f"Supplier {mode} {i}", "context": "supplier",
+         "language": "en-US"}
+        for i in range(n)
+    ]
+
+
+async def sequential(client, requests):
+    for request in requests:
+        response = await client.post("/analyze", json=request)
+        response.raise_for_status()
+
+
+async def concurrent(client, requests):
+    responses = await asyncio.gather(*[
+        client.post("/analyze", json=request) for request in requests
+    ])
+    for response in responses:
+        response.raise_for_status()
+
+
+async def batch(client, requests):
+    response = await client.post(
+        "/analyze/batch", json={"requests": requests}
+    )
+    response.raise_for_status()
+    results = response.text.count("event: result")
+    if results != len(requests):
+        raise RuntimeError(f"{results} results for {len(requests)} subjects")
+
+
+async def main(subjects, pages, llm_delay):
+    services = await FakeServices(llm_delay=llm_delay).start()
+    os.environ.update(fake_env(services.port))
+
+    import main as backend
+    import langchain_setup
+    from agents.search import SearchAgent
+    from url_scheduler import UrlScheduler
+
+    # Send raw strings to the stub: no tiktoken encoding download needed
+    langchain_setup.get_embeddings().check_embedding_ctx_length = False
+
+    # The stub has no quota: measure the pipeline, not the client-side
+    # rate limits configured for Azure OpenAI
+    for endpoint in langchain_setup.endpoints:
+        endpoint.requests = endpoint.tokens = None
+    # All the stub pages are on one host: no per-domain limits
+    UrlScheduler.domain_quota = UrlScheduler.domain_concurrency = None
+
+    # Serper is not part of this benchmark: related subjects share the
+    # same local pages, different for each mode
+    modes = [("sequential", sequential), ("concurrent", concurrent),
+             ("batch", batch)]
+    urls = services.page_urls(pages * len(modes))
+    current = []
+
+    async def fake_stream_queries(self, queries, n_jobs=5):
+        yield list(current)
+
+    SearchAgent.stream_queries = fake_stream_queries
+
+    transport = httpx.ASGITransport(app=backend.app)
+    rows = []
+    async with backend.app.router.lifespan_context(backend.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=600
+        ) as client:
+            for i, (mode, run) in enumerate(modes):
+                current[:] = urls[i * pages:(i + 1) * pages]
+                before = dict(services.calls)
+                start = time.perf_counter()
+                await run(client, payloads(mode, subjects))
+                elapsed = time.perf_counter() - start
+                calls = {
+                    kind: services.calls[kind] - before[kind]
+                    for kind in ("chat", "embeddings", "pages")
+                }
+                rows.append((mode, elapsed, calls))
+
+    await services.stop()
+
+    print(f"{subjects} subjects, {pages} pages each, "
+          f"LLM delay {llm_delay:.2f}s")
+    print(f"{'mode':<12}{'seconds':>9}{'chat':>7}{'embed':>7}{'pages':>7}")
+    for mode, elapsed, calls in rows:
+        print(f"{mode:<12}{elapsed:>9.2f}{calls['chat']:>7}"
+              f"{calls['embeddings']:>7}{calls['pages']:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subjects", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--llm-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(main(args.subjects, args.pages, args.llm_delay))
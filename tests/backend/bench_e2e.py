@@ -0,0 +1,448 @@
+
+"""
+End-to-end benchmark: drives /analyze at a given concurrency against
+recorded upstream responses (Serper results, pages, chat completions,
+embeddings) replayed offline by local servers with their recorded
+latencies. Reports latency percentiles, throughput, CPU and memory, and
+the latency of each analysis stage (from the request traces).
+
+Record fixtures against the real services (API keys in the environment),
+or against the local stub services with --synthetic; run reuses them.
+If the fixtures are missing, run records synthetic ones first.
+Compare a run with a saved baseline to catch regressions: the exit status
+is 1 if any metric is worse than the baseline beyond --tolerance.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_e2e.py record --subjects 10
+    python ../tests/backend/bench_e2e.py record --synthetic
+    python ../tests/backend/bench_e2e.py run -n 40 -c 4 --save-baseline b.json
+    python ../tests/backend/bench_e2e.py run -n 40 -c 4 --baseline b.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+from replay_services import (  # noqa: E402
+    RecordingProxy, ReplayServices, SERPER_URL, load_fixtures,
+    new_fixtures, route_serper, save_fixtures
+)
+
+DEFAULT_FIXTURES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "e2e.json.gz"
+)
+# Regressions smaller than this many seconds are noise, whatever the ratio
+NOISE_FLOOR = 0.01
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile, 0 for no values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+
+def rss_mb() -> float:
+    """
+    Current resident memory of the process, in MB (Linux only, else 0).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return 0.0
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+class TraceCollector(logging.Handler):
+    """
+    Keeps the 'trace {...}' log lines of the /analyze requests.
+    """
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.traces = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("trace "):
+            trace = json.loads(message[6:])
+            if trace.get("route") == "/analyze":
+                self.traces.append(trace)
+
+
+class StageClock:
+    """
+    CPU seconds spent in each stage, by wrapping tracing.span. Only
+    meaningful at concurrency 1: concurrent requests share the CPU time
+    of the process.
+    """
+
+    def __init__(self):
+        import tracing
+
+        self.cpu = {}
+        starts = {}
+        enter, exit_ = tracing.span.__enter__, tracing.span.__exit__
+
+        def timed_enter(span):
+            starts[id(span)] = time.process_time()
+            return enter(span)
+
+        def timed_exit(span, *exc_info):
+            spent = time.process_time() - starts.pop(id(span))
+            self.cpu.setdefault(span.stage, []).append(spent)
+            return exit_(span, *exc_info)
+
+        tracing.span.__enter__ = timed_enter
+        tracing.span.__exit__ = timed_exit
+
+
+def collect_traces() -> TraceCollector:
+    """
+    Keeps the backend's INFO logs off the console (warnings still shown)
+    and collects its request traces.
+    """
+    collector = TraceCollector()
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setLevel(logging.WARNING)
+    root.addHandler(collector)
+    root.setLevel(logging.INFO)
+    return collector
+
+
+def import_backend(port: int, no_rate_limits: bool):
+    """
+    Points the backend clients to the local server on port and imports it.
+    """
+    route_serper(f"http://127.0.0.1:{port}")
+    import main as backend
+    import langchain_setup
+    from url_scheduler import UrlScheduler
+
+    # Send raw strings: fixtures are keyed by text, and no tiktoken
+    # encoding download is needed
+    langchain_setup.get_embeddings().check_embedding_ctx_length = False
+    if no_rate_limits:
+        for endpoint in langchain_setup.endpoints:
+            endpoint.requests = endpoint.tokens = None
+    # The replayed pages are all served by the local proxy
+    UrlScheduler.domain_quota = UrlScheduler.domain_concurrency = None
+    return backend
+
+
+async def drive(backend, payloads, concurrency):
+    """
+    Posts each payload to /analyze?refresh=true, at most concurrency at a
+    time.
+    Returns:
+        tuple[list[float], int]: Latency of each request, failed requests.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=backend.app)
+    latencies = []
+    failures = 0
+
+    async def post(client, payload):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/analyze", params={"refresh": "true"}, json=payload
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                failures += 1
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=600
+    ) as client:
+        await asyncio.gather(*[post(client, p) for p in payloads])
+    return latencies, failures
+
+
+def subjects(n: int) -> list[dict]:
+    return [
+        {"subject": f"Supplier {i}", "context": "supplier",
+         "language": "en-US"}
+        for i in range(n)
+    ]
+
+
+async def record(args):
+    fixtures = new_fixtures(subjects(args.subjects))
+    stub = None
+    if args.synthetic:
+        stub = await FakeServices(
+            llm_delay=args.llm_delay, page_delay=args.page_delay,
+            search_delay=args.search_delay
+        ).start()
+        upstream = {
+            "azure_endpoint": stub.base_url, "azure_key": "fake",
+            "serper_url": f"{stub.base_url}/serper", "serper_key": "fake",
+        }
+        env = fake_env(0)
+    else:
+        upstream = {
+            "azure_endpoint": os.environ["AZURE_OPENAI_ENDPOINT"],
+            "azure_key": os.environ["AZURE_OPENAI_API_KEY"],
+            "serper_url": SERPER_URL,
+            "serper_key": os.environ["SERPER_API_KEY"],
+        }
+        env = {}
+    proxy = await RecordingProxy(fixtures, **upstream).start()
+    os.environ.update(env)
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": proxy.base_url,
+        "TRUSTME_STATE_BACKEND": "memory",
+    })
+    backend = import_backend(proxy.port, args.no_rate_limits)
+    collect_traces()
+
+    start = time.perf_counter()
+    async with backend.app.router.lifespan_context(backend.app):
+        _, failures = await drive(
+            backend, fixtures["requests"], args.concurrency
+        )
+    elapsed = time.perf_counter() - start
+    await proxy.stop()
+    if stub is not None:
+        await stub.stop()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.fixtures)),
+                exist_ok=True)
+    save_fixtures(args.fixtures, fixtures)
+    print(f"Recorded {len(fixtures['requests'])} requests "
+          f"({failures} failed) in {elapsed:.1f}s: "
+          f"{len(fixtures['chat'])} completions, "
+          f"{len(fixtures['embeddings'])} embeddings, "
+          f"{len(fixtures['search'])} searches, "
+          f"{len(fixtures['pages'])} pages -> {args.fixtures}")
+
+
+def reset_caches():
+    """
+    Empties the in-process page, embedding and LLM caches filled by the
+    warmup.
+    """
+    from cache import llm_cache, page_cache
+    from embedding_cache import cached_embeddings
+    from state import MemoryStore
+
+    for cache in (page_cache, llm_cache):
+        cache.memory = MemoryStore(cache.memory.max_bytes)
+    cached_embeddings._memory.clear()
+
+
+async def run(args):
+    if not os.path.exists(args.fixtures):
+        print(f"No fixtures at {args.fixtures}: recording synthetic ones")
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), "record",
+            "--synthetic", "--no-rate-limits", "--fixtures", args.fixtures,
+        ], check=True)
+    fixtures = load_fixtures(args.fixtures)
+    services = await ReplayServices(
+        fixtures, latency_scale=args.latency_scale
+    ).start()
+    os.environ.update(fake_env(services.port))
+    os.environ["TRUSTME_STATE_BACKEND"] = "memory"
+    backend = import_backend(services.port, args.no_rate_limits)
+
+    collector = collect_traces()
+    clock = StageClock() if args.concurrency == 1 else None
+
+    recorded = fixtures["requests"]
+    payloads = [recorded[i % len(recorded)] for i in range(args.requests)]
+    async with backend.app.router.lifespan_context(backend.app):
+        await drive(backend, recorded[:args.warmup], args.concurrency)
+        if not args.warm_caches:
+            reset_caches()
+        collector.traces.clear()
+        if clock is not None:
+            clock.cpu.clear()
+        services.misses = dict.fromkeys(services.misses, 0)
+
+        rss_before = rss_mb()
+        cpu_before = time.process_time()
+        start = time.perf_counter()
+        latencies, failures = await drive(
+            backend, payloads, args.concurrency
+        )
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_before
+    await services.stop()
+
+    stages = {}
+    for trace in collector.traces:
+        totals = {}
+        for span in trace["spans"]:
+            totals[span["stage"]] = (
+                totals.get(span["stage"], 0) + span["seconds"]
+            )
+        for stage, seconds in totals.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    report = {
+        "config": {
+            "requests": args.requests, "concurrency": args.concurrency,
+            "latency_scale": args.latency_scale,
+            "rate_limits": not args.no_rate_limits,
+            "warm_caches": args.warm_caches,
+        },
+        "latency": summarize(latencies),
+        "throughput": len(latencies) / elapsed,
+        "failures": failures,
+        "cpu_per_request": cpu / len(latencies),
+        "rss_mb": rss_mb(),
+        "rss_growth_mb": rss_mb() - rss_before,
+        "max_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF
+        ).ru_maxrss / 1024,
+        "stages": {
+            stage: {
+                **summarize(values),
+                **({"cpu": sum(clock.cpu.get(stage, [])) / len(values)}
+                   if clock is not None else {}),
+            }
+            for stage, values in sorted(stages.items())
+        },
+        "misses": services.misses,
+    }
+    print_report(report, elapsed)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression beyond {args.tolerance:.0%} of "
+              f"{args.baseline}")
+
+
+def print_report(report: dict, elapsed: float):
+    config = report["config"]
+    latency = report["latency"]
+    print(f"{config['requests']} requests, concurrency "
+          f"{config['concurrency']}, {elapsed:.2f}s, "
+          f"{report['throughput']:.2f} req/s, "
+          f"{report['failures']} failed")
+    print(f"latency p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+          f"p99 {latency['p99']:.3f}s")
+    print(f"CPU {report['cpu_per_request'] * 1000:.1f} ms/request, "
+          f"RSS {report['rss_mb']:.0f} MB "
+          f"(+{report['rss_growth_mb']:.0f} MB during the run, "
+          f"peak {report['max_rss_mb']:.0f} MB)")
+    print(f"{'stage':<10}{'p50':>9}{'p95':>9}{'p99':>9}{'cpu':>9}")
+    for stage, row in report["stages"].items():
+        cpu = f"{row['cpu'] * 1000:>7.1f}ms" if "cpu" in row else f"{'-':>9}"
+        print(f"{stage:<10}{row['p50']:>9.3f}{row['p95']:>9.3f}"
+              f"{row['p99']:>9.3f}{cpu}")
+    misses = {kind: n for kind, n in report["misses"].items() if n}
+    if misses:
+        print(f"Calls missing from the fixtures (answered approximately): "
+              f"{misses}")
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lists the metrics of report worse than baseline by more than
+    tolerance (a ratio) and NOISE_FLOOR seconds.
+    """
+    def slower(name, value, reference, floor=NOISE_FLOOR):
+        if value > reference * (1 + tolerance) and value - reference > floor:
+            regressions.append(
+                f"{name}: {value:.4f} vs {reference:.4f} (baseline)"
+            )
+
+    regressions = []
+    for q, reference in baseline["latency"].items():
+        slower(f"latency {q}", report["latency"][q], reference)
+    slower("cpu per request", report["cpu_per_request"],
+           baseline["cpu_per_request"], floor=0)
+    for stage, row in baseline["stages"].items():
+        if stage in report["stages"]:
+            for q in ("p50", "p95"):
+                slower(f"{stage} {q}", report["stages"][stage][q], row[q])
+    if report["throughput"] * (1 + tolerance) < baseline["throughput"]:
+        regressions.append(
+            f"throughput: {report['throughput']:.2f} vs "
+            f"{baseline['throughput']:.2f} req/s (baseline)"
+        )
+    if report["failures"] > baseline["failures"]:
+        regressions.append(
+            f"failures: {report['failures']} vs {baseline['failures']}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    modes = parser.add_subparsers(dest="mode", required=True)
+    recorder = modes.add_parser("record", help="record fixtures")
+    recorder.add_argument("--subjects", type=int, default=10)
+    recorder.add_argument(
+        "--synthetic", action="store_true",
+        help="record the local stub services instead of the real APIs"
+    )
+    recorder.add_argument("--llm-delay", type=float, default=0.3)
+    recorder.add_argument("--page-delay", type=float, default=0.05)
+    recorder.add_argument("--search-delay", type=float, default=0.2)
+    recorder.add_argument("-c", "--concurrency", type=int, default=4)
+    runner = modes.add_parser("run", help="replay fixtures")
+    runner.add_argument("-n", "--requests", type=int, default=40)
+    runner.add_argument("-c", "--concurrency", type=int, default=4)
+    runner.add_argument("--warmup", type=int, default=2)
+    runner.add_argument(
+        "--latency-scale", type=float, default=1.0,
+        help="factor applied to the recorded upstream latencies"
+    )
+    runner.add_argument(
+        "--warm-caches", action="store_true",
+        help="keep the page, embedding and LLM caches filled by the warmup"
+    )
+    runner.add_argument("--save-baseline", metavar="PATH")
+    runner.add_argument("--baseline", metavar="PATH")
+    runner.add_argument("--tolerance", type=float, default=0.2)
+    for mode in (recorder, runner):
+        mode.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+        mode.add_argument(
+            "--no-rate-limits", action="store_true",
+            help="lift the client-side rate limits of the upstream APIs"
+        )
+    args = parser.parse_args()
+    asyncio.run(record(args) if args.mode == "record" else run(args))
@@ -0,0 +1,117 @@
+
+"""
+HTML extraction benchmark: pages per second for each engine, and the
+event-loop latency impact of extracting inline versus in the extraction pool.
+
+Uses the saved HTML pages of --corpus (*.html files), or a synthetic corpus.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_extraction.py --corpus path/to/pages
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+import extraction  # noqa: E402
+
+
+def synthetic_page(n: int, paragraphs: int = 400) -> str:
+    body = "".join(
+        f"<div class='c{i}'><p>Paragraph {i} of page {n}: the company "
+        f"<a href='/x{i}'>reported</a> revenue of {i * 7} million.</p>"
+        f"<aside>Related link {i}</aside></div>"
+        for i in range(paragraphs)
+    )
+    return (
+        "<html><head><title>Page</title>"
+        f"<script>{'var a = 1;' * 500}</script><style>p {{}}</style></head>"
+        f"<body><header>Site</header><nav>Home | News</nav>{body}"
+        "<form><input name='q'></form><footer>Cookies</footer></body></html>"
+    )
+
+
+def load_corpus(path: str | None, size: int) -> list[str]:
+    if path:
+        pages = []
+        for name in sorted(glob.glob(os.path.join(path, "*.html"))):
+            with open(name, encoding="utf-8", errors="replace") as f:
+                pages.append(f.read())
+        return pages
+    return [synthetic_page(n) for n in range(size)]
+
+
+async def measure_lag(work) -> tuple[float, float]:
+    """
+    Runs work() while a heartbeat measures how late the loop wakes it up.
+    Returns (max lag, p99 lag) in milliseconds.
+    """
+    lags = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        interval = 0.005
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - start - interval) * 1000)
+
+    beat = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.02)
+    await work()
+    done.set()
+    await beat
+    lags.sort()
+    return lags[-1], lags[int(len(lags) * 0.99) - 1]
+
+
+async def main(corpus, size, pool):
+    extraction.__EXTRACTION_POOL__ = pool
+    pages = load_corpus(corpus, size)
+    mb = sum(len(p) for p in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {mb:.1f} MB, {pool} pool")
+    print(f"{'engine':<12}{'pages/s':>10}{'inline max/p99 lag ms':>24}"
+          f"{'pool max/p99 lag ms':>22}")
+
+    for engine in extraction.available_engines():
+        start = time.perf_counter()
+        for page in pages:
+            extraction.extract_text(page, engine)
+        rate = len(pages) / (time.perf_counter() - start)
+
+        async def inline():
+            for page in pages:
+                extraction.extract_text(page, engine)
+                await asyncio.sleep(0)
+
+        async def pooled():
+            await asyncio.gather(*[
+                extraction.extract_text_async(page, engine)
+                for page in pages
+            ])
+
+        inline_lag = await measure_lag(inline)
+        pool_lag = await measure_lag(pooled)
+        print(f"{engine:<12}{rate:>10.1f}"
+              f"{inline_lag[0]:>14.1f} / {inline_lag[1]:<7.1f}"
+              f"{pool_lag[0]:>12.1f} / {pool_lag[1]:<7.1f}")
+
+    extraction.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", default=None,
+                        help="Folder of saved .html pages")
+    parser.add_argument("--size", type=int, default=100,
+                        help="Synthetic corpus size, if no --corpus")
+    parser.add_argument("--pool", choices=["thread", "process"],
+                        default="thread")
+    args = parser.parse_args()
+    asyncio.run(main(args.corpus, args.size, args.pool))
@@ -0,0 +1,97 @@
+
+"""
+Load benchmark: N concurrent /analyze calls against a local stub LLM.
+
+With non-blocking LLM calls, N concurrent requests should complete in about
+the time of a single one instead of N times as long.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_llm_concurrency.py --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+
+
+async def timed_batch(client, payload, n):
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/analyze", params={"refresh": "true"}, json=payload)
+        for _ in range(n)
+    ])
+    elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise RuntimeError(f"Failed responses: {failed}")
+    return elapsed
+
+
+async def main(concurrency, llm_delay, pages):
+    services = await FakeServices(llm_delay=llm_delay).start()
+    os.environ.update(fake_env(services.port))
+
+    import main as backend
+    import langchain_setup
+    from agents.search import SearchAgent
+    from url_scheduler import UrlScheduler
+    from cache import llm_cache
+
+    # Send raw strings to the stub: no tiktoken encoding download needed
+    langchain_setup.get_embeddings().check_embedding_ctx_length = False
+
+    # The stub has no quota: measure the concurrency, not the client-side
+    # rate limits configured for Azure OpenAI
+    for endpoint in langchain_setup.endpoints:
+        endpoint.requests = endpoint.tokens = None
+    # All the stub pages are on one host: no per-domain limits
+    UrlScheduler.domain_quota = UrlScheduler.domain_concurrency = None
+
+    # The same analysis is repeated: every call must reach the stub LLM
+    llm_cache.memory.max_bytes = 0
+    llm_cache.shared = None
+
+    # Serper is not part of this benchmark: return local pages directly
+    urls = services.page_urls(pages)
+
+    async def fake_stream_queries(self, queries, n_jobs=5):
+        yield urls
+
+    SearchAgent.stream_queries = fake_stream_queries
+
+    payload = {"subject": "ACME", "context": "supplier", "language": "en-US"}
+    transport = httpx.ASGITransport(app=backend.app)
+    async with backend.app.router.lifespan_context(backend.app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=300
+        ) as client:
+            await timed_batch(client, payload, 1)  # warm-up
+            single = await timed_batch(client, payload, 1)
+            parallel = await timed_batch(client, payload, concurrency)
+
+    await services.stop()
+
+    print(f"LLM delay per call:        {llm_delay:.2f}s")
+    print(f"1 request:                 {single:.2f}s")
+    print(f"{concurrency} concurrent requests: {parallel:.2f}s")
+    print(f"Slowdown vs single:        {parallel / single:.2f}x "
+          f"(serialized would be ~{concurrency}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-delay", type=float, default=0.5)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.llm_delay, args.pages))
@@ -0,0 +1,78 @@
+
+"""
+Scrape throughput benchmark: a new ClientSession for every URL (previous
+behaviour) versus the shared pooled session from http_client.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_scraper_pool.py --pages 300 --jobs 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+
+
+async def fetch_with_new_session(url, headers, semaphore):
+    async with semaphore:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers=headers) as resp:
+                return await resp.text()
+
+
+async def fetch_with_shared_session(url, headers, semaphore):
+    import http_client
+    async with semaphore:
+        async with http_client.get_session().get(
+            url, headers=headers
+        ) as resp:
+            return await resp.text()
+
+
+async def measure(services, fetch, urls, jobs):
+    services.peers.clear()
+    sem = asyncio.Semaphore(jobs)
+    headers = {"Connection": "keep-alive"}
+    start = time.perf_counter()
+    pages = await asyncio.gather(*[fetch(url, headers, sem) for url in urls])
+    elapsed = time.perf_counter() - start
+    assert all(pages)
+    return len(urls) / elapsed, len(services.peers)
+
+
+async def main(n_pages, jobs, page_delay):
+    services = await FakeServices(page_delay=page_delay).start()
+    os.environ.update(fake_env(services.port))
+    import http_client
+
+    urls = services.page_urls(n_pages)
+    await http_client.open_session()
+
+    before = await measure(services, fetch_with_new_session, urls, jobs)
+    after = await measure(services, fetch_with_shared_session, urls, jobs)
+
+    await http_client.close_session()
+    await services.stop()
+
+    print(f"{'mode':<16}{'pages/s':>10}{'connections':>14}")
+    print(f"{'per-URL session':<16}{before[0]:>10.1f}{before[1]:>14}")
+    print(f"{'shared session':<16}{after[0]:>10.1f}{after[1]:>14}")
+    print(f"Speed-up: {after[0] / before[0]:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--jobs", type=int, default=5)
+    parser.add_argument("--page-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(main(args.pages, args.jobs, args.page_delay))
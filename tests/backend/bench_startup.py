@@ -0,0 +1,360 @@
+
+"""
+Startup benchmark: what a new worker process costs before it serves.
+
+First imports the app in fresh interpreters and reports the import time
+and the time to create the upstream clients on first use. Then starts
+gunicorn with the backend's gunicorn.conf.py against local stub services,
+with and without preload_app, recycling each worker every --max-requests
+requests while /analyze is driven at --concurrency. For the initial and
+the replacement workers it reports the seconds from the fork to the app
+startup and to the first served /analyze, and the memory of each worker
+(PSS splits the pages shared copy-on-write between the processes sharing
+them; Linux only).
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_startup.py
+    python ../tests/backend/bench_startup.py --workers 4 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(TESTS, "..", "..", "backend")
+sys.path.insert(0, TESTS)
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+
+IMPORT_PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+import langchain_setup
+langchain_setup.preload_imports()
+preloaded = time.perf_counter()
+langchain_setup.get_llm()
+langchain_setup.get_embeddings()
+langchain_setup.get_google_search()
+created = time.perf_counter()
+print(json.dumps({
+    "import main": imported - start,
+    "client imports": preloaded - imported,
+    "client creation": created - preloaded,
+}))
+"""
+
+# The backend's gunicorn.conf.py, overridden for the benchmark; the hooks
+# log the workers' events and route their clients to the stub services.
+GUNICORN_CONF = """
+import json
+import os
+import sys
+import time
+
+exec(open({conf!r}).read())
+
+bind = {bind!r}
+workers = {workers}
+max_requests = {max_requests}
+max_requests_jitter = 0
+preload_app = {preload}
+log_file = {log!r}
+
+
+def _record(event, **data):
+    with open({events!r}, "a") as f:
+        f.write(json.dumps(
+            {{"pid": os.getpid(), "event": event, "t": time.time(), **data}}
+        ) + "\\n")
+
+
+def post_fork(server, worker):
+    _record("fork")
+
+
+def post_worker_init(worker):
+    import langchain_setup
+
+    search = langchain_setup.get_google_search.local
+    embeddings = langchain_setup.get_embeddings.local
+
+    def routed(factory=search.factory):
+        sys.path.insert(0, {tests!r})
+        from replay_services import route_serper
+        route_serper({base_url!r})
+        return factory()
+
+    def no_tiktoken(factory=embeddings.factory):
+        model = factory()
+        model.check_embedding_ctx_length = False
+        return model
+
+    search.factory = routed
+    embeddings.factory = no_tiktoken
+    # the stubs have no quota
+    for endpoint in langchain_setup.endpoints:
+        endpoint.requests = endpoint.tokens = None
+    # the stub pages are all on one host
+    from url_scheduler import UrlScheduler
+    UrlScheduler.domain_quota = UrlScheduler.domain_concurrency = None
+
+    app = worker.wsgi
+    served = []
+
+    async def timed(scope, receive, send):
+        if scope["type"] == "lifespan":
+            async def lifespan_send(message):
+                if message["type"] == "lifespan.startup.complete":
+                    _record("ready")
+                await send(message)
+            return await app(scope, receive, lifespan_send)
+        status = []
+
+        async def status_send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        await app(scope, receive, status_send)
+        if not served and scope["path"] == "/analyze":
+            served.append(True)
+            _record("first_request", status=status[0] if status else None)
+
+    worker.wsgi = timed
+"""
+
+
+def median(values: list[float]) -> float:
+    return statistics.median(values) if values else 0.0
+
+
+def measure_imports(repeat: int) -> dict:
+    """
+    Runs IMPORT_PROBE in repeat fresh interpreters.
+    Returns:
+        dict: Median seconds of each step.
+    """
+    env = {**os.environ, **fake_env(9)}
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {step: median([run[step] for run in runs]) for step in runs[0]}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def memory_kb(pid: int) -> dict:
+    """
+    Rss and Pss of a process in kB, empty if unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    fields = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in ("Rss", "Pss"):
+            fields[name] = int(value.split()[0])
+    return fields
+
+
+async def wait_until_up(base: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base) as client:
+        while True:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError("gunicorn did not start")
+            await asyncio.sleep(0.05)
+
+
+async def drive(base: str, requests: int, concurrency: int) -> int:
+    """
+    Posts requests /analyze calls (new connections, so that every worker
+    gets some) at most concurrency at a time.
+    Returns:
+        int: Failed requests.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+    limits = httpx.Limits(max_keepalive_connections=0)
+
+    async def post(client, i):
+        nonlocal failures
+        async with semaphore:
+            try:
+                response = await client.post(
+                    "/analyze", params={"refresh": "true"},
+                    json={"subject": f"Startup Subject {i}",
+                          "context": "company", "language": "en-US"}
+                )
+                failures += response.status_code != 200
+            except httpx.TransportError:
+                failures += 1  # e.g. a worker exiting after max_requests
+
+    async with httpx.AsyncClient(
+        base_url=base, timeout=120, limits=limits
+    ) as client:
+        await asyncio.gather(*[post(client, i) for i in range(requests)])
+    return failures
+
+
+async def run_gunicorn(services, args, preload: bool) -> dict:
+    """
+    Serves the app with gunicorn under load and collects the workers'
+    events.
+    Returns:
+        dict: Boot time, failures and per-worker timings and memory.
+    """
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        events = os.path.join(tmp, "events.jsonl")
+        log = os.path.join(tmp, "gunicorn.log")
+        conf = os.path.join(tmp, "gunicorn.conf.py")
+        with open(conf, "w") as f:
+            f.write(GUNICORN_CONF.format(
+                conf=os.path.join(BACKEND, "gunicorn.conf.py"),
+                bind=f"127.0.0.1:{port}", workers=args.workers,
+                max_requests=args.max_requests, preload=preload, log=log,
+                events=events, tests=TESTS, base_url=services.base_url,
+            ))
+        env = {**os.environ, **fake_env(services.port)}
+        launched = time.time()
+        output = open(log, "a")
+        master = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "main:app", "-c", conf],
+            cwd=BACKEND, env=env, stdout=output, stderr=output
+        )
+        try:
+            await wait_until_up(base)
+            up = time.time()
+            failures = await drive(base, args.requests, args.concurrency)
+            with open(events) as f:
+                records = [json.loads(line) for line in f]
+            live = {
+                r["pid"] for r in records
+                if os.path.exists(f"/proc/{r['pid']}")
+            }
+            memory = {
+                "master": memory_kb(master.pid),
+                "workers": [memory_kb(pid) for pid in sorted(live)],
+            }
+        except Exception:
+            if os.path.exists(log):
+                with open(log) as f:
+                    sys.stderr.write(f.read()[-4000:])
+            raise
+        finally:
+            # graceful stop: the uvicorn workers do not all honour the
+            # SIGQUIT a quick stop sends them
+            master.send_signal(signal.SIGTERM)
+            try:
+                master.wait(30)
+            except subprocess.TimeoutExpired:
+                master.kill()
+            output.close()
+
+    workers = {}
+    for record in records:
+        workers.setdefault(record["pid"], {})[record["event"]] = record
+    rows = []
+    by_fork = sorted(workers.items(), key=lambda w: w[1]["fork"]["t"])
+    for n, (pid, seen) in enumerate(by_fork):
+        fork = seen["fork"]["t"]
+        first = seen.get("first_request")
+        rows.append({
+            "pid": pid,
+            "kind": "initial" if n < args.workers else "replacement",
+            "ready": seen["ready"]["t"] - fork if "ready" in seen else None,
+            "first": first["t"] - fork if first else None,
+            "status": first.get("status") if first else None,
+        })
+    return {
+        "boot": up - launched, "failures": failures, "workers": rows,
+        "memory": memory,
+    }
+
+
+def seconds(value) -> str:
+    return "-" if value is None else f"{value:.3f}s"
+
+
+def report(mode: str, result: dict) -> None:
+    """
+    Prints each worker's timings, then their medians by kind.
+    """
+    print(f"\n{mode}: first /health after {result['boot']:.2f}s, "
+          f"{result['failures']} failed requests")
+    print(f"{'worker':<20} {'fork->ready':>12} {'fork->1st req':>14} "
+          f"{'status':>7}")
+    for row in result["workers"]:
+        print(f"{row['pid']:>7} {row['kind']:<12} "
+              f"{seconds(row['ready']):>12} {seconds(row['first']):>14} "
+              f"{row['status'] or '-':>7}")
+    for kind in ("initial", "replacement"):
+        rows = [row for row in result["workers"] if row["kind"] == kind]
+        ready = [row["ready"] for row in rows if row["ready"] is not None]
+        first = [row["first"] for row in rows if row["first"] is not None]
+        if rows:
+            print(f"{'median ' + kind:<20} {median(ready):>11.3f}s "
+                  f"{median(first):>13.3f}s")
+    memory = result["memory"]
+    workers = [m for m in memory["workers"] if m]
+    if workers:
+        print(f"memory: master {memory['master'].get('Rss', 0) / 1024:.0f}"
+              f" MB RSS, workers "
+              f"{median([m['Rss'] for m in workers]) / 1024:.0f} MB RSS / "
+              f"{median([m['Pss'] for m in workers]) / 1024:.0f} MB PSS")
+
+
+async def main(args):
+    print("Import (median of", args.repeat, "fresh interpreters)")
+    for step, seconds in measure_imports(args.repeat).items():
+        print(f"  {step:<16} {seconds:.3f}s")
+
+    services = await FakeServices(llm_delay=args.llm_delay).start()
+    try:
+        for preload in (True, False):
+            result = await run_gunicorn(services, args, preload)
+            report(f"preload_app={preload}", result)
+    finally:
+        await services.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-requests", type=int, default=10,
+                        help="requests before a worker is recycled")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--llm-delay", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
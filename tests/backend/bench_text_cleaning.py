@@ -0,0 +1,64 @@
+
+"""
+Micro-benchmark: text_cleaning.clean_sentences against the previous
+per-character clean_text_gen, on large extracted page texts.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_text_cleaning.py --pages 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from cleaning_tests import legacy_clean_text_gen  # noqa: E402
+from text_cleaning import clean_sentences, clean_pages  # noqa: E402
+
+
+def page_text(n: int, sentences: int = 3000) -> str:
+    return " ".join(
+        f"Sentence {i % 500} says the company — [{i}] reported revenue of "
+        f"€{i * 3} million ({n}), according to “sources” -- see below."
+        if i % 3 else
+        "We use cookies to improve your experience on this site."
+        for i in range(sentences)
+    )
+
+
+def timed(fn, pages):
+    start = time.perf_counter()
+    result = fn(pages)
+    return time.perf_counter() - start, result
+
+
+def main(n_pages):
+    pages = [page_text(n) for n in range(n_pages)]
+    mb = sum(len(p) for p in pages) / 1e6
+
+    legacy_time, legacy = timed(
+        lambda ps: [s for p in ps for s in legacy_clean_text_gen(p)], pages
+    )
+    new_time, new = timed(
+        lambda ps: [s for p in ps for s in clean_sentences(p)], pages
+    )
+    batch_time, batch = timed(clean_pages, pages)
+
+    assert new == legacy
+    print(f"Input: {n_pages} pages, {mb:.1f} MB")
+    print(f"legacy clean_text_gen:   {legacy_time:.3f}s  "
+          f"({mb / legacy_time:.1f} MB/s)")
+    print(f"clean_sentences:         {new_time:.3f}s  "
+          f"({mb / new_time:.1f} MB/s, {legacy_time / new_time:.1f}x)")
+    print(f"clean_pages (dedup):     {batch_time:.3f}s  "
+          f"({len(batch)} of {len(new)} sentences kept)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=50)
+    main(parser.parse_args().pages)
@@ -0,0 +1,90 @@
+
+"""
+Throttling benchmark: a burst of LLM calls against a local stub that
+accepts a fixed number of completions per second and answers the others
+with 429, like an Azure OpenAI deployment over quota.
+
+Compares the previous behaviour (no client-side limit, the OpenAI client's
+own two retries) with llm_endpoint (rate limit under the quota, shared
+pause on 429, jittered backoff).
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_upstream_throttling.py --calls 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import FakeServices, fake_env  # noqa: E402
+
+
+async def burst(ainvoke_llm, model, calls):
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        ainvoke_llm("trust score of ACME", model=model)
+        for _ in range(calls)
+    ], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = sum(isinstance(result, Exception) for result in results)
+    return calls - failed, failed, elapsed
+
+
+async def main(calls, quota, llm_delay):
+    services = await FakeServices(
+        llm_delay=llm_delay, llm_quota=quota
+    ).start()
+    os.environ.update(fake_env(services.port))
+
+    import langchain_setup
+    from langchain_openai import AzureChatOpenAI
+    from resilience import Endpoint
+
+    endpoint = langchain_setup.llm_endpoint
+    rows = []
+
+    # before: no client-side limit, retries left to the OpenAI client
+    langchain_setup.llm_endpoint = Endpoint("llm", max_attempts=1)
+    unguarded = AzureChatOpenAI(
+        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        azure_deployment="chat", max_retries=2
+    )
+    services.calls["throttled"] = 0
+    rows.append(("unguarded", *await burst(
+        langchain_setup.ainvoke_llm, unguarded, calls
+    ), services.calls["throttled"]))
+
+    await asyncio.sleep(1.5)  # let the stub's quota window reset
+    langchain_setup.llm_endpoint = Endpoint(
+        "llm", requests_per_minute=quota * 60 * 0.9,
+        timeout=endpoint.timeout, deadline=120,
+    )
+    services.calls["throttled"] = 0
+    rows.append(("llm_endpoint", *await burst(
+        langchain_setup.ainvoke_llm, langchain_setup.get_llm(), calls
+    ), services.calls["throttled"]))
+
+    await services.stop()
+
+    print(f"{calls} calls, upstream quota {quota}/s, "
+          f"{llm_delay:.2f}s per completion")
+    print(f"{'mode':<14}{'ok':>6}{'failed':>8}{'429s':>7}"
+          f"{'seconds':>9}{'ok/s':>7}")
+    for mode, ok, failed, elapsed, throttled in rows:
+        print(f"{mode:<14}{ok:>6}{failed:>8}{throttled:>7}"
+              f"{elapsed:>9.2f}{ok / elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--quota", type=int, default=20)
+    parser.add_argument("--llm-delay", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.quota, args.llm_delay))
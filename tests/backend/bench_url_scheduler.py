@@ -0,0 +1,170 @@
+
+"""
+URL scheduling benchmark: pages downloaded by the scrape stage with the
+former selection (the queries' links flattened, the first top_k kept,
+n_jobs downloads at a time) and with the UrlScheduler.
+
+Search results are simulated: each query returns links of a pool of
+domains, some as variants of the same page (www., tracking parameters),
+and a few domains are slow. Downloads are simulated with sleeps, with the
+scheduler's domain history warmed up by --warmup earlier analyses. Reports
+the pages downloaded twice, the pages of slow domains, the domains and
+queries covered, and the scrape time (median and worst analysis).
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_url_scheduler.py
+    python ../tests/backend/bench_url_scheduler.py --analyses 50 --top-k 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import fake_env  # noqa: E402
+
+for name, value in fake_env(0).items():
+    os.environ.setdefault(name, value)
+
+from url_scheduler import (  # noqa: E402
+    DomainStats, UrlScheduler, domain_of, url_key
+)
+
+VARIANTS = [
+    "https://{host}/{path}", "https://www.{host}/{path}/",
+    "http://{host}/{path}?utm_source=google&utm_medium=organic",
+    "https://{host}/{path}?gclid=abc#section",
+]
+
+
+def search_results(rng, n_queries, per_query, domains):
+    """
+    Links of each query; popular domains (first in the list) come up in
+    most queries, often with the same pages.
+    """
+    results = []
+    for _ in range(n_queries):
+        links = []
+        for _ in range(per_query):
+            host = domains[min(int(rng.expovariate(0.4)), len(domains) - 1)]
+            path = f"page{rng.randrange(3)}"
+            links.append(rng.choice(VARIANTS).format(host=host, path=path))
+        results.append(links)
+    return results
+
+
+def latency(rng, url, slow_domains, slow_seconds, scale):
+    base = slow_seconds if domain_of(url) in slow_domains else 0.2
+    return base * rng.uniform(0.5, 1.5) * scale
+
+
+async def former(results, top_k, n_jobs, delay):
+    links = [url for query in results for url in query][:top_k]
+    sem = asyncio.Semaphore(n_jobs)
+
+    async def fetch(url):
+        async with sem:
+            await asyncio.sleep(delay(url))
+
+    await asyncio.gather(*[fetch(url) for url in links])
+    return links
+
+
+async def scheduled(results, top_k, n_jobs, delay, history):
+    scheduler = UrlScheduler(top_k, n_queries=len(results), history=history)
+    for links in results:
+        scheduler.add(links)
+    scheduler.close()
+    started = []
+
+    async def fetch(url):
+        started.append(url)
+        start = time.monotonic()
+        await asyncio.sleep(delay(url))
+        history.record(domain_of(url), time.monotonic() - start)
+
+    await scheduler.run(fetch, n_jobs)
+    return started
+
+
+def summary(results, links, slow_domains):
+    keys = [url_key(url) for url in links]
+    queries = {
+        n for n, query in enumerate(results)
+        for url in query if url in links
+    }
+    return {
+        "duplicates": len(keys) - len(set(keys)),
+        "domains": len({domain_of(url) for url in links}),
+        "slow": sum(domain_of(url) in slow_domains for url in links),
+        "queries": len(queries),
+    }
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    domains = [f"site{n}.com" for n in range(args.domains)]
+    slow_domains = set(rng.sample(domains[:6], args.slow_domains))
+    # the history's notion of slow follows the simulated latencies
+    history = DomainStats(slow_seconds=args.history_slow * args.scale)
+
+    def delay(url):
+        return latency(rng, url, slow_domains, args.slow_seconds, args.scale)
+
+    for _ in range(args.warmup):
+        results = search_results(rng, args.queries, args.per_query, domains)
+        await scheduled(results, args.top_k, args.jobs, delay, history)
+
+    rows = {"former": [], "scheduler": []}
+    for _ in range(args.analyses):
+        results = search_results(rng, args.queries, args.per_query, domains)
+        for mode in rows:
+            start = time.perf_counter()
+            if mode == "former":
+                links = await former(results, args.top_k, args.jobs, delay)
+            else:
+                links = await scheduled(
+                    results, args.top_k, args.jobs, delay, history
+                )
+            row = summary(results, links, slow_domains)
+            row["seconds"] = time.perf_counter() - start
+            rows[mode].append(row)
+
+    print(f"{args.analyses} analyses, top_k {args.top_k}, "
+          f"{args.queries} queries, slow domains: {sorted(slow_domains)}")
+    print(f"{'mode':<10} {'dup. fetches':>12} {'slow pages':>10} "
+          f"{'domains':>8} {'queries':>8} {'median s':>9} {'worst s':>8}")
+    for mode, runs in rows.items():
+        seconds = [run["seconds"] for run in runs]
+        print(f"{mode:<10} "
+              f"{statistics.mean(r['duplicates'] for r in runs):>12.2f} "
+              f"{statistics.mean(r['slow'] for r in runs):>10.2f} "
+              f"{statistics.mean(r['domains'] for r in runs):>8.2f} "
+              f"{statistics.mean(r['queries'] for r in runs):>8.2f} "
+              f"{statistics.median(seconds):>9.3f} {max(seconds):>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyses", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=4)
+    parser.add_argument("--per-query", type=int, default=10)
+    parser.add_argument("--domains", type=int, default=30)
+    parser.add_argument("--slow-domains", type=int, default=2)
+    parser.add_argument("--slow-seconds", type=float, default=3.0)
+    parser.add_argument("--history-slow", type=float,
+                        default=DomainStats().slow_seconds)
+    parser.add_argument("--scale", type=float, default=0.1,
+                        help="factor applied to the simulated latencies")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,106 @@
+
+"""
+Verifier benchmark: wall time of one verification as the evidence grows,
+in a single prompt holding all of it and split into concurrent shards of
+__VERIFIER_PROMPT_TOKENS__ (map-reduce).
+
+The LLM is simulated in process: each call takes --base seconds plus
+--per-1k seconds per thousand prompt tokens (prefill), so only the prompt
+sizes and the parallelism are measured. Chunks come from --domains source
+domains.
+
+Usage (from the backend folder):
+    python ../tests/backend/bench_verifier_shards.py
+    python ../tests/backend/bench_verifier_shards.py --per-1k 0.4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from fake_services import fake_env  # noqa: E402
+
+for name, value in fake_env(0).items():
+    os.environ.setdefault(name, value)
+
+import agents.verifier as verifier  # noqa: E402
+from config import __VERIFIER_PROMPT_TOKENS__  # noqa: E402
+from prompt_packing import chunk_cost, count_tokens  # noqa: E402
+
+
+def evidence(tokens: int, domains: int) -> list[Document]:
+    """
+    Chunks of about tokens tokens in total, spread over the domains.
+    """
+    chunks = []
+    total = 0
+    while total < tokens:
+        n = len(chunks)
+        chunk = Document(
+            page_content=f"Statement {n} about the subject: "
+            + " ".join(f"detail{n}x{i}" for i in range(60)),
+            metadata={"source": f"https://site{n % domains}.com/{n}",
+                      "score": 1 / (n + 1)},
+        )
+        chunks.append(chunk)
+        total += chunk_cost(chunk)
+    return chunks
+
+
+async def measure(chunks, max_tokens, max_shards, args):
+    calls = []
+
+    async def ainvoke(prompt, model=None):
+        tokens = count_tokens(prompt)
+        calls.append(tokens)
+        await asyncio.sleep(args.base + args.per_1k * tokens / 1000)
+        return "OK"
+
+    verifier.ainvoke_llm = ainvoke
+    start = time.perf_counter()
+    result = await verifier.VerifierAgent().run(
+        chunks, "en", max_tokens=max_tokens, max_shards=max_shards
+    )
+    return time.perf_counter() - start, calls, len(result["data"])
+
+
+async def main(args):
+    # the tokenizer and the LLM client are loaded outside the measures
+    count_tokens("")
+    verifier.VerifierAgent()
+    print(f"LLM model: {args.base}s + {args.per_1k}s per 1k prompt tokens; "
+          f"shards of {__VERIFIER_PROMPT_TOKENS__} tokens")
+    print(f"{'evidence':>9} {'mode':<8} {'calls':>5} {'largest':>8} "
+          f"{'chunks':>7} {'seconds':>8}")
+    for size in args.sizes:
+        chunks = evidence(size, args.domains)
+        modes = [
+            # everything in one prompt, as large as needed
+            ("single", size * 2, 1),
+            ("sharded", __VERIFIER_PROMPT_TOKENS__, args.max_shards),
+        ]
+        for mode, max_tokens, max_shards in modes:
+            seconds, calls, kept = await measure(
+                chunks, max_tokens, max_shards, args
+            )
+            print(f"{size:>9} {mode:<8} {len(calls):>5} {max(calls):>8} "
+                  f"{kept:>7} {seconds:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[2000, 5000, 10000, 20000])
+    parser.add_argument("--domains", type=int, default=12)
+    parser.add_argument("--max-shards", type=int, default=4)
+    parser.add_argument("--base", type=float, default=1.0)
+    parser.add_argument("--per-1k", type=float, default=0.25)
+    asyncio.run(main(parser.parse_args()))
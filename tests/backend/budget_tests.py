@@ -0,0 +1,107 @@
+"""
+Tests of the request budget and of the incremental retries of an analysis.
+
+Run from the repository root:
+    pytest tests/backend/budget_tests.py
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from fake_services import patch_agents
+
+import main
+from budget import BudgetExceeded, RequestBudget
+from budget import charge, current_budget
+from resilience import DeadlineExceeded
+
+REQUEST = main.AnalysisRequest(
+    subject="ACME", context="the subject operated", language="en"
+)
+
+
+def test_request_budget_limits():
+    async def run():
+        budget = RequestBudget(seconds=0.1, max_llm_calls=2)
+        assert await budget.limit(asyncio.sleep(0, "done")) == "done"
+        with pytest.raises(BudgetExceeded):
+            await budget.limit(asyncio.sleep(5))
+        assert budget.exhausted()
+
+        budget = RequestBudget(max_llm_calls=2)
+        token = current_budget.set(budget)
+        charge("llm_calls")
+        assert not budget.exhausted()
+        charge("llm_calls")
+        assert budget.exhausted() and budget.counters["llm_calls"] == 2
+        with pytest.raises(BudgetExceeded):
+            charge("llm_calls")
+        assert budget.counters["llm_calls"] == 2
+        current_budget.reset(token)
+        charge("llm_calls")  # no analysis running: not charged
+        assert budget.counters["llm_calls"] == 2
+
+    asyncio.run(run())
+
+
+def test_retry_searches_follow_up_query_into_same_evidence(monkeypatch):
+    async def score(on_token):
+        return 80.0, "consistent"
+
+    searched, evidence, generated = patch_agents(monkeypatch, [
+        {"whys": ["founding date unclear"], "suggested_retry": "founded"},
+        "OK",
+    ], score)
+
+    response = asyncio.run(main.inference(REQUEST))
+
+    assert response.trust_score == 80.0
+    # only the follow-up query is searched, and its chunks are added to
+    # the evidence of the first attempt
+    assert searched == [["ACME history", "ACME reviews"], ['"ACME" founded']]
+    assert generated == [True]
+    assert len(evidence) == 2 and evidence[1] > evidence[0]
+
+
+@pytest.mark.parametrize("failure", ["late deadline", "budget"])
+def test_scoring_out_of_time_is_no_server_error(monkeypatch, failure):
+    async def score(on_token):
+        await asyncio.sleep(0.45 if failure == "late deadline" else 5)
+        # an upstream giving up as the request budget runs out
+        raise DeadlineExceeded("llm: deadline exceeded")
+
+    patch_agents(monkeypatch, ["OK"], score)
+    monkeypatch.setattr(
+        main, "RequestBudget", lambda: RequestBudget(seconds=0.5)
+    )
+    monkeypatch.setattr(main, "__SCORER_TIME_RESERVE__", 0.1)
+    monkeypatch.setattr(main, "__REQUEST_DEADLINE_SLACK__", 0.1)
+
+    response = asyncio.run(main.inference(REQUEST))
+    assert response.trust_score == 0.0
+
+
+def test_upstream_deadline_with_budget_left_is_server_error(monkeypatch):
+    async def score(on_token):
+        raise DeadlineExceeded("llm: deadline exceeded")
+
+    patch_agents(monkeypatch, ["OK"], score)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.inference(REQUEST))
+    assert error.value.status_code == 500
+
+
+def test_call_limit_enforced_on_scoring(monkeypatch):
+    async def score(on_token):
+        return 80.0, "consistent"
+
+    patch_agents(monkeypatch, ["OK"], score)
+    # the query generation and the verification use both calls
+    monkeypatch.setattr(
+        main, "RequestBudget", lambda: RequestBudget(max_llm_calls=2)
+    )
+
+    response = asyncio.run(main.inference(REQUEST))
+    assert response.trust_score == 0.0
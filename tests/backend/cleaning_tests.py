@@ -0,0 +1,94 @@
+
+"""
+Equivalence tests: text_cleaning against the previous per-character
+implementation of ScraperAgent.clean_text_gen.
+
+Run from the repository root:
+    pytest tests/backend/cleaning_tests.py
+"""
+import random
+import re
+
+from text_cleaning import clean_sentences, clean_pages
+
+
+def legacy_clean_text_gen(text):
+    """
+    Previous ScraperAgent.clean_text_gen, kept as the reference output.
+    """
+    if not isinstance(text, str):
+        if isinstance(text, list):
+            text = " ".join(str(x) for x in text)
+        else:
+            text = str(text)
+
+    text = re.sub(r"\[\w+\]", "", text)
+    text = re.sub(r"([^\w\s]{2,}|_{2,}|-{2,})", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+
+    for s in sentences:
+        cleaned = "".join(
+            c for c in s if 32 <= ord(c) <= 126 or c in "\n\r\t"
+        ).strip()
+        if 15 < len(cleaned) < 1024 and not cleaned.isdigit():
+            yield cleaned
+
+
+SAMPLES = [
+    "",
+    "Short. Tiny!",
+    "The company was founded in 1998 [1]. It employs 200 people!! Really?",
+    "Prezzo: 10€ — offerta valida fino al 31/12. Perché è conveniente?",
+    "Line one.\nLine two is here\tand continues.\r\nThird line ends here.",
+    "Header ---- Section ____ Name ... More text follows after this.",
+    "Control\x00chars\x07 inside\x1b a long sentence here. End\x7f of it.",
+    "Numbers only follow. 1234567890123456789 . Then more words here.",
+    "Ellipsis end.é Next sentence starts with an accent here.",
+    "Unicode spaces and　ideographic space in a sentence.",
+    "Separators\x1c\x1d\x1e\x1f inside this sentence text here.",
+    ["list", "input", "is joined with spaces into one long sentence."],
+    12345678901234567890,
+    "x" * 2000 + ". A normal sentence after a long one.",
+]
+
+
+def random_text(rng, length):
+    alphabet = (
+        "abcdefghij KLMNOP  ..!!??--__[]()\n\t\r"
+        "\x00\x07\x1b\x7f  éàü€—“”0123456789"
+    )
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def test_samples_match_legacy():
+    for text in SAMPLES:
+        assert clean_sentences(text) == list(legacy_clean_text_gen(text))
+
+
+def test_random_texts_match_legacy():
+    rng = random.Random(42)
+    for _ in range(500):
+        text = random_text(rng, rng.randint(0, 400))
+        assert clean_sentences(text) == list(legacy_clean_text_gen(text))
+
+
+def test_near_duplicates_removed_across_pages():
+    pages = [
+        "We use cookies to improve your experience. ACME was founded in "
+        "1998 in Milan.",
+        "WE USE COOKIES, to improve your experience! ACME has 200 "
+        "employees today.",
+    ]
+    assert clean_pages(pages) == [
+        "We use cookies to improve your experience.",
+        "ACME was founded in 1998 in Milan.",
+        "ACME has 200 employees today.",
+    ]
+    assert len(clean_pages(pages, dedup=False)) == 4
+
+
+def test_batch_skips_failed_pages():
+    assert clean_pages([None, "", "A sentence that is long enough."]) == [
+        "A sentence that is long enough."
+    ]
@@ -1,5 +1,18 @@
+import os
+import sys
+
 import pytest
 
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend"
+))
+
+from fake_services import fake_env  # noqa: E402
+
+# the backend clients are created on first use; none is called by the tests
+for name, value in fake_env(0).items():
+    os.environ.setdefault(name, value)
+
 
 def pytest_addoption(parser):
     parser.addoption(
@@ -0,0 +1,99 @@
+
+"""
+Tests of the chunk deduplication stage (boilerplate, exact and near
+duplicates).
+
+Run from the repository root:
+    pytest tests/backend/dedup_tests.py
+"""
+
+from dedup import (
+    NearDuplicateIndex,
+    boilerplate_keys,
+    deduplicate_pages,
+    minhash_signatures,
+)
+from text_cleaning import dedup_key
+
+BANNER = "We use cookies to improve your experience on this website."
+NAV = "Home News Sport Business Contact Us About the company."
+WIRE = (
+    "The central bank raised interest rates by a quarter point on "
+    "Tuesday, citing persistent inflation in the services sector."
+)
+
+
+def page(url, *sentences):
+    return url, " ".join(sentences)
+
+
+def test_boilerplate_across_pages_and_hosts():
+    fact = "ACME was founded in 1998 in Milan."
+    pages = [
+        ("https://a.com/1", [BANNER, NAV, fact, "First article text."]),
+        ("https://a.com/2", [BANNER, NAV, fact, "Second article text."]),
+        ("https://a.com/3", [NAV, "Third article text here."]),
+    ] + [
+        (f"https://site{n}.com/1", [BANNER, f"Article {n} text here."])
+        for n in range(3)
+    ] + [("https://other.com/1", ["Seventh article text here."])]
+    # the banner is on most pages, the navigation on every page of a.com
+    assert boilerplate_keys(pages, min_pages=3, ratio=0.5) == {
+        dedup_key(BANNER), dedup_key(NAV)
+    }
+    # a fact repeated by two pages of a site, or by two sites, is evidence
+    assert boilerplate_keys(pages[:2], min_pages=3, ratio=0.5) == set()
+    assert boilerplate_keys(pages[1:5], min_pages=3, ratio=0.5) == {
+        dedup_key(BANNER)
+    }
+
+
+def test_deduplicate_pages():
+    result = deduplicate_pages([
+        page("https://a.com/1", BANNER, NAV, WIRE),
+        page("https://a.com/2", BANNER, NAV, "ACME was founded in 1998."),
+        page("https://b.com/1", BANNER, WIRE.upper()),
+        ("https://c.com/1", None),
+        page("https://d.com/1", BANNER, "ACME has 200 employees today."),
+    ])
+    # the navigation of a.com is on two pages only: kept once
+    assert result.chunks == [
+        NAV, WIRE, "ACME was founded in 1998.",
+        "ACME has 200 employees today."
+    ]
+    assert result.sources == [
+        "https://a.com/1", "https://a.com/1", "https://a.com/2",
+        "https://d.com/1",
+    ]
+    assert result.counts == {
+        "sentences": 10, "boilerplate": 4, "duplicates": 2
+    }
+    assert result.signatures.shape == (4, 129)
+
+
+def test_near_duplicates_filtered():
+    chunks = [
+        WIRE,
+        WIRE.replace("Tuesday", "Tuesday afternoon"),
+        "ACME reported record profits for the third consecutive quarter.",
+    ]
+    index = NearDuplicateIndex(threshold=0.6)
+    assert index.filter(chunks, minhash_signatures(chunks)) == [
+        chunks[0], chunks[2]
+    ]
+    # later batches are checked against the chunks already indexed
+    later = [
+        WIRE.replace("Tuesday", "Monday"),
+        "ACME reported record profits for the 3 consecutive quarter.",
+    ]
+    assert index.filter(later, minhash_signatures(later)) == [later[1]]
+    assert len(index) == 3
+
+
+def test_distinct_templated_sentences_kept():
+    chunks = [
+        f"Revenue in {year} was {year * 3} million euros." for year in
+        range(1990, 2020)
+    ]
+    index = NearDuplicateIndex()
+    assert index.filter(chunks, minhash_signatures(chunks)) == chunks
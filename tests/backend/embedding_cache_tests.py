@@ -0,0 +1,98 @@
+"""
+Tests of the embedding cache: the in-memory LRU of CachedEmbeddings and
+the on-disk EmbeddingStore shared by worker processes.
+
+Run from the repository root:
+    pytest tests/backend/embedding_cache_tests.py
+"""
+import asyncio
+import os
+import sqlite3
+
+from fake_services import CountingEmbeddings
+
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from embedding_cache import embedding_key
+
+
+def key(n: int) -> str:
+    return embedding_key(f"chunk {n}", "test")
+
+
+def test_cached_embeddings_hits_and_misses():
+    upstream = CountingEmbeddings()
+    embeddings = CachedEmbeddings(upstream, max_items=2)
+
+    async def run():
+        first = await embeddings.aembed_documents(["a", "bb", "a"])
+        second = await embeddings.aembed_documents(["bb", "a"])
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert second == [[2.0, 1.0], [1.0, 1.0]]
+    # duplicates are sent once, and hits are not sent at all
+    assert upstream.batches == [["a", "bb"]]
+    # the LRU keeps max_items vectors: 'bb', used least recently, is
+    # evicted by 'ccc'
+    embeddings.embed_documents(["ccc"])
+    embeddings.embed_documents(["a", "bb"])
+    assert upstream.batches[1:] == [["ccc"], ["bb"]]
+    stats = embeddings.stats()
+    assert stats["memory_hits"] == 3 and stats["misses"] == 4
+    assert stats["memory_items"] == 2 and stats["hit_ratio"] == 3 / 7
+
+
+def test_embedding_store_evicts_least_recently_used(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "vectors", capacity=3)
+    store.put_many({key(n): [float(n), 1.0] for n in range(3)})
+    # keeps key(0) recent
+    assert list(store.get_many([key(0)])) == [key(0)]
+    store.put_many({key(3): [3.0, 1.0], key(4): [4.0, 1.0]})
+    found = store.get_many([key(n) for n in range(5)])
+    assert sorted(found) == sorted([key(0), key(3), key(4)])
+    assert found[key(4)].tolist() == [4.0, 1.0]
+    assert found[key(0)].tolist() == [0.0, 1.0]
+
+    # a batch larger than the store keeps its last vectors
+    store.put_many({key(n): [float(n), 1.0] for n in range(10, 15)})
+    found = store.get_many([key(n) for n in range(15)])
+    assert sorted(found) == sorted([key(12), key(13), key(14)])
+    assert {vector[0] for vector in found.values()} == {12.0, 13.0, 14.0}
+
+
+def test_embedding_store_reads_many_keys_in_batches(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "vectors", capacity=2000)
+    # the default of SQLite builds before 3.32
+    store._conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    store.put_many({key(n): [float(n), 1.0] for n in range(1200)})
+    found = store.get_many([key(n) for n in range(1300)])
+    assert len(found) == 1200
+    assert found[key(1199)].tolist() == [1199.0, 1.0]
+
+
+def test_embedding_store_reused_across_processes(tmp_path):
+    texts = [f"shared chunk {n}" for n in range(4)]
+
+    pid = os.fork()
+    if pid == 0:
+        # a worker process embeds the chunks and stores them
+        try:
+            worker = CachedEmbeddings(
+                CountingEmbeddings(),
+                store=EmbeddingStore(str(tmp_path), "vectors", 100)
+            )
+            worker.embed_documents(texts)
+            os._exit(0)
+        except BaseException:
+            os._exit(1)
+    assert os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+
+    upstream = CountingEmbeddings()
+    embeddings = CachedEmbeddings(
+        upstream, store=EmbeddingStore(str(tmp_path), "vectors", 100)
+    )
+    vectors = asyncio.run(embeddings.aembed_documents(texts + ["new"]))
+    assert vectors == [[float(len(text)), 1.0] for text in texts + ["new"]]
+    assert upstream.batches == [["new"]]
+    assert embeddings.stats()["shared_hits"] == 4
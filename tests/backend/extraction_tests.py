@@ -0,0 +1,77 @@
+"""
+Tests of the page decoding and HTML text extraction engines.
+
+Run from the repository root:
+    pytest tests/backend/extraction_tests.py
+"""
+import asyncio
+
+from aiohttp import web
+
+from fake_services import fake_page
+
+import http_client
+from agents.scraper import HEADERS, ScraperAgent
+from extraction import available_engines, decode_html
+from extraction import extract_text
+
+PAGE = "<html><body><p>Società fondata a Milano nel 1998.</p></body></html>"
+
+
+def test_decode_html_charset_sources():
+    latin = PAGE.encode("latin-1")
+    assert decode_html(latin, "iso-8859-1") == PAGE
+    meta = b'<html><head><meta charset="iso-8859-1"></head>' + latin
+    assert "Società" in decode_html(meta)
+    assert decode_html(PAGE.encode("utf-8")) == PAGE
+    assert decode_html(PAGE.encode("utf-8"), "no-such-charset") == PAGE
+    # a download cut in the middle of a character
+    assert decode_html("città".encode("utf-8")[:-1]) == "citt"
+    assert "Societ" in decode_html(latin)
+
+
+def test_page_without_charset_is_read():
+    body = PAGE.encode("utf-8")
+
+    async def page(request):
+        return web.Response(body=body, headers={"Content-Type": "text/html"})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with http_client.get_session().get(
+                f"http://127.0.0.1:{port}/", headers=HEADERS
+            ) as resp:
+                assert resp.charset is None
+                return await ScraperAgent().read_capped(resp)
+        finally:
+            await http_client.close_session()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == PAGE
+
+
+def test_engines_agree():
+    expected = extract_text(fake_page(1), "bs4")
+    assert "Page 1 reports" in expected
+    assert "Cookie notice" not in expected and "var x" not in expected
+    for engine in available_engines():
+        assert extract_text(fake_page(1), engine) == expected
+
+
+def test_engines_handle_xml_declarations_and_empty_documents():
+    xhtml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        "<p>XHTML evidence.</p></body></html>"
+    )
+    for engine in available_engines():
+        assert extract_text(xhtml, engine) == "XHTML evidence."
+        for empty in ("", "   ", "<!-- nothing here -->"):
+            assert extract_text(empty, engine) == ""
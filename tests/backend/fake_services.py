@@ -0,0 +1,518 @@
+
+"""
+Local stand-ins for the upstream services used by the backend (Azure OpenAI
+chat and embeddings, Serper, web pages, a Redis server) so benchmarks and
+tests can run without API keys.
+"""
+import asyncio
+import fnmatch
+import hashlib
+import json
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_DIM = 64
+
+
+def fake_completion(prompt: str, reject: bool = False) -> str:
+    """
+    Returns a plausible completion for the prompt of each agent.
+    If reject is True, the verifier reports a contradiction.
+    """
+    if "OSINT research agent" in prompt and "Inputs: " in prompt:
+        inputs = json.loads(prompt.split("Inputs: ", 1)[1])
+        return json.dumps({
+            item["id"]: [f"{item['name']} query {i}" for i in range(5)]
+            for item in inputs
+        })
+    if "OSINT research agent" in prompt:
+        return json.dumps([f"query {i}" for i in range(5)])
+    if "trust score" in prompt:
+        return json.dumps({"score": 80, "details": "Consistent sources."})
+    if reject:
+        return json.dumps({
+            "whys": ["Founding year differs between sources."],
+            "suggested_retry": "founding year",
+        })
+    return "OK"
+
+
+def fake_embedding(value) -> list[float]:
+    """
+    Deterministic pseudo-embedding derived from the input hash.
+    """
+    digest = hashlib.sha256(
+        json.dumps(value).encode("utf-8")
+    ).digest() * (EMBEDDING_DIM // 32)
+    return [(b - 128) / 128.0 for b in digest[:EMBEDDING_DIM]]
+
+
+def fake_page(n: int) -> str:
+    sentences = " ".join(
+        f"Page {n} reports that the subject has operated since {1990 + i}."
+        for i in range(40)
+    )
+    return (
+        "<html><head><title>Page</title><script>var x = 1;</script></head>"
+        f"<body><nav>Home | About</nav><p>{sentences}</p>"
+        "<footer>Cookie notice</footer></body></html>"
+    )
+
+
+def patch_searches(monkeypatch) -> list[list[str]]:
+    """
+    Replaces the searches and downloads of main.inference in process: each
+    query finds one page, https://site<n>.com/page/<n> with n a digest of
+    the query, holding the text of fake_page(n). Evidence is indexed with
+    BM25 only (no embedding calls).
+    Returns:
+        The queries of each search stage, appended as they run.
+    """
+    import main
+    from agents.scraper import ScraperAgent
+    from agents.search import SearchAgent
+    from retrieval import RetrievalSession
+
+    searched = []
+
+    async def stream_queries(self, queries):
+        searched.append(list(queries))
+        for query in queries:
+            n = int(hashlib.sha256(query.encode("utf-8")).hexdigest()[:6], 16)
+            yield [f"https://site{n}.com/page/{n}"]
+
+    async def fetch_site(self, url, headers, timeout=None):
+        n = int(url.rsplit("/", 1)[1])
+        return fake_page(n).split("<p>")[1].split("</p>")[0]
+
+    monkeypatch.setattr(SearchAgent, "stream_queries", stream_queries)
+    monkeypatch.setattr(ScraperAgent, "fetch_site", fetch_site)
+    monkeypatch.setattr(
+        main, "RetrievalSession", lambda: RetrievalSession(mode="bm25")
+    )
+    return searched
+
+
+def patch_agents(monkeypatch, verdicts, score):
+    """
+    Replaces query generation, verification (replying the verdicts in
+    turn) and scoring (awaiting score(on_token)) of main.inference, with
+    the searches of patch_searches. Each charges one LLM call.
+    Returns:
+        The searched queries, the evidence size at each verification and
+        the cache flag of each query generation.
+    """
+    import main
+    from budget import charge
+    from agents.scorer import ScorerAgent
+    from agents.search import SearchAgent
+    from agents.verifier import VerifierAgent
+    from retrieval import RetrievalSession
+
+    searched = patch_searches(monkeypatch)
+    sessions = []
+    evidence = []
+    generated = []
+
+    def new_session():
+        sessions.append(RetrievalSession(mode="bm25"))
+        return sessions[-1]
+
+    async def define_queries(self, name, context, language, cache=True):
+        charge("llm_calls")
+        generated.append(cache)
+        return [f"{name} history", f"{name} reviews"]
+
+    async def verify(self, text_chunks, language):
+        charge("llm_calls")
+        evidence.append(len(sessions[-1]))
+        verdict = verdicts[len(evidence) - 1]
+        return {
+            "verified": "OK" if verdict == "OK" else json.dumps(verdict),
+            "data": text_chunks,
+            "error_details": "NO" if verdict == "OK" else verdict,
+        }
+
+    async def run_scorer(self, log, language, on_token=None):
+        charge("llm_calls")
+        return await score(on_token)
+
+    monkeypatch.setattr(main, "RetrievalSession", new_session)
+    monkeypatch.setattr(SearchAgent, "define_queries", define_queries)
+    monkeypatch.setattr(VerifierAgent, "run", verify)
+    monkeypatch.setattr(ScorerAgent, "run", run_scorer)
+    return searched, evidence, generated
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    In-process embeddings of each text's length, recording the batches
+    requested. If fail is True, every call raises ConnectionError.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    @property
+    def calls(self) -> int:
+        return len(self.batches)
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        if self.fail:
+            raise ConnectionError("embedding endpoint down")
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+class FakeServices:
+    """
+    aiohttp application serving fake Azure OpenAI, Serper and web page
+    endpoints.
+    Attributes:
+        llm_delay: Seconds each chat completion takes.
+        page_delay: Seconds each page takes.
+        search_delay: Seconds each Serper query takes.
+        search_pages: Number of pages Serper results are drawn from.
+        verifier_rejections: Number of verifier calls answered with a
+        contradiction before answering 'OK'.
+        llm_quota: Chat completions accepted per second; the others are
+        answered with 429 and a Retry-After header, like Azure OpenAI.
+        calls: Counter of requests per endpoint kind.
+        peers: Client (host, port) pairs seen, i.e. TCP connections opened.
+    """
+
+    def __init__(self, llm_delay=0.5, page_delay=0.0, port=0,
+                 verifier_rejections=0, llm_quota=None, search_delay=0.0,
+                 search_pages=30):
+        self.llm_delay = llm_delay
+        self.page_delay = page_delay
+        self.search_delay = search_delay
+        self.search_pages = search_pages
+        self.verifier_rejections = verifier_rejections
+        self.llm_quota = llm_quota
+        self.port = port
+        self.calls = {
+            "chat": 0, "embeddings": 0, "pages": 0, "search": 0,
+            "throttled": 0,
+        }
+        self._window = (0, 0)  # (second, accepted completions)
+        self.peers = set()
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def page_urls(self, n: int) -> list[str]:
+        return [f"{self.base_url}/pages/{i}" for i in range(n)]
+
+    def throttled(self) -> bool:
+        second = int(time.monotonic())
+        window, accepted = self._window
+        if window != second:
+            window, accepted = second, 0
+        if accepted >= self.llm_quota:
+            return True
+        self._window = (window, accepted + 1)
+        return False
+
+    async def chat(self, request):
+        self.calls["chat"] += 1
+        if self.llm_quota is not None and self.throttled():
+            self.calls["throttled"] += 1
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit"}},
+                status=429, headers={"Retry-After": "1"}
+            )
+        body = await request.json()
+        prompt = " ".join(
+            str(m.get("content", "")) for m in body.get("messages", [])
+        )
+        await asyncio.sleep(self.llm_delay)
+        reject = "Assess whether" in prompt and self.verifier_rejections > 0
+        if reject:
+            self.verifier_rejections -= 1
+        content = fake_completion(prompt, reject)
+        return await self.chat_response(request, body, content, {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        })
+
+    async def chat_response(self, request, body, content, usage):
+        """
+        Answers a chat completion request with content, streamed if asked.
+        """
+        if body.get("stream"):
+            return await self.stream_chat(request, body, content)
+        return web.json_response({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4.1"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    async def stream_chat(self, request, body, content, size=4):
+        """
+        Streams the completion as OpenAI chat.completion.chunk events.
+        """
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        pieces = [content[i:i + size] for i in range(0, len(content), size)]
+        for i, piece in enumerate(pieces + [""]):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4.1"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece else {},
+                    "finish_reason": None if piece else "stop",
+                }],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(self, request):
+        self.calls["embeddings"] += 1
+        body = await request.json()
+        inputs = body.get("input", [])
+        if not isinstance(inputs, list) or (
+            inputs and isinstance(inputs[0], int)
+        ):
+            inputs = [inputs]
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "text-embedding"),
+            "data": [
+                {"object": "embedding", "index": i,
+                 "embedding": fake_embedding(value)}
+                for i, value in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def page(self, request):
+        self.calls["pages"] += 1
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.page_delay:
+            await asyncio.sleep(self.page_delay)
+        n = int(request.match_info["n"])
+        return web.Response(text=fake_page(n), content_type="text/html")
+
+    async def search(self, request):
+        """
+        Serper results: 8 of the search_pages pages, chosen by query hash.
+        """
+        self.calls["search"] += 1
+        await asyncio.sleep(self.search_delay)
+        query = request.query.get("q", "")
+        seed = int(hashlib.sha256(query.encode("utf-8")).hexdigest(), 16)
+        pages = [(seed >> (8 * i)) % self.search_pages for i in range(8)]
+        return web.json_response({
+            "searchParameters": {"q": query},
+            "organic": [
+                {"title": f"Page {n}", "link": f"{self.base_url}/pages/{n}",
+                 "position": i + 1}
+                for i, n in enumerate(dict.fromkeys(pages))
+            ],
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(
+            "/openai/deployments/{deployment}/chat/completions", self.chat
+        )
+        app.router.add_post(
+            "/openai/deployments/{deployment}/embeddings", self.embeddings
+        )
+        app.router.add_post("/serper/{search_type}", self.search)
+        app.router.add_get("/pages/{n}", self.page)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeRedis:
+    """
+    Threaded TCP server speaking the subset of the Redis protocol (RESP)
+    used by state.RedisStore: PING, AUTH, SELECT, GET, MGET, SET (PX, NX),
+    DEL, INCRBY, SCAN (MATCH, COUNT), DBSIZE and FLUSHDB.
+    Attributes:
+        data: key -> (value, expires_at) of the selected database.
+        commands: Number of commands received.
+        connections: Number of connections accepted.
+    """
+
+    def __init__(self, port=0):
+        self.data = {}
+        self.commands = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                fake.connections += 1
+                while True:
+                    try:
+                        args = fake.read_command(self.rfile)
+                    except ConnectionError:
+                        return
+                    self.wfile.write(fake.execute(args))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", port), Handler
+        )
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    @staticmethod
+    def read_command(rfile) -> list[bytes]:
+        line = rfile.readline()
+        if not line:
+            raise ConnectionError()
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(rfile.readline()[1:-2])
+            args.append(rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(
+                FakeRedis.encode(v) for v in value
+            )
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at < time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args) -> bytes:
+        command = args[0].upper().decode()
+        with self._lock:
+            self.commands += 1
+            if command in ("PING", "AUTH", "SELECT"):
+                return self.encode("PONG" if command == "PING" else "OK")
+            if command == "GET":
+                return self.encode(self._get(args[1]))
+            if command == "MGET":
+                return self.encode([self._get(key) for key in args[1:]])
+            if command == "SET":
+                options = [a.upper() for a in args[3:]]
+                if b"NX" in options and self._get(args[1]) is not None:
+                    return self.encode(None)
+                expires_at = None
+                if b"PX" in options:
+                    ms = int(args[3 + options.index(b"PX") + 1])
+                    expires_at = time.time() + ms / 1000
+                self.data[args[1]] = (args[2], expires_at)
+                return self.encode("OK")
+            if command == "DEL":
+                return self.encode(sum(
+                    self.data.pop(key, None) is not None for key in args[1:]
+                ))
+            if command == "INCRBY":
+                value = int(self._get(args[1]) or 0) + int(args[2])
+                expires_at = self.data.get(args[1], (None, None))[1]
+                self.data[args[1]] = (str(value).encode(), expires_at)
+                return self.encode(value)
+            if command == "SCAN":
+                options = [a.upper() for a in args[2:]]
+                pattern = args[2 + options.index(b"MATCH") + 1].decode()
+                step = int(args[2 + options.index(b"COUNT") + 1])
+                start = int(args[1])
+                keys = sorted(self.data)[start:start + step]
+                cursor = start + step if len(keys) == step else 0
+                return self.encode([str(cursor).encode(), [
+                    key for key in keys
+                    if fnmatch.fnmatchcase(key.decode(), pattern)
+                ]])
+            if command == "DBSIZE":
+                return self.encode(len(self.data))
+            if command == "FLUSHDB":
+                self.data.clear()
+                return self.encode("OK")
+        return f"-ERR unknown command '{command}'\r\n".encode()
+
+    def start(self):
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def fake_env(port: int) -> dict:
+    """
+    Environment variables pointing the backend clients to FakeServices.
+    """
+    return {
+        "AZURE_OPENAI_API_KEY": "fake",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{port}",
+        "AZURE_OPENAI_DEPLOYMENT": "chat",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "embeddings",
+        "OPENAI_API_VERSION": "2024-02-01",
+        "SERPER_API_KEY": "fake",
+        "LANGSMITH_TRACING": "false",
+        "TRUSTME_JOB_DIR": os.path.join(
+            tempfile.gettempdir(), "trustme-tests"
+        ),
+    }
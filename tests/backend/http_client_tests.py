@@ -0,0 +1,97 @@
+"""
+Tests of the pooled HTTP session shared by the scraper and the Serper
+searches of a worker.
+
+Run from the repository root:
+    pytest tests/backend/http_client_tests.py
+"""
+import asyncio
+
+from aiohttp import web
+
+from fake_services import fake_page
+
+import agents.scraper as scraper
+import http_client
+from agents.scraper import HEADERS, ScraperAgent
+from agents.search import SearchAgent
+from cache import TieredCache
+from config import __HTTP_POOL_LIMIT__, __HTTP_POOL_LIMIT_PER_HOST__
+
+
+def test_session_shared_and_reopened():
+    async def run():
+        session = await http_client.open_session()
+        assert http_client.get_session() is session
+        assert await http_client.open_session() is session
+        assert session.connector.limit == __HTTP_POOL_LIMIT__
+        assert session.connector.limit_per_host == (
+            __HTTP_POOL_LIMIT_PER_HOST__
+        )
+        await http_client.close_session()
+        assert session.closed
+        # used outside of the app after shutdown: a new session is opened
+        reopened = http_client.get_session()
+        assert reopened is not session and not reopened.closed
+        await http_client.close_session()
+
+    asyncio.run(run())
+
+
+def test_scraper_reuses_connections(monkeypatch):
+    monkeypatch.setattr(
+        scraper, "page_cache", TieredCache("pages", 1 << 20, 60)
+    )
+    peers = set()
+
+    async def page(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.Response(
+            text=fake_page(int(request.match_info["n"])),
+            content_type="text/html"
+        )
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/page/{n}", page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        agent = ScraperAgent()
+        try:
+            return [
+                await agent.fetch_site(f"{base}/page/{n}", HEADERS)
+                for n in range(5)
+            ]
+        finally:
+            await http_client.close_session()
+            await runner.cleanup()
+
+    texts = asyncio.run(run())
+    assert all(f"Page {n} reports" in text for n, text in enumerate(texts))
+    # one kept-alive connection for the five sequential downloads
+    assert len(peers) == 1
+
+
+def test_search_uses_pooled_session():
+    class FakeSerper:
+        aiosession = None
+
+        async def aresults(self, query):
+            return {"organic": [{"link": "https://acme.com"}]}
+
+    async def run():
+        agent = SearchAgent()
+        agent.google_search = FakeSerper()
+        try:
+            links = await agent.search("ACME", asyncio.Semaphore(1))
+            return links, agent.google_search.aiosession, (
+                http_client.get_session()
+            )
+        finally:
+            await http_client.close_session()
+
+    links, used, pooled = asyncio.run(run())
+    assert links == ["https://acme.com"] and used is pooled
@@ -0,0 +1,158 @@
+"""
+Tests of the analysis job queue: stores (memory and SQLite, shared by
+workers) and the JobManager worker pool.
+
+Run from the repository root:
+    pytest tests/backend/jobs_tests.py
+"""
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import main
+from jobs import DONE, FAILED, QUEUED, RUNNING, Job
+from jobs import JobManager, MemoryJobStore, SQLiteJobStore
+
+
+def request(subject):
+    return {"subject": subject, "context": "ctx", "language": "en"}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_submit_deduplicates_active_jobs(store):
+    async def run():
+        manager = JobManager(store, runner=None)
+        first = await manager.submit(request("ACME"))
+        again = await manager.submit(request("ACME"), priority=5)
+        other = await manager.submit(request("Other"))
+        assert again.id == first.id and other.id != first.id
+        assert (await manager.get(first.id)).status == QUEUED
+
+        # finished jobs are not in flight: the analysis runs again
+        first.status = DONE
+        await store.update(first)
+        assert (await manager.submit(request("ACME"))).id != first.id
+
+    asyncio.run(run())
+
+
+def test_sqlite_store_deduplicates_across_workers(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    # one store (and connection) per simulated worker process
+    stores = [SQLiteJobStore(path) for _ in range(8)]
+    barrier = threading.Barrier(len(stores))
+    ids = []
+
+    def submit(store):
+        job = Job(request=request("ACME"), key="acme")
+        barrier.wait()
+        ids.append(store._insert(job).id)
+
+    threads = [
+        threading.Thread(target=submit, args=(store,)) for store in stores
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ids) == len(stores) and len(set(ids)) == 1
+
+    # a restarted worker finds the queued job and runs it
+    async def run():
+        restarted = SQLiteJobStore(path)
+        job = await restarted.claim()
+        assert job.id == ids[0] and job.status == RUNNING
+        assert (await stores[0].get(job.id)).status == RUNNING
+        assert await restarted.claim() is None
+
+    asyncio.run(run())
+
+
+def test_sqlite_store_keeps_oldest_of_legacy_duplicates(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs ("
+        "id TEXT PRIMARY KEY, key TEXT, priority INTEGER, status TEXT, "
+        "created_at REAL, started_at REAL, finished_at REAL, "
+        "request TEXT, result TEXT, error TEXT)"
+    )
+    for job_id in ("old", "new"):
+        conn.execute(
+            "INSERT INTO jobs (id, key, status, request) VALUES "
+            "(?, 'acme', ?, '{}')", (job_id, QUEUED)
+        )
+    conn.commit()
+    conn.close()
+
+    async def run():
+        store = SQLiteJobStore(path)
+        assert (await store.find_active("acme")).id == "old"
+        assert (await store.get("new")).status == FAILED
+
+    asyncio.run(run())
+
+
+def test_manager_runs_jobs_by_priority(store):
+    order = []
+
+    async def runner(job_request):
+        order.append(job_request["subject"])
+        if job_request["subject"] == "broken":
+            raise ValueError("no evidence")
+        return {"trust_score": 50.0, "details": job_request["subject"]}
+
+    async def run():
+        manager = JobManager(store, runner, concurrency=1, poll_interval=0.01)
+        low = await manager.submit(request("low"))
+        broken = await manager.submit(request("broken"), priority=1)
+        high = await manager.submit(request("high"), priority=2)
+        await manager.start()
+        try:
+            for _ in range(200):
+                jobs = [
+                    await manager.get(job.id) for job in (low, broken, high)
+                ]
+                if all(job.status in (DONE, FAILED) for job in jobs):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await manager.stop()
+        return jobs
+
+    low, broken, high = asyncio.run(run())
+    assert order == ["high", "broken", "low"]
+    assert high.status == DONE and high.result["details"] == "high"
+    assert broken.status == FAILED and broken.error == "no evidence"
+    assert low.status == DONE and low.finished_at >= low.started_at
+
+
+def test_job_store_opened_by_the_app_not_at_import(tmp_path, monkeypatch):
+    backend = os.path.join(os.path.dirname(__file__), "..", "..", "backend")
+    subprocess.run(
+        [sys.executable, "-c", "import main"], cwd=backend, check=True,
+        env={**os.environ, "TRUSTME_JOB_DIR": str(tmp_path / "jobs")},
+    )
+    # what the gunicorn master imports before forking leaves no file
+    assert not (tmp_path / "jobs").exists()
+
+    store = MemoryJobStore()
+    monkeypatch.setattr(main, "job_manager", JobManager(None, main.run_job))
+    monkeypatch.setattr(main, "create_job_store", lambda: store)
+
+    async def run():
+        async with main.lifespan(main.app):
+            return main.job_manager.store
+
+    assert asyncio.run(run()) is store
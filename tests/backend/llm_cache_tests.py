@@ -0,0 +1,102 @@
+"""
+Tests of the LLM completion cache and of its use by the retries of an
+analysis.
+
+Run from the repository root:
+    pytest tests/backend/llm_cache_tests.py
+"""
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from fake_services import patch_searches
+
+import agents.search as search
+import langchain_setup
+import main
+from agents.verifier import VerifierAgent
+from budget import RequestBudget, current_budget
+
+
+class FakeChat:
+    """
+    Chat model counting its calls, replying with finish_reason.
+    """
+
+    deployment_name = "chat"
+
+    def __init__(self, temperature=0.2, finish_reason="stop"):
+        self.temperature = temperature
+        self.finish_reason = finish_reason
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        return AIMessage(
+            content=f"reply {self.calls}",
+            response_metadata={"finish_reason": self.finish_reason},
+        )
+
+
+def test_llm_completions_cached():
+    async def run():
+        budget = RequestBudget()
+        current_budget.set(budget)
+        model = FakeChat()
+        prompt = "Generate queries for cached subject"
+        first = await langchain_setup.ainvoke_llm(prompt, model=model)
+        second = await langchain_setup.ainvoke_llm(prompt, model=model)
+        assert first.content == second.content == "reply 1"
+        assert model.calls == 1
+        assert budget.counters["llm_calls"] == 1
+
+        # per-call opt-out, and other temperatures or deployments
+        await langchain_setup.ainvoke_llm(prompt, model=model, cache=False)
+        await langchain_setup.ainvoke_llm(prompt, model=FakeChat(0.9))
+        other = FakeChat()
+        other.deployment_name = "other"
+        await langchain_setup.ainvoke_llm(prompt, model=other)
+        assert model.calls == 2 and other.calls == 1
+
+        truncated = FakeChat(finish_reason="length")
+        for _ in range(2):
+            await langchain_setup.ainvoke_llm(
+                "Verify truncated chunks", model=truncated
+            )
+        assert truncated.calls == 2
+
+    asyncio.run(run())
+
+
+def test_retries_regenerate_queries_uncached(monkeypatch):
+    """
+    The first attempt searches 'a'; every retry regenerates the queries
+    (without the cache) and gets 'b'. The first retry brings new evidence
+    and is verified, the next ones bring none and are not.
+    """
+    cache_flags = []
+    verified = []
+
+    async def fake_llm(prompt, model=None, cache=True):
+        cache_flags.append(cache)
+        return AIMessage(content='["a"]' if len(cache_flags) == 1
+                         else '["b"]')
+
+    async def fake_verify(self, text_chunks, language, **kwargs):
+        verified.append(len(text_chunks))
+        return {"verified": '{"whys": ["doubt"]}', "data": text_chunks,
+                "error_details": {"whys": ["doubt"]}}
+
+    searched = patch_searches(monkeypatch)
+    monkeypatch.setattr(search, "ainvoke_llm", fake_llm)
+    monkeypatch.setattr(VerifierAgent, "run", fake_verify)
+
+    response = asyncio.run(main.inference(main.AnalysisRequest(
+        subject="Retry subject", context="retry context", language="en"
+    )))
+
+    assert response.trust_score == 0.0
+    assert len(verified) == 2
+    assert searched[0] == ["a"] and all(q == ["b"] for q in searched[1:])
+    assert cache_flags[0] is True
+    assert len(cache_flags) > 2 and not any(cache_flags[1:])
@@ -0,0 +1,109 @@
+"""
+Tests of the asynchronous LLM calls of the agents and of their
+concurrency bound for each worker.
+
+Run from the repository root:
+    pytest tests/backend/llm_concurrency_tests.py
+"""
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from fake_services import fake_completion
+
+import langchain_setup
+from agents.scorer import ScorerAgent
+from agents.search import SearchAgent
+from agents.verifier import VerifierAgent
+from config import __LLM_CONCURRENCY__
+from resilience import Endpoint
+
+
+class SlowChat:
+    """
+    Chat model answering after delay seconds without blocking the event
+    loop, tracking the calls running at once. invoke (blocking) fails.
+    """
+
+    deployment_name = "chat"
+    temperature = 0.2
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+
+    def invoke(self, prompt):
+        raise AssertionError("blocking LLM call")
+
+    async def ainvoke(self, prompt):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+            return AIMessage(content=fake_completion(prompt))
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture(autouse=True)
+def unthrottled(monkeypatch):
+    # no rate limits: only the semaphore bounds the calls
+    monkeypatch.setattr(langchain_setup, "llm_endpoint", Endpoint("llm"))
+
+
+def test_llm_calls_bounded_per_worker(monkeypatch):
+    model = SlowChat()
+
+    async def run():
+        monkeypatch.setattr(
+            langchain_setup, "llm_semaphore",
+            asyncio.Semaphore(__LLM_CONCURRENCY__)
+        )
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            langchain_setup.ainvoke_llm(f"prompt {n}", model, cache=False)
+            for n in range(3 * __LLM_CONCURRENCY__)
+        ])
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    assert model.max_running == __LLM_CONCURRENCY__
+    # three rounds of concurrent calls, not one call after the other
+    assert elapsed < 3 * __LLM_CONCURRENCY__ * model.delay / 2
+
+
+def test_agents_do_not_block_event_loop(monkeypatch):
+    model = SlowChat(delay=0.2)
+    search, verifier, scorer = SearchAgent(), VerifierAgent(), ScorerAgent()
+    search.llm = verifier.llm = scorer.llm = model
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        monkeypatch.setattr(
+            langchain_setup, "llm_semaphore",
+            asyncio.Semaphore(__LLM_CONCURRENCY__)
+        )
+        task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            search.define_queries("ACME", "ctx", cache=False),
+            verifier.run(["ACME was founded in 1990."], "en"),
+            scorer.run({"searches": [["ACME was founded in 1990."]]}, "en"),
+        )
+        task.cancel()
+        return results, time.perf_counter() - start
+
+    (queries, verdict, score), elapsed = asyncio.run(run())
+    assert queries == [f"query {i}" for i in range(5)]
+    assert verdict["verified"] == "OK" and score[0] == 80
+    # the three calls overlap and the loop keeps serving other tasks
+    assert model.max_running == 3
+    assert elapsed < 0.5 and len(ticks) >= 10
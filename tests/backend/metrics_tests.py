@@ -0,0 +1,86 @@
+
+"""
+Tests of the Prometheus metrics, stage spans and request trace IDs.
+
+Run from the repository root:
+    pytest tests/backend/metrics_tests.py
+"""
+import asyncio
+
+import httpx
+
+import main
+from metrics import Registry
+from tracing import Trace, current_stage, current_trace
+from tracing import record_llm_usage, span
+
+
+def test_histogram_exposition():
+    registry = Registry()
+    histogram = registry.histogram(
+        "latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1)
+    )
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'say "hi"')
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.",
+                         "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="0.1"} 2',
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="1"} 3',
+        'latency_seconds_bucket{stage="say \\"hi\\"",le="+Inf"} 4',
+        'latency_seconds_sum{stage="say \\"hi\\""} 3.65',
+        'latency_seconds_count{stage="say \\"hi\\""} 4',
+    ]
+
+
+def test_spans_and_usage_are_recorded_in_the_trace():
+    trace = Trace()
+    token = current_trace.set(trace)
+    try:
+        with span("scrape"):
+            with span("embed"):
+                assert current_stage.get() == "embed"
+            assert current_stage.get() == "scrape"
+        with span("verify"):
+            record_llm_usage(1000, 100)
+    finally:
+        current_trace.reset(token)
+
+    assert [stage for stage, _, _ in trace.spans] == [
+        "embed", "scrape", "verify"
+    ]
+    summary = trace.summary()
+    assert summary["llm_prompt_tokens"] == 1000
+    assert summary["llm_completion_tokens"] == 100
+    assert summary["cost_usd"] == 0.0028
+    assert current_stage.get() == "other"
+
+
+def test_trace_header_and_metrics_endpoint():
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            generated = await client.get("/health")
+            echoed = await client.get(
+                "/health", headers={"X-Trace-Id": "req-42"}
+            )
+            rejected = await client.get(
+                "/health", headers={"X-Trace-Id": "bad id; drop"}
+            )
+            scraped = await client.get("/metrics")
+        return generated, echoed, rejected, scraped
+
+    generated, echoed, rejected, scraped = asyncio.run(run())
+    assert len(generated.headers["x-trace-id"]) == 32
+    assert echoed.headers["x-trace-id"] == "req-42"
+    assert rejected.headers["x-trace-id"] != "bad id; drop"
+    assert scraped.headers["content-type"].startswith("text/plain")
+    body = scraped.text
+    assert ('trustme_request_seconds_count{route="/health",method="GET",'
+            'status="200"} 3') in body
+    assert 'trustme_cache_misses_total{cache="pages"}' in body
+    assert 'trustme_upstream_circuit_state{endpoint="llm"} 0' in body
@@ -0,0 +1,292 @@
+
+"""
+Tests of the token-budgeted prompt packing of the Verifier and Scorer, and
+of the Verifier's sharded (map-reduce) verification.
+
+Run from the repository root:
+    pytest tests/backend/packing_tests.py
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from fake_services import patch_searches
+
+import agents.verifier as verifier
+import main
+import prompt_packing
+from agents.prompt_templates import VERIFIER_PROMPT
+from agents.scorer import ScorerAgent
+from agents.scraper import ScraperAgent
+from agents.search import SearchAgent
+from config import __VERIFIER_PROMPT_CHUNKS__
+from prompt_packing import (
+    as_documents,
+    chunk_budget,
+    chunk_cost,
+    count_tokens,
+    format_chunk,
+    pack_chunks,
+    render_chunks,
+    shard_chunks,
+)
+
+
+def doc(text, score, source="https://example.com"):
+    return Document(
+        page_content=text, metadata={"source": source, "score": score}
+    )
+
+
+def rendered_cost(chunks):
+    return sum(
+        count_tokens(json.dumps(format_chunk(c), ensure_ascii=False)) + 1
+        for c in chunks
+    )
+
+
+def test_best_scores_first_within_budget():
+    chunks = [
+        doc(f"Evidence sentence number {i} about the subject.", i / 100)
+        for i in range(100)
+    ]
+    budget = rendered_cost(chunks[:10])
+    packed = pack_chunks(chunks, budget)
+    assert rendered_cost(packed) <= budget
+    assert [c.metadata["score"] for c in packed] == sorted(
+        (c.metadata["score"] for c in packed), reverse=True
+    )
+    assert packed[0] is chunks[-1]
+
+
+def test_repeated_chunks_packed_once():
+    attempts = [
+        [doc("ACME was founded in 1998 in Milan.", 0.5)],
+        [doc("ACME was founded in 1998 in Milan.", 0.5),
+         doc("ACME has 200 employees.", 0.4)],
+    ]
+    packed = pack_chunks(
+        [c for attempt in attempts for c in attempt], 10_000
+    )
+    assert [c.page_content for c in packed] == [
+        "ACME was founded in 1998 in Milan.", "ACME has 200 employees."
+    ]
+
+
+def test_oversized_chunk_skipped():
+    chunks = [doc("word " * 5000, 0.9), doc("A short sentence here.", 0.1)]
+    assert pack_chunks(chunks, 100) == [chunks[1]]
+
+
+def test_sources_rendered_and_strings_accepted():
+    chunks = as_documents(["Plain text chunk.", "", None])
+    chunks.append(doc("Sourced chunk.", 0.3, "https://a.com/x"))
+    assert json.loads(render_chunks(pack_chunks(chunks, 1000))) == [
+        "Sourced chunk. (source: https://a.com/x)", "Plain text chunk."
+    ]
+
+
+def test_chunk_budget_leaves_room_for_template():
+    overhead = count_tokens(
+        VERIFIER_PROMPT.format(text_chunks="", language="it")
+    )
+    assert chunk_budget(VERIFIER_PROMPT, 1000, language="it") == (
+        1000 - overhead
+    )
+    assert chunk_budget(VERIFIER_PROMPT, 10, language="it") == 0
+
+
+def evidence(domains, per_domain, words=40):
+    """
+    Chunks of per_domain pages on each domain, best scores first.
+    """
+    chunks = [
+        doc(f"Fact {d}-{n}: " + "detail " * words, 1 - (d * 10 + n) / 1000,
+            f"https://news.site{d}.com/{n}")
+        for n in range(per_domain) for d in range(domains)
+    ]
+    return sorted(chunks, key=lambda c: -c.metadata["score"])
+
+
+def test_shards_balanced_by_domain_within_budget():
+    chunks = evidence(6, 3)
+    budget = rendered_cost(chunks) // 3 + 50
+    shards = shard_chunks(
+        chunks, budget, 4, key=lambda c: c.metadata["source"].split("/")[2]
+    )
+    assert len(shards) == 3
+    assert sorted(c.page_content for s in shards for c in s) == sorted(
+        c.page_content for c in chunks
+    )
+    for shard in shards:
+        assert rendered_cost(shard) <= budget
+        sources = {c.metadata["source"].split("/")[2] for c in shard}
+        # each domain's chunks stay together
+        assert sum(
+            c.metadata["source"].split("/")[2] in sources for c in chunks
+        ) == len(shard)
+    assert shards[0][0] is chunks[0]
+
+
+def test_shards_hold_at_most_max_chunks():
+    chunks = evidence(3, 4, words=5)
+    shards = shard_chunks(
+        chunks, rendered_cost(chunks), 4,
+        key=lambda c: c.metadata["source"].split("/")[2], max_chunks=3
+    )
+    # within the token budget, but four shards of three chunks
+    assert [len(shard) for shard in shards] == [3, 3, 3, 3]
+    assert sorted(c.page_content for s in shards for c in s) == sorted(
+        c.page_content for c in chunks
+    )
+
+
+def test_shards_split_large_groups_and_drop_overflow():
+    chunks = evidence(1, 6)
+    budget = chunk_cost(chunks[0]) * 2
+    shards = shard_chunks(chunks, budget, 2, key=lambda c: "one")
+    assert [len(shard) for shard in shards] == [2, 2]
+    assert shard_chunks(chunks, 1, 4) == []
+
+
+def test_tokenizer_fallback_warns_once(monkeypatch, caplog):
+    class Unavailable:
+        @staticmethod
+        def get_encoding(name):
+            raise ConnectionError("no network")
+
+    monkeypatch.setitem(sys.modules, "tiktoken", Unavailable)
+    prompt_packing._encoding.cache_clear()
+    try:
+        with caplog.at_level(logging.WARNING):
+            assert not prompt_packing.load_tokenizer()
+            counts = [count_tokens("x" * 30) for _ in range(3)]
+    finally:
+        prompt_packing._encoding.cache_clear()
+    assert counts == [10, 10, 10]
+    assert [record.levelname for record in caplog.records
+            if "Tokenizer unavailable" in record.message] == ["WARNING"]
+
+
+def test_tokenizer_loaded_off_the_event_loop_at_startup(monkeypatch):
+    threads = []
+    monkeypatch.setattr(
+        main, "load_tokenizer",
+        lambda: threads.append(threading.current_thread())
+    )
+
+    async def run():
+        async with main.lifespan(main.app):
+            pass
+
+    asyncio.run(run())
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def fake_verifier(monkeypatch, replies, delay=0.05):
+    """
+    Replaces the Verifier's LLM calls, answering replies(prompt) after
+    delay. Returns the prompts received.
+    """
+    prompts = []
+
+    async def ainvoke(prompt, model=None):
+        prompts.append(prompt)
+        await asyncio.sleep(delay)
+        return replies(prompt)
+
+    monkeypatch.setattr(verifier, "ainvoke_llm", ainvoke)
+    return prompts
+
+
+def test_small_evidence_verified_in_one_prompt(monkeypatch):
+    prompts = fake_verifier(monkeypatch, lambda prompt: "OK")
+    chunks = evidence(3, 2)
+    result = asyncio.run(verifier.VerifierAgent().run(chunks, "en"))
+    assert len(prompts) == 1
+    assert result == {"verified": "OK", "data": chunks, "error_details": "NO"}
+
+
+def test_large_evidence_verified_in_parallel_shards(monkeypatch):
+    def reply(prompt):
+        whys = [f"site{d} disagrees." for d in (1, 4) if f"site{d}." in prompt]
+        if not whys:
+            return "OK"
+        return json.dumps({"whys": whys, "suggested_retry": "revenue"})
+
+    prompts = fake_verifier(monkeypatch, reply, delay=0.2)
+    chunks = evidence(6, 4)
+    per_prompt = rendered_cost(chunks) // 3 + 400
+    start = time.perf_counter()
+    result = asyncio.run(verifier.VerifierAgent().run(
+        chunks, "en", max_tokens=per_prompt
+    ))
+    elapsed = time.perf_counter() - start
+    assert len(prompts) == 3
+    assert elapsed < 0.4
+    assert len(result["data"]) == len(chunks)
+    for prompt in prompts:
+        assert count_tokens(prompt) <= per_prompt
+    assert sorted(result["error_details"]["whys"]) == [
+        "site1 disagrees.", "site4 disagrees."
+    ]
+    assert result["error_details"]["suggested_retry"] == "revenue"
+    assert json.loads(result["verified"]) == result["error_details"]
+
+
+def test_inference_verifies_candidates_in_shards(monkeypatch):
+    patch_searches(monkeypatch)
+
+    async def define_queries(self, name, context, language, cache=True):
+        return [f"{name} topic {n}" for n in range(12)]
+
+    async def fetch_site(self, url, headers, timeout=None):
+        # distinct sentences, so that no page is a near duplicate
+        return " ".join(
+            f"The subject operated {digest} in {digest[:6]}."
+            for digest in (
+                hashlib.sha256(f"{url} {i}".encode()).hexdigest()[:16]
+                for i in range(10)
+            )
+        )
+
+    async def score(self, log, language, on_token=None):
+        return 80.0, "consistent"
+
+    monkeypatch.setattr(SearchAgent, "define_queries", define_queries)
+    monkeypatch.setattr(ScraperAgent, "fetch_site", fetch_site)
+    monkeypatch.setattr(ScorerAgent, "run", score)
+    prompts = fake_verifier(monkeypatch, lambda prompt: "OK", delay=0)
+
+    response = asyncio.run(main.inference(main.AnalysisRequest(
+        subject="ACME", context="the subject operated", language="en"
+    )))
+    assert response.trust_score == 80.0
+    # more evidence than one prompt holds is verified in shards
+    assert len(prompts) > 1
+    for prompt in prompts:
+        assert prompt.count("The subject operated") <= (
+            __VERIFIER_PROMPT_CHUNKS__
+        )
+
+
+def test_merge_verdicts():
+    assert verifier.merge_verdicts(["OK", "OK"]) == ("OK", "NO")
+    content, details = verifier.merge_verdicts([
+        json.dumps({"whys": ["A"], "suggested_retry": "q1"}),
+        json.dumps({"whys": ["A", "B"], "suggested_retry": "q2"}),
+        "{}",
+        "Not JSON.",
+    ])
+    assert details == {"whys": ["A", "B", "Not JSON."],
+                       "suggested_retry": "q2"}
+    assert json.loads(content) == details
+    assert verifier.merge_verdicts(["OK", "{}"])[1] == {
+        "whys": [], "suggested_retry": None
+    }
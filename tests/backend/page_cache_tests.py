@@ -0,0 +1,127 @@
+"""
+Tests of URL normalization and of the page cache used by the scraper.
+
+Run from the repository root:
+    pytest tests/backend/page_cache_tests.py
+"""
+import asyncio
+
+from aiohttp import web
+
+from fake_services import fake_page
+
+import agents.scraper as scraper
+import http_client
+from agents.scraper import HEADERS, ScraperAgent
+from cache import TieredCache, normalize_url
+from state import SQLiteStore
+
+
+def test_normalize_url():
+    expected = "https://example.com/news/item?id=7&page=2"
+    for url in [
+        "https://example.com/news/item?id=7&page=2",
+        "HTTPS://Example.COM/news/item/?page=2&id=7",
+        "https://example.com:443/news/item?id=7&page=2#comments",
+        "https://example.com/news/item?utm_source=x&id=7&UTM_Medium=y"
+        "&page=2&gclid=abc&fbclid=def",
+        "  https://example.com/news/item//?id=7&page=2  ",
+    ]:
+        assert normalize_url(url) == expected, url
+    # the path keeps its case, and other ports and parameters stay
+    assert normalize_url("http://example.com:8080/News") == (
+        "http://example.com:8080/News"
+    )
+    assert normalize_url("https://example.com") == "https://example.com/"
+    assert normalize_url("https://example.com/?q=") == (
+        "https://example.com/?q="
+    )
+    assert normalize_url("https://example.com/a?id=1") != (
+        normalize_url("https://example.com/a?id=2")
+    )
+
+
+def serve_pages(test):
+    """
+    Runs test(base_url) against a local site serving /page/<n> (and 404 on
+    /missing), returning its result and the number of requests per path.
+    """
+    requests = {}
+
+    async def page(request):
+        requests[request.path] = requests.get(request.path, 0) + 1
+        return web.Response(
+            text=fake_page(int(request.match_info["n"])),
+            content_type="text/html"
+        )
+
+    async def missing(request):
+        requests[request.path] = requests.get(request.path, 0) + 1
+        return web.Response(status=404, text="not found")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/page/{n}", page)
+        app.router.add_get("/missing", missing)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            return await test(f"http://127.0.0.1:{runner.addresses[0][1]}")
+        finally:
+            await http_client.close_session()
+            await runner.cleanup()
+
+    return asyncio.run(run()), requests
+
+
+def test_page_cache_hit_miss_and_expiry(monkeypatch):
+    cache = TieredCache("pages", max_bytes=1 << 20, ttl=0.3)
+    monkeypatch.setattr(scraper, "page_cache", cache)
+    agent = ScraperAgent()
+
+    async def test(base):
+        first = await agent.fetch_site(f"{base}/page/1", HEADERS)
+        # equivalent URLs are served from the cache
+        hits = [
+            await agent.fetch_site(url, HEADERS) for url in [
+                f"{base}/page/1", f"{base}/page/1/?utm_source=news#top",
+            ]
+        ]
+        await agent.fetch_site(f"{base}/page/2", HEADERS)
+        # failed downloads are not cached
+        for _ in range(2):
+            await agent.fetch_site(f"{base}/missing", HEADERS)
+        await asyncio.sleep(0.4)
+        expired = await agent.fetch_site(f"{base}/page/1", HEADERS)
+        return first, hits, expired
+
+    (first, hits, expired), requests = serve_pages(test)
+    assert "Page 1 reports" in first and hits == [first, first]
+    assert expired == first
+    assert requests == {"/page/1": 2, "/page/2": 1, "/missing": 2}
+    assert cache.counters["memory_hits"] == 2
+    assert cache.counters["sets"] == 3
+
+
+def test_page_cache_shared_tier_expires(tmp_path):
+    path = str(tmp_path / "pages.sqlite3")
+
+    async def run():
+        # two workers, each with its memory tier, sharing one store
+        worker_a = TieredCache("pages", 1 << 20, 0.2, SQLiteStore(path))
+        worker_b = TieredCache("pages", 1 << 20, 0.2, SQLiteStore(path))
+        url = normalize_url("https://example.com/a?utm_source=x")
+        await worker_a.set(url, "page text")
+        shared_hit = await worker_b.get(url)
+        memory_hit = await worker_b.get(url)
+        await asyncio.sleep(0.3)
+        return shared_hit, memory_hit, await worker_b.get(url), worker_b
+
+    shared_hit, memory_hit, expired, worker_b = asyncio.run(run())
+    assert shared_hit == memory_hit == "page text"
+    assert expired is None
+    assert worker_b.counters == {
+        "memory_hits": 1, "shared_hits": 1, "misses": 1, "sets": 0
+    }
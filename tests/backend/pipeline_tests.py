@@ -0,0 +1,207 @@
+
+"""
+Tests of the pipelined search/scrape stages: streamed query results,
+early cutoff and cancellation of the slow downloads.
+
+Run from the repository root:
+    pytest tests/backend/pipeline_tests.py
+"""
+import asyncio
+import time
+
+from fake_services import fake_page
+
+from agents.scraper import ScraperAgent
+from agents.search import SearchAgent
+from cache import SingleFlight
+from dedup import PageStream
+from retrieval import RetrievalSession
+from text_cleaning import dedup_key
+
+
+def test_stream_queries_yields_in_completion_order():
+    cancelled = []
+
+    async def fake_search(query, semaphore):
+        try:
+            await asyncio.sleep(float(query))
+        except asyncio.CancelledError:
+            cancelled.append(query)
+            raise
+        return [] if query == "0.02" else [f"https://{query}.com"]
+
+    agent = SearchAgent()
+    agent.search = fake_search
+
+    async def run():
+        stream = agent.stream_queries(["0.05", "0.01", "0.02", "5"])
+        first = [await anext(stream), await anext(stream)]
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(run()) == [["https://0.01.com"], ["https://0.05.com"]]
+    assert cancelled == ["5"]
+
+
+def pipeline(delays, **kwargs):
+    """
+    Runs run_pipeline over pages downloading in the given seconds (one
+    query per page), returning the documents, the elapsed time and the
+    downloads cancelled.
+    """
+    cancelled = []
+
+    async def fake_fetch_site(url, headers, timeout=None):
+        n = int(url.rsplit("/", 1)[1])
+        try:
+            await asyncio.sleep(delays[n])
+        except asyncio.CancelledError:
+            cancelled.append(n)
+            raise
+        return fake_page(n).split("<p>")[1].split("</p>")[0]
+
+    async def url_batches():
+        for n in range(len(delays)):
+            yield [f"https://site{n}.com/page/{n}"]
+
+    agent = ScraperAgent()
+    agent.fetch_site = fake_fetch_site
+    session = RetrievalSession(mode="bm25")
+
+    async def run():
+        start = time.perf_counter()
+        documents = await agent.run_pipeline(
+            url_batches(), "subject operated", session=session, **kwargs
+        )
+        return documents, time.perf_counter() - start
+
+    documents, elapsed = asyncio.run(run())
+    return documents, elapsed, sorted(cancelled), session
+
+
+def test_pipeline_stops_once_evidence_is_sufficient():
+    # each page has 40 sentences: 3 pages bring 120 chunks
+    documents, elapsed, cancelled, session = pipeline(
+        [0.01, 0.02, 0.03, 10, 10], min_pages=3, min_chunks=100, grace=5
+    )
+    assert elapsed < 2
+    assert cancelled == [3, 4]
+    assert len(session) == 120
+    assert len(documents) == 15
+    assert {doc.metadata["source"] for doc in documents} <= {
+        f"https://site{n}.com/page/{n}" for n in range(3)
+    }
+
+
+def test_pipeline_waits_grace_seconds_for_more_evidence():
+    documents, elapsed, cancelled, session = pipeline(
+        [0.01, 0.02, 0.03, 0.1, 10], min_pages=3, min_chunks=1000, grace=0.3
+    )
+    assert 0.3 <= elapsed < 2
+    assert cancelled == [4]
+    assert len(session) == 160
+
+
+def test_pipeline_runs_every_download_without_enough_pages():
+    documents, elapsed, cancelled, session = pipeline(
+        [0.01, 0.2], min_pages=3, min_chunks=10, grace=0
+    )
+    assert cancelled == []
+    assert len(session) == 80
+    assert session.seen_urls == {
+        "https://site0.com/page/0", "https://site1.com/page/1"
+    }
+
+
+def test_pipeline_returns_n_chunks_within_download_limit():
+    documents, elapsed, cancelled, session = pipeline(
+        [0.01, 0.02, 0.03], min_pages=10, top_k=2, n_chunks=60
+    )
+    # top_k bounds the downloads, n_chunks the chunks returned
+    assert cancelled == [] and len(session.seen_urls) == 2
+    assert len(session) == 80 and len(documents) == 60
+
+
+def test_pipeline_leaves_out_boilerplate_of_earlier_batches():
+    banner = "We use cookies to improve your experience on this website."
+
+    async def fake_fetch_site(url, headers, timeout=None):
+        n = int(url.rsplit("/", 1)[1])
+        # one page per batch: the banner is indexed with the first page
+        await asyncio.sleep(0.05 * n)
+        return f"{banner} The subject website opened office {n} in 199{n}."
+
+    async def url_batches():
+        for n in range(4):
+            yield [f"https://site{n}.com/page/{n}"]
+
+    agent = ScraperAgent()
+    agent.fetch_site = fake_fetch_site
+
+    documents = asyncio.run(agent.run_pipeline(
+        url_batches(), "cookies website", min_pages=10,
+        session=RetrievalSession(mode="bm25"),
+    ))
+    assert sorted(doc.page_content for doc in documents) == [
+        f"The subject website opened office {n} in 199{n}." for n in range(4)
+    ]
+
+
+def test_single_flight_cancels_orphaned_executions():
+    async def run(cancel_orphans):
+        flights = SingleFlight(cancel_orphans=cancel_orphans)
+        started = asyncio.Event()
+        execution = []
+
+        async def work():
+            execution.append(asyncio.current_task())
+            started.set()
+            await asyncio.sleep(10)
+
+        callers = [
+            asyncio.create_task(flights.do("key", work)) for _ in range(2)
+        ]
+        await started.wait()
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        still_running = not execution[0].done()
+        callers[1].cancel()
+        await asyncio.sleep(0.01)
+        orphan_cancelled = execution[0].cancelled()
+        execution[0].cancel()
+        return still_running, orphan_cancelled
+
+    assert asyncio.run(run(True)) == (True, True)
+    assert asyncio.run(run(False)) == (True, False)
+
+
+def test_page_stream_boilerplate_independent_of_batches():
+    banner = "We use cookies to improve your experience on this website."
+    facts = [
+        "ACME was founded in 1998.", "ACME has 200 employees.",
+        "ACME is based in Milan.",
+    ]
+    pages = [
+        (f"https://site{n}.com/1", [banner, fact])
+        for n, fact in enumerate(facts)
+    ]
+
+    def run(batches):
+        stream = PageStream(min_pages=3, ratio=0.5)
+        chunks = [
+            chunk for batch in batches for chunk in stream.add(batch)[0]
+        ]
+        boilerplate = stream.boilerplate()
+        return sorted(
+            chunk for chunk in chunks if dedup_key(chunk) not in boilerplate
+        ), stream.counts
+
+    # the banner is known as boilerplate only at the third page, but is
+    # left out whichever batch it came in
+    for batches in (
+        [pages], [pages[:2], pages[2:]], [[page] for page in pages[::-1]]
+    ):
+        assert run(batches) == (sorted(facts), {
+            "sentences": 6, "boilerplate": 3, "duplicates": 0
+        })
@@ -0,0 +1,402 @@
+
+"""
+Record and replay of the upstream services (Azure OpenAI chat and
+embeddings, Serper, web pages) for hermetic end-to-end benchmarks.
+
+RecordingProxy forwards the backend's calls to the real services (or to
+FakeServices) and keeps their responses and latencies; ReplayServices serves
+the saved fixtures offline, with the recorded latencies. Search results are
+rewritten to point to the proxy's /pages/{n}, so recorded pages are served
+by the same local server.
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import struct
+import time
+
+import aiohttp
+from aiohttp import web
+
+from fake_services import FakeServices, fake_embedding
+
+FIXTURES_VERSION = 2
+SERPER_URL = "https://google.serper.dev"
+
+
+def chat_key(body: dict, base_url: str) -> str:
+    """
+    Fixture key of a chat completion: hash of its messages, without the
+    local server's base_url (prompts cite the page URLs, whose port
+    changes at each run).
+    """
+    return hashlib.sha256(json.dumps(
+        body.get("messages", []), sort_keys=True, ensure_ascii=False
+    ).replace(base_url, "").encode("utf-8")).hexdigest()
+
+
+def prompt_kind(body: dict) -> str:
+    """
+    Start of a chat prompt, the same for all the prompts of an agent.
+    """
+    return " ".join(
+        str(m.get("content", "")) for m in body.get("messages", [])
+    )[:40]
+
+
+def text_key(text) -> str:
+    """
+    Fixture key of an embedded text.
+    """
+    return hashlib.sha256(json.dumps(text).encode("utf-8")).hexdigest()
+
+
+def pack_vector(vector: list[float]) -> str:
+    """
+    Encodes an embedding as base64 float16 (a quarter of its JSON size).
+    """
+    return base64.b64encode(
+        struct.pack(f"<{len(vector)}e", *vector)
+    ).decode("ascii")
+
+
+def unpack_vector(data: str) -> list[float]:
+    raw = base64.b64decode(data)
+    return list(struct.unpack(f"<{len(raw) // 2}e", raw))
+
+
+def new_fixtures(requests: list[dict]) -> dict:
+    """
+    Returns empty fixtures for the given /analyze payloads.
+    """
+    return {
+        "version": FIXTURES_VERSION,
+        "requests": requests,
+        "chat": {},
+        "embeddings": {},
+        "embedding_latency": {"calls": 0, "seconds": 0.0},
+        "search": {},
+        "pages": {},
+    }
+
+
+def save_fixtures(path: str, fixtures: dict) -> None:
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(fixtures, f, ensure_ascii=False)
+
+
+def load_fixtures(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        fixtures = json.load(f)
+    if fixtures.get("version") != FIXTURES_VERSION:
+        raise ValueError(
+            f"{path}: fixtures version {fixtures.get('version')}, "
+            f"expected {FIXTURES_VERSION}: record them again"
+        )
+    return fixtures
+
+
+def route_serper(base_url: str) -> None:
+    """
+    Sends the Serper calls of GoogleSerperAPIWrapper to base_url instead of
+    google.serper.dev (the wrapper has no endpoint setting).
+    """
+    from langchain_community.utilities import GoogleSerperAPIWrapper
+
+    async def search_results(self, search_term, search_type="search",
+                             **kwargs):
+        params = {
+            "q": search_term,
+            **{k: v for k, v in kwargs.items() if v is not None},
+        }
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{base_url}/serper/{search_type}", params=params,
+                headers={"X-API-KEY": self.serper_api_key or ""},
+                raise_for_status=True
+            ) as response:
+                return await response.json()
+
+    GoogleSerperAPIWrapper._async_google_serper_search_results = (
+        search_results
+    )
+
+
+class RecordingProxy(FakeServices):
+    """
+    FakeServices routes forwarding each call upstream and recording the
+    response and its latency in fixtures.
+    Attributes:
+        fixtures: Recorded responses (see new_fixtures).
+        azure_endpoint: Azure OpenAI endpoint the chat and embedding calls
+        are forwarded to.
+        azure_key: Azure OpenAI API key.
+        serper_url: Serper API URL.
+        serper_key: Serper API key.
+    """
+
+    def __init__(self, fixtures, azure_endpoint, azure_key,
+                 serper_url=SERPER_URL, serper_key="", port=0):
+        super().__init__(llm_delay=0, port=port)
+        self.fixtures = fixtures
+        self.azure_endpoint = azure_endpoint.rstrip("/")
+        self.azure_key = azure_key
+        self.serper_url = serper_url.rstrip("/")
+        self.serper_key = serper_key
+        self.page_ids = {
+            page["url"]: n for n, page in fixtures["pages"].items()
+        }
+        self._session = None
+        self._downloads = {}
+        self.user_agent = ""
+
+    async def forward(self, method, url, **kwargs):
+        """
+        Sends a request upstream.
+        Returns:
+            tuple: (status, headers, body bytes, seconds).
+        """
+        start = time.perf_counter()
+        async with self._session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            return (response.status, response.headers, body,
+                    time.perf_counter() - start)
+
+    async def chat(self, request):
+        self.calls["chat"] += 1
+        body = await request.json()
+        status, headers, data, seconds = await self.forward(
+            "POST", f"{self.azure_endpoint}{request.path_qs}",
+            json={**body, "stream": False},
+            headers={"api-key": self.azure_key},
+        )
+        if status != 200:
+            return web.Response(
+                body=data, status=status, content_type="application/json",
+                headers={k: v for k, v in headers.items()
+                         if k.lower() == "retry-after"}
+            )
+        answer = json.loads(data)
+        content = answer["choices"][0]["message"]["content"]
+        usage = answer.get("usage", {})
+        self.fixtures["chat"][chat_key(body, self.base_url)] = {
+            "kind": prompt_kind(body), "content": content, "usage": usage,
+            "latency": seconds,
+        }
+        return await self.chat_response(request, body, content, usage)
+
+    async def embeddings(self, request):
+        self.calls["embeddings"] += 1
+        body = await request.json()
+        status, headers, data, seconds = await self.forward(
+            "POST", f"{self.azure_endpoint}{request.path_qs}",
+            json=body, headers={"api-key": self.azure_key},
+        )
+        if status == 200:
+            inputs = body.get("input", [])
+            if not isinstance(inputs, list):
+                inputs = [inputs]
+            for item in json.loads(data)["data"]:
+                self.fixtures["embeddings"][
+                    text_key(inputs[item["index"]])
+                ] = pack_vector(item["embedding"])
+            latency = self.fixtures["embedding_latency"]
+            latency["calls"] += 1
+            latency["seconds"] += seconds
+        return web.Response(
+            body=data, status=status, content_type="application/json"
+        )
+
+    async def search(self, request):
+        self.calls["search"] += 1
+        search_type = request.match_info["search_type"]
+        status, _, data, seconds = await self.forward(
+            "POST", f"{self.serper_url}/{search_type}",
+            params=request.query, headers={"X-API-KEY": self.serper_key},
+        )
+        if status != 200:
+            return web.Response(body=data, status=status)
+        results = json.loads(data)
+        for item in results.get("organic", []):
+            if "link" in item:
+                n = self.page_ids.setdefault(
+                    item["link"], str(len(self.page_ids))
+                )
+                self.fixtures["pages"].setdefault(n, {"url": item["link"]})
+                item["link"] = f"/pages/{n}"
+        self.fixtures["search"][f"{search_type}:{request.query['q']}"] = {
+            "results": results, "latency": seconds,
+        }
+        return web.json_response(local_links(results, self.base_url))
+
+    async def page(self, request):
+        self.calls["pages"] += 1
+        page = self.fixtures["pages"].get(request.match_info["n"])
+        if page is None:
+            return web.Response(status=404)
+        if "html" not in page:
+            # recorded even if the backend cancels the download (early
+            # cutoff): replays with other timings may need the page
+            self.user_agent = request.headers.get("User-Agent", "")
+            task = self._downloads.get(page["url"])
+            if task is None:
+                task = self._downloads[page["url"]] = asyncio.create_task(
+                    self.record_page(page, self.user_agent)
+                )
+            await asyncio.shield(task)
+        return page_response(page)
+
+    async def record_page(self, page: dict, user_agent: str) -> None:
+        try:
+            status, headers, data, seconds = await self.forward(
+                "GET", page["url"], headers={"User-Agent": user_agent},
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status, headers, data, seconds = 502, {}, b"", 0.0
+        page.update({
+            "status": status,
+            "content_type": headers.get("Content-Type", "text/html"),
+            "html": data.decode("utf-8", errors="replace"),
+            "latency": seconds,
+        })
+
+    async def start(self):
+        self._session = aiohttp.ClientSession()
+        return await super().start()
+
+    async def stop(self):
+        await super().stop()
+        # pages found but never requested (early cutoff), for replays that
+        # reach them
+        for page in self.fixtures["pages"].values():
+            if page["url"] not in self._downloads:
+                self._downloads[page["url"]] = asyncio.create_task(
+                    self.record_page(page, self.user_agent)
+                )
+        await asyncio.gather(*self._downloads.values())
+        if self._session:
+            await self._session.close()
+
+
+def local_links(results: dict, base_url: str) -> dict:
+    """
+    Prefixes the recorded /pages/{n} links with base_url.
+    """
+    return {**results, "organic": [
+        {**item, "link": base_url + item["link"]} if "link" in item else item
+        for item in results.get("organic", [])
+    ]}
+
+
+def page_response(page: dict) -> web.Response:
+    return web.Response(
+        text=page["html"], status=page["status"],
+        content_type=page["content_type"].split(";")[0].strip(),
+    )
+
+
+class ReplayServices(FakeServices):
+    """
+    FakeServices routes answering from recorded fixtures, after the
+    recorded latency times latency_scale. Calls missing from the fixtures
+    are counted in misses and answered with a recorded completion of the
+    same agent (the evidence selected by the pipeline depends on timing),
+    by the FakeServices stand-ins (other prompts, embeddings) or with no
+    results (search, pages).
+    Attributes:
+        fixtures: Recorded responses (see load_fixtures).
+        latency_scale: Factor applied to the recorded latencies, 0 to
+        answer at once.
+        misses: Calls missing from the fixtures, by kind.
+    """
+
+    def __init__(self, fixtures, latency_scale=1.0, port=0):
+        super().__init__(llm_delay=0, port=port)
+        self.fixtures = fixtures
+        self.latency_scale = latency_scale
+        self.misses = {"chat": 0, "embeddings": 0, "search": 0, "pages": 0}
+        vectors = fixtures["embeddings"]
+        self.dim = len(unpack_vector(next(iter(vectors.values())))) \
+            if vectors else None
+        self._vectors = {}
+        self._by_kind = {}
+        for recorded in fixtures["chat"].values():
+            self._by_kind.setdefault(recorded["kind"], recorded)
+        latency = fixtures["embedding_latency"]
+        self.embedding_latency = (
+            latency["seconds"] / latency["calls"] if latency["calls"] else 0
+        )
+
+    async def wait(self, seconds: float) -> None:
+        if seconds and self.latency_scale:
+            await asyncio.sleep(seconds * self.latency_scale)
+
+    async def chat(self, request):
+        body = await request.json()
+        key = chat_key(body, self.base_url)
+        recorded = self.fixtures["chat"].get(key)
+        if recorded is None:
+            self.misses["chat"] += 1
+            recorded = self._by_kind.get(prompt_kind(body))
+        if recorded is None:
+            return await super().chat(request)
+        self.calls["chat"] += 1
+        await self.wait(recorded["latency"])
+        return await self.chat_response(
+            request, body, recorded["content"], recorded["usage"]
+        )
+
+    def vector(self, text) -> list[float]:
+        key = text_key(text)
+        vector = self._vectors.get(key)
+        if vector is None:
+            data = self.fixtures["embeddings"].get(key)
+            if data is None:
+                self.misses["embeddings"] += 1
+                fake = fake_embedding(text)
+                dim = self.dim or len(fake)
+                return (fake * (dim // len(fake) + 1))[:dim]
+            vector = self._vectors[key] = unpack_vector(data)
+        return vector
+
+    async def embeddings(self, request):
+        self.calls["embeddings"] += 1
+        body = await request.json()
+        inputs = body.get("input", [])
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+        await self.wait(self.embedding_latency)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "text-embedding"),
+            "data": [
+                {"object": "embedding", "index": i,
+                 "embedding": self.vector(value)}
+                for i, value in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def search(self, request):
+        self.calls["search"] += 1
+        key = f"{request.match_info['search_type']}:{request.query['q']}"
+        recorded = self.fixtures["search"].get(key)
+        if recorded is None:
+            self.misses["search"] += 1
+            return web.json_response({"organic": []})
+        await self.wait(recorded["latency"])
+        return web.json_response(
+            local_links(recorded["results"], self.base_url)
+        )
+
+    async def page(self, request):
+        self.calls["pages"] += 1
+        page = self.fixtures["pages"].get(request.match_info["n"])
+        if page is None or "html" not in page:
+            self.misses["pages"] += 1
+            return web.Response(status=404)
+        await self.wait(page["latency"])
+        return page_response(page)
@@ -0,0 +1,139 @@
+
+"""
+Tests of the upstream resilience layer: rate limits, retries, deadlines and
+circuit breakers.
+
+Run from the repository root:
+    pytest tests/backend/resilience_tests.py
+"""
+import asyncio
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError
+from resilience import DeadlineExceeded, Endpoint, TokenBucket
+from resilience import classify
+
+
+class UpstreamError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.headers = {"retry-after": retry_after} if retry_after else {}
+
+
+class Upstream:
+    """
+    Fails with the given errors, then answers 'ok'.
+    """
+
+    def __init__(self, *errors, delay=0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_classify():
+    assert classify(UpstreamError(429)) == "throttled"
+    assert classify(UpstreamError(503)) == "transient"
+    assert classify(TimeoutError()) == "transient"
+    assert classify(UpstreamError(400)) is None
+    assert classify(ValueError()) is None
+
+
+def test_token_bucket_spaces_calls():
+    async def run():
+        bucket = TokenBucket(per_minute=600, burst=1)  # one every 0.1s
+        start = time.monotonic()
+        await asyncio.gather(*[bucket.acquire() for _ in range(4)])
+        return time.monotonic() - start
+
+    assert 0.28 < asyncio.run(run()) < 0.6
+
+
+def test_token_bucket_deadline():
+    async def run():
+        bucket = TokenBucket(per_minute=60, burst=1)
+        await bucket.acquire()
+        await bucket.acquire(timeout=0.1)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+
+
+def test_retries_throttled_and_transient_errors():
+    upstream = Upstream(UpstreamError(429, "0.05"), UpstreamError(502))
+    endpoint = Endpoint("test", max_attempts=3)
+
+    assert asyncio.run(endpoint.call(upstream)) == "ok"
+    assert upstream.calls == 3
+    assert endpoint.counters["throttled"] == 1
+    assert endpoint.counters["transient"] == 1
+    assert endpoint.counters["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    upstream = Upstream(UpstreamError(400))
+    endpoint = Endpoint("test")
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(endpoint.call(upstream))
+    assert upstream.calls == 1
+    assert endpoint.breaker.state == "closed"
+
+
+def test_deadline_bounds_slow_calls():
+    endpoint = Endpoint("test", timeout=10, deadline=0.2)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(endpoint.call(Upstream(delay=5)))
+    assert time.monotonic() - start < 1
+    assert endpoint.counters["timeouts"] == 1
+
+
+def test_circuit_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    endpoint = Endpoint("test", max_attempts=1, breaker=breaker)
+    upstream = Upstream(UpstreamError(500), UpstreamError(500))
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await endpoint.call(upstream)
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await endpoint.call(upstream)
+        await asyncio.sleep(0.15)
+        return await endpoint.call(upstream)
+
+    assert asyncio.run(run()) == "ok"
+    assert upstream.calls == 3
+    assert breaker.state == "closed"
+    assert endpoint.stats()["rejected"] == 1
+
+
+def test_stream_retries_before_first_item():
+    attempts = []
+
+    async def stream():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise UpstreamError(503)
+        for piece in ("a", "b", "c"):
+            yield piece
+
+    async def run():
+        endpoint = Endpoint("test", max_attempts=2)
+        return [piece async for piece in endpoint.stream(stream)]
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert len(attempts) == 2
@@ -0,0 +1,89 @@
+"""
+Tests of the analysis result cache and of the coalescing of identical
+concurrent analyses (SingleFlight).
+
+Run from the repository root:
+    pytest tests/backend/result_cache_tests.py
+"""
+import asyncio
+
+import httpx
+
+import main
+
+
+def fake_inference(monkeypatch, score=70.0, delay=0.0):
+    """
+    Replaces main.inference with a run taking delay seconds.
+    Returns:
+        The subjects of the runs, appended as they start.
+    """
+    runs = []
+
+    async def inference(request, emit=None, queries=None):
+        runs.append(request.subject)
+        details = f"run {len(runs)}"
+        await asyncio.sleep(delay)
+        return main.AnalysisResponse(trust_score=score, details=details)
+
+    monkeypatch.setattr(main, "inference", inference)
+    return runs
+
+
+def request(subject, context="ctx"):
+    return main.AnalysisRequest(subject=subject, context=context,
+                                language="en")
+
+
+def test_result_cache_hit_and_refresh(monkeypatch):
+    runs = fake_inference(monkeypatch)
+
+    async def run():
+        first = await main.cached_inference(request("Cache hit"))
+        # case and whitespace do not make a new analysis
+        hit = await main.cached_inference(request(" cache  HIT ", "CTX"))
+        refreshed = await main.cached_inference(
+            request("Cache hit"), refresh=True
+        )
+        after = await main.cached_inference(request("Cache hit"))
+        return first, hit, refreshed, after
+
+    first, hit, refreshed, after = asyncio.run(run())
+    assert runs == ["Cache hit", "Cache hit"]
+    assert first.details == hit.details == "run 1"
+    assert refreshed.details == after.details == "run 2"
+
+
+def test_failed_results_not_cached(monkeypatch):
+    runs = fake_inference(monkeypatch, score=0.0)
+
+    async def run():
+        for _ in range(2):
+            await main.cached_inference(request("Cache failure"))
+
+    asyncio.run(run())
+    assert len(runs) == 2
+
+
+def test_identical_concurrent_requests_share_one_run(monkeypatch):
+    runs = fake_inference(monkeypatch, delay=0.1)
+    coalesced = main.result_flights.coalesced
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await asyncio.gather(*[
+                client.post("/analyze", json={
+                    "subject": subject, "context": "ctx", "language": "en"
+                })
+                for subject in ["Flight A"] * 5 + ["Flight B"]
+            ])
+
+    responses = asyncio.run(run())
+    assert sorted(runs) == ["Flight A", "Flight B"]
+    assert main.result_flights.coalesced - coalesced == 4
+    details = [response.json()["details"] for response in responses]
+    assert len(set(details[:5])) == 1 and details[5] != details[0]
+    assert len(main.result_flights) == 0
@@ -0,0 +1,168 @@
+
+"""
+Tests of the hybrid (BM25 + vector) retrieval session.
+
+Run from the repository root:
+    pytest tests/backend/retrieval_tests.py
+"""
+import asyncio
+import zlib
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from retrieval import RetrievalSession
+
+CHUNKS = [
+    "ACME Corporation was founded in 1998 in Milan.",
+    "The weather in Rome was sunny all week.",
+    "ACME reported revenue of 20 million euros.",
+    "Football results of the weekend.",
+]
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Bag-of-words embeddings: texts sharing words are close.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("embedding endpoint down")
+        vector = [0.0] * 64
+        for word in text.lower().split():
+            vector[sum(map(ord, word.strip("."))) % 64] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+
+class RandomEmbeddings(Embeddings):
+    """
+    A fixed random vector for each text, counting the texts embedded.
+    """
+
+    def __init__(self, dim=32):
+        self.dim = dim
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+        return rng.standard_normal(self.dim).tolist()
+
+
+def test_bm25_ranks_exact_terms():
+    index = BM25Index()
+    index.add(CHUNKS)
+    ranked = index.search("ACME founded", 10)
+    assert [i for i, _ in ranked] == [0, 2]
+    assert index.search("unrelated", 10) == []
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+    assert [i for i, _ in fused] == [1, 3, 2]
+
+
+def test_hybrid_session_returns_sources_and_scores():
+    async def run():
+        session = RetrievalSession(FakeEmbeddings(), mode="hybrid")
+        await session.add_texts(CHUNKS, [f"https://s{i}.com" for i in
+                                         range(len(CHUNKS))])
+        return await session.search_documents("ACME founded 1998", 2)
+
+    docs = asyncio.run(run())
+    assert docs[0].page_content == CHUNKS[0]
+    assert docs[0].metadata["source"] == "https://s0.com"
+    assert docs[0].metadata["score"] > docs[1].metadata["score"]
+
+
+def test_falls_back_to_bm25_when_embeddings_fail():
+    embeddings = FakeEmbeddings(fail=True)
+
+    async def run():
+        session = RetrievalSession(embeddings, mode="hybrid")
+        await session.add_texts(CHUNKS)
+        return session, await session.search_documents("ACME revenue", 1)
+
+    session, docs = asyncio.run(run())
+    assert not session.vectors_enabled
+    assert [d.page_content for d in docs] == [CHUNKS[2]]
+    assert embeddings.calls == 1
+
+
+def test_bm25_mode_never_embeds():
+    embeddings = FakeEmbeddings()
+
+    async def run():
+        session = RetrievalSession(embeddings, mode="bm25")
+        await session.add_texts(CHUNKS)
+        return await session.search_documents("weather Rome", 4)
+
+    assert [d.page_content for d in asyncio.run(run())] == [CHUNKS[1]]
+    assert embeddings.calls == 0
+
+
+def test_vector_index_grows_incrementally():
+    embeddings = RandomEmbeddings()
+
+    async def run():
+        session = RetrievalSession(embeddings, index="flat", mode="vector")
+        assert await session.add_texts(CHUNKS[:2]) == 2
+        index = session._index
+        assert await session.add_texts(CHUNKS[1:] + [CHUNKS[0], ""]) == 2
+        # the same index, with only the new chunks embedded and added
+        assert session._index is index and index.ntotal == 4
+        assert embeddings.texts == 4 and len(session) == 4
+        return await session.similarity_search(CHUNKS[3], 1)
+
+    assert asyncio.run(run()) == [CHUNKS[3]]
+
+
+def test_ann_index_switch_matches_flat_search():
+    texts = [f"chunk {n} of the evidence" for n in range(400)]
+    queries = texts[::40]
+
+    async def run(index):
+        session = RetrievalSession(
+            RandomEmbeddings(), index=index, ann_threshold=100, mode="vector"
+        )
+        kinds = []
+        for start in range(0, len(texts), 50):
+            await session.add_texts(texts[start:start + 50])
+            kinds.append(session.index_kind)
+        results = [
+            await session.similarity_search(query, 10) for query in queries
+        ]
+        return kinds, results
+
+    flat_kinds, flat = asyncio.run(run("flat"))
+    assert set(flat_kinds) == {"flat"}
+    for index in ("auto", "ivf"):
+        kinds, results = asyncio.run(run(index))
+        ann = "hnsw" if index == "auto" else "ivf"
+        # exact search up to ann_threshold vectors, then rebuilt as ANN
+        assert kinds == ["flat", "flat"] + [ann] * 6
+        for query, found, exact in zip(queries, results, flat):
+            assert found[0] == exact[0] == query
+        if ann == "hnsw":
+            # IVF probes a few cells only: on these unclustered vectors,
+            # just the nearest neighbour is certain
+            recall = sum(
+                len(set(found) & set(exact))
+                for found, exact in zip(results, flat)
+            ) / sum(len(exact) for exact in flat)
+            assert recall >= 0.9
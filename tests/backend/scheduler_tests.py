@@ -0,0 +1,158 @@
+"""
+Tests of the URL scheduling of the scrape stage: canonical keys, query
+interleaving, per-domain limits and the domains' download history.
+
+Run from the repository root:
+    pytest tests/backend/scheduler_tests.py
+"""
+import asyncio
+
+from cache import normalize_url
+from url_scheduler import (
+    DomainStats, UrlScheduler, domain_of, url_key
+)
+
+
+def drain(scheduler: UrlScheduler) -> list[str]:
+    """
+    Starts and finishes downloads one at a time until none is left.
+    """
+    started = []
+    while (url := scheduler.pop()) is not None:
+        started.append(url)
+        scheduler.done(url)
+    return started
+
+
+def test_url_key_merges_variants():
+    assert normalize_url(
+        "https://a.com/p?utm_source=x&id=2&gclid=1&fbclid=3"
+    ) == "https://a.com/p?id=2"
+    variants = [
+        "https://www.a.com/p/", "http://a.com/p#top",
+        "HTTPS://A.com:443/p?utm_campaign=spring",
+    ]
+    assert {url_key(url) for url in variants} == {"https://a.com/p"}
+    assert url_key("https://a.com/p?id=1") != url_key("https://a.com/p?id=2")
+
+
+def test_domain_of():
+    assert domain_of("https://news.example.com/a") == "example.com"
+    assert domain_of("https://www.bbc.co.uk/news") == "bbc.co.uk"
+    assert domain_of("https://example.it") == "example.it"
+    assert domain_of("http://127.0.0.1:8080/pages/1") == "127.0.0.1"
+
+
+def test_queries_interleaved_and_duplicates_skipped():
+    scheduler = UrlScheduler(5, history=DomainStats())
+    scheduler.add(["https://a.com/1", "https://b.com/1", "https://c.com/1"])
+    scheduler.add(["https://www.a.com/1/", "https://d.com/1",
+                   "https://e.com/1"])
+    scheduler.close()
+    assert drain(scheduler) == [
+        "https://a.com/1", "https://b.com/1", "https://d.com/1",
+        "https://c.com/1", "https://e.com/1",
+    ]
+    assert scheduler.counters["duplicates"] == 1
+    assert scheduler.exhausted()
+
+
+def test_seen_urls_skipped_and_updated():
+    seen = {"https://a.com/1"}
+    scheduler = UrlScheduler(5, seen=seen, history=DomainStats())
+    scheduler.add(["http://www.a.com/1?utm_source=feed", "https://b.com/1"])
+    scheduler.close()
+    assert drain(scheduler) == ["https://b.com/1"]
+    assert seen == {"https://a.com/1", "https://b.com/1"}
+
+
+def test_domain_quota_and_concurrency():
+    scheduler = UrlScheduler(10, history=DomainStats())
+    scheduler.domain_quota, scheduler.domain_concurrency = 3, 2
+    scheduler.add([f"https://big.com/{n}" for n in range(6)]
+                  + ["https://other.com/1"])
+    scheduler.close()
+    first, second = scheduler.pop(), scheduler.pop()
+    # big.com has two downloads running: other.com goes first
+    assert scheduler.pop() == "https://other.com/1"
+    assert scheduler.pop() is None
+    scheduler.done(first)
+    assert scheduler.pop() == "https://big.com/2"
+    scheduler.done(second)
+    assert scheduler.pop() is None
+    assert scheduler.counters["over_quota"] == 3
+    assert scheduler.counters["started"] == 4
+
+
+def test_fair_share_until_every_query_arrived():
+    scheduler = UrlScheduler(4, n_queries=2, history=DomainStats())
+    scheduler.add([f"https://q{n}.com/1" for n in range(4)])
+    assert len(drain(scheduler)) == 2
+    scheduler.add([f"https://r{n}.com/1" for n in range(4)])
+    assert drain(scheduler) == ["https://r0.com/1", "https://r1.com/1"]
+    assert scheduler.exhausted()
+
+
+def test_slow_and_failing_domains_pushed_back():
+    history = DomainStats(slow_seconds=1, failure_penalty=5)
+    for _ in range(3):
+        history.record("slow.com", 4)
+        history.record("broken.com", 0.1, failed=True)
+    history.record_cancelled("fast.com", 0.5)
+    assert history.penalty("fast.com") == 0.5
+    # a cancelled download faster than the average changes nothing
+    history.record_cancelled("slow.com", 0.1)
+    assert history.penalty("slow.com") == 4
+    assert list(history.stats(2)["slowest"]) == ["broken.com", "slow.com"]
+
+    scheduler = UrlScheduler(3, history=history)
+    scheduler.add(["https://slow.com/1", "https://broken.com/1",
+                   "https://fast.com/1", "https://new.com/1"])
+    scheduler.close()
+    # scores: rank + penalty, i.e. slow 4, broken 6, fast 2.5 and new 3
+    assert drain(scheduler) == [
+        "https://fast.com/1", "https://new.com/1", "https://slow.com/1"
+    ]
+
+
+def test_history_bounded():
+    history = DomainStats(max_domains=2)
+    for domain in ("a.com", "b.com", "c.com"):
+        history.record(domain, 1)
+    assert history.stats()["domains"] == 2
+    assert history.penalty("a.com") == 0
+
+
+def test_run_follows_added_links_and_propagates_errors():
+    async def run():
+        scheduler = UrlScheduler(10, history=DomainStats())
+        fetched = []
+
+        async def fetch(url):
+            await asyncio.sleep(0.01)
+            fetched.append(url)
+
+        async def producer():
+            scheduler.add(["https://a.com/1", "https://b.com/1"])
+            await asyncio.sleep(0.05)
+            scheduler.add(["https://c.com/1"])
+            scheduler.close()
+
+        await asyncio.gather(scheduler.run(fetch, 1), producer())
+        assert fetched == ["https://a.com/1", "https://b.com/1",
+                           "https://c.com/1"]
+
+        failing = UrlScheduler(10, history=DomainStats())
+        failing.add(["https://a.com/1", "https://b.com/1"])
+        failing.close()
+
+        async def fail(url):
+            raise ValueError(url)
+
+        try:
+            await failing.run(fail, 2)
+        except ValueError:
+            return True
+        return False
+
+    assert asyncio.run(run())
@@ -0,0 +1,110 @@
+"""
+Tests of the SearchAgent query fan-out: concurrency bound, per-query
+timeouts and partial results when some queries fail.
+
+Run from the repository root:
+    pytest tests/backend/search_tests.py
+"""
+import asyncio
+import time
+
+import pytest
+
+import agents.search as search
+import http_client
+from agents.search import SearchAgent
+from resilience import Endpoint
+
+
+class FakeSerper:
+    """
+    Serper wrapper answering each query after 0.05 s, with one link per
+    query. Queries starting with 'slow' hang, 'broken' ones fail and
+    'empty' ones find nothing. Tracks the calls running at once.
+    """
+
+    aiosession = None
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    async def aresults(self, query):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(30 if query.startswith("slow") else 0.05)
+            if query.startswith("broken"):
+                raise ValueError("malformed response")
+            if query.startswith("empty"):
+                return {"organic": []}
+            return {"organic": [
+                {"link": f"https://{query}.com"}, {"title": "no link"}
+            ]}
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    # no retries, and a circuit breaker of its own
+    monkeypatch.setattr(search, "search_endpoint", Endpoint(
+        "search", timeout=0.3, deadline=1.0, max_attempts=1
+    ))
+    agent = SearchAgent()
+    agent.google_search = FakeSerper()
+    return agent
+
+
+def run_timed(coro):
+    async def run():
+        start = time.perf_counter()
+        try:
+            return await coro, time.perf_counter() - start
+        finally:
+            await http_client.close_session()
+
+    return asyncio.run(run())
+
+
+def test_queries_fan_out_within_concurrency_bound(agent):
+    queries = [f"q{n}" for n in range(6)]
+    results, elapsed = run_timed(agent.run_queries(queries, n_jobs=3))
+    assert results == [[f"https://q{n}.com"] for n in range(6)]
+    assert agent.google_search.max_running == 3
+    # two rounds of three concurrent queries, not six in a row
+    assert elapsed < 0.25
+
+
+def test_slow_and_failed_queries_leave_partial_results(agent):
+    queries = ["q0", "slow1", "broken2", "empty3", "q4"]
+    results, elapsed = run_timed(agent.run_queries(queries))
+    assert results == [["https://q0.com"], ["https://q4.com"]]
+    # the hanging query is dropped at the endpoint timeout
+    assert elapsed < 1.0
+
+
+def test_search_timeout_per_query(agent):
+    async def run():
+        semaphore = asyncio.Semaphore(2)
+        return await asyncio.gather(
+            agent.search("slow", semaphore, timeout=0.1),
+            agent.search("q1", semaphore, timeout=0.1),
+        )
+
+    (slow, fast), elapsed = run_timed(run())
+    assert slow == [] and fast == ["https://q1.com"]
+    assert elapsed < 0.25
+
+
+def test_stream_queries_skips_failed_queries(agent):
+    async def run():
+        return [
+            links async for links in agent.stream_queries(
+                ["broken0", "q1", "slow2", "empty3"], n_jobs=4
+            )
+        ]
+
+    results, elapsed = run_timed(run())
+    assert results == [["https://q1.com"]]
+    assert elapsed < 1.0
@@ -0,0 +1,210 @@
+
+"""
+Tests of the shared state stores (memory, SQLite, Redis protocol against
+FakeRedis) and of the caches built on them.
+
+Run from the repository root:
+    pytest tests/backend/state_tests.py
+"""
+import asyncio
+import os
+import sqlite3
+import time
+
+import pytest
+
+from fake_services import CountingEmbeddings, FakeRedis
+
+from cache import TieredCache
+from embedding_cache import CachedEmbeddings
+from embedding_cache import KeyValueVectorStore
+from process_local import ProcessLocal
+from state import MemoryStore, RateLimiter, RedisStore
+from state import SQLiteStore
+
+
+@pytest.fixture(scope="module")
+def redis_server():
+    server = FakeRedis().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path, redis_server):
+    """
+    Returns a factory of stores of one backend. Stores created by the same
+    factory share their data, like the workers of one deployment.
+    """
+    redis_server.data.clear()
+    memory = MemoryStore()
+
+    def make():
+        if request.param == "memory":
+            return memory
+        if request.param == "sqlite":
+            return SQLiteStore(str(tmp_path / "state.sqlite3"))
+        return RedisStore(redis_server.url, "test")
+
+    return make
+
+
+def test_get_set_delete(make_store):
+    store = make_store()
+    assert store.get("missing") is None
+    store.set("a", b"\x00binary\xff")
+    store.set_many({"b": b"2", "c": b"3"})
+    assert store.get("a") == b"\x00binary\xff"
+    assert store.get_many(["c", "missing", "b"]) == [b"3", None, b"2"]
+    store.delete("a")
+    assert store.get("a") is None
+
+
+def test_ttl_expires(make_store):
+    store = make_store()
+    store.set("short", b"x", ttl=0.05)
+    store.set("long", b"y", ttl=60)
+    time.sleep(0.1)
+    assert store.get("short") is None
+    assert store.get("long") == b"y"
+
+
+def test_counters(make_store):
+    store = make_store()
+    assert store.incr("hits") == 1
+    assert store.incr("hits", 4) == 5
+    store.incr("window", ttl=0.05)
+    time.sleep(0.1)
+    assert store.incr("window", ttl=0.05) == 1
+
+
+def test_memory_store_purges_expired_windows():
+    store = MemoryStore(purge_interval=0)
+    limiter = RateLimiter(store, limit=3, window=0.05)
+    for n in range(100):
+        limiter.hit(f"client{n}")
+    time.sleep(0.1)
+    limiter.hit("client0")
+    assert len(store) == 1 and store.size == 1
+
+
+def test_sqlite_store_size_total_and_timed_purge(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    worker_a = SQLiteStore(path, max_bytes=10)
+    worker_b = SQLiteStore(path, max_bytes=10)
+    worker_a.set("a", b"1234")
+    worker_b.set("a", b"12")  # replaced, counted once
+    worker_b.set("b", b"1234", ttl=0.05)
+    worker_a.delete("a")
+    assert worker_a.size == worker_b.size == 4
+
+    time.sleep(0.1)
+    worker_b.set("c", b"1")
+    # expired, but kept until the next purge
+    assert len(worker_b) == 2 and worker_b.size == 5
+    worker_b.purge_interval = 0
+    worker_b.set("d", b"1")
+    assert len(worker_b) == 2 and worker_b.size == 2
+
+    # over the cap, the least recently used item goes
+    worker_a.set("e", b"123456789")
+    assert worker_a.get_many(["c", "d", "e"]) == [None, b"1", b"123456789"]
+    with sqlite3.connect(path) as conn:
+        total = conn.execute("SELECT SUM(size) FROM cache").fetchone()[0]
+    assert total == worker_a.size == 10
+
+
+def test_redis_store_counts_its_namespace(redis_server):
+    redis_server.data.clear()
+    pages = RedisStore(redis_server.url, "pages")
+    results = RedisStore(redis_server.url, "results")
+    pages.set_many({f"url{n}": b"text" for n in range(2500)})
+    results.set("analysis", b"{}")
+    assert len(pages) == 2500 and len(results) == 1
+
+
+def test_shared_between_workers(make_store):
+    worker_a, worker_b = make_store(), make_store()
+    worker_a.set("page", b"text")
+    worker_a.incr("requests")
+    assert worker_b.get("page") == b"text"
+    assert worker_b.incr("requests") == 2
+
+
+def test_rate_limiter_across_workers(make_store):
+    limiters = [RateLimiter(make_store(), limit=3) for _ in range(2)]
+    hits = [limiters[i % 2].hit("client") for i in range(5)]
+    assert hits == [True, True, True, False, False]
+
+
+def in_child(fn) -> int:
+    """
+    Runs fn() in a forked process, like a worker forked by a preloading
+    gunicorn master. Returns the exit status: 0 if fn returned True.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if fn() else 1)
+        except BaseException:
+            os._exit(2)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+def test_process_local_is_recreated_after_fork():
+    local = ProcessLocal(lambda: object())
+    parent = local.get()
+    assert local.get() is parent
+    assert in_child(lambda: local.get() is not parent) == 0
+    assert local.get() is parent
+
+
+def test_store_used_across_fork(make_store):
+    store = make_store()
+    if store.backend == "memory":
+        pytest.skip("per-process store")
+    # the parent's connection is open when the worker is forked
+    store.set("parent", b"1")
+
+    def worker():
+        store.set("child", b"2")
+        return store.get("parent") == b"1" and store.incr("forks") == 1
+
+    assert in_child(worker) == 0
+    assert store.get_many(["parent", "child"]) == [b"1", b"2"]
+    assert store.incr("forks") == 2
+
+
+def test_tiered_cache_survives_worker_restart(make_store):
+    async def run():
+        first = TieredCache("pages", 1024, ttl=60, shared=make_store())
+        await first.set("url", "page text")
+        # a recycled worker starts with an empty memory tier
+        second = TieredCache("pages", 1024, ttl=60, shared=make_store())
+        return await second.get("url"), second.stats()
+
+    value, stats = asyncio.run(run())
+    assert value == "page text"
+    assert stats["shared_hits"] == 1
+
+
+def test_embeddings_shared_through_redis(redis_server):
+    upstream = CountingEmbeddings()
+    texts = ["first chunk", "second chunk"]
+
+    async def run():
+        workers = [
+            CachedEmbeddings(upstream, store=KeyValueVectorStore(
+                RedisStore(redis_server.url, "embeddings")
+            ))
+            for _ in range(2)
+        ]
+        first = await workers[0].aembed_documents(texts)
+        second = await workers[1].aembed_documents(texts)
+        return first, second, workers[1].stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == second == [[11.0, 1.0], [12.0, 1.0]]
+    assert upstream.calls == 1
+    assert stats["shared_hits"] == 2
+
@@ -0,0 +1,100 @@
+"""
+Tests of the Server-Sent Events endpoint: order of the stage events and
+cancellation of the analysis when the client goes away.
+
+Run from the repository root:
+    pytest tests/backend/stream_tests.py
+"""
+import asyncio
+import json
+
+import httpx
+
+from fake_services import patch_agents
+
+import main
+
+REQUEST = {
+    "subject": "Stream subject", "context": "the subject operated",
+    "language": "en",
+}
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_events_in_stage_order(monkeypatch):
+    async def score(on_token):
+        for token in ("Consistent ", "sources."):
+            await on_token(token)
+        return 75.0, "Consistent sources."
+
+    patch_agents(monkeypatch, [
+        {"whys": ["founding date unclear"], "suggested_retry": "founded"},
+        "OK",
+    ], score)
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/analyze/stream", params={"refresh": "true"}, json=REQUEST
+            )
+        return response
+
+    response = asyncio.run(run())
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    names = [name for name, _ in events]
+
+    # each attempt: queries, then urls and pages, evidence, verification
+    stages = [name for name in names if name not in ("urls", "page")]
+    assert stages == [
+        "queries", "evidence", "verification",
+        "queries", "evidence", "verification",
+        "score_token", "score_token", "result",
+    ]
+    retry = names.index("verification") + 1
+    for start, end in ((0, retry), (retry, names.index("score_token"))):
+        attempt = names[start:end]
+        assert attempt.index("urls") < attempt.index("page")
+        assert attempt.index("page") < attempt.index("evidence")
+    assert [data["attempt"] for name, data in events
+            if name == "verification"] == [0, 1]
+    assert events[retry][1]["queries"] == ['"Stream subject" founded']
+    assert "".join(data["text"] for name, data in events
+                   if name == "score_token") == "Consistent sources."
+    assert events[-1][1]["trust_score"] == 75.0
+
+
+def test_stream_closed_cancels_analysis(monkeypatch):
+    cancelled = asyncio.Event()
+
+    async def inference(request, emit=None, queries=None):
+        await emit("queries", {"attempt": 0, "queries": ["q"]})
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    monkeypatch.setattr(main, "inference", inference)
+
+    async def run():
+        events = main.analysis_events(
+            main.AnalysisRequest(**REQUEST), refresh=True
+        )
+        first = await anext(events)
+        # what StreamingResponse does when the client disconnects
+        await events.aclose()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        return first
+
+    assert asyncio.run(run()).startswith("event: queries\n")